@@ -1,3 +1,9 @@
+from ._cache import *
 from ._core import *
+from ._jit import *
+from ._merge import *
+from ._output import *
 from ._postprocessor import *
+from ._profiling import *
+from ._server import *
 from ._ui import *
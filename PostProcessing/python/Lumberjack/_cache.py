@@ -0,0 +1,129 @@
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import ROOT
+import uuid
+
+import numpy as np
+
+from .._util import make_directory
+
+
+__all__ = ['ResultCache', 'get_hash']
+
+
+def _json_default(obj):
+    '''convert objects not supported by `json` to a serializable representation'''
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return repr(obj)
+
+
+def get_hash(obj):
+    '''compute a stable hash of a (nested) structure of dicts, lists and scalars'''
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=_json_default).encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """Persistent on-disk cache for objects produced by Lumberjack.
+
+    The cache is organized in two levels. The *context* contains everything which
+    affects all objects produced from a data frame (input files, tree name,
+    selections, expressions of defined columns, etc.). Each context has its own
+    subdirectory in the cache directory, named after the context hash.
+
+    Inside the context directory, each object is stored under a key computed from
+    its own specification (splitting cuts, quantities, binnings, weight, etc.).
+    Objects produced by one run are stored in a separate ROOT file, so that several
+    processes can write to the same cache at the same time.
+
+    Cache files are only opened when an object is requested from them and at most
+    one file is kept open at a time, so the number of open files and the memory
+    held by objects read from them do not grow with the number of files in the cache.
+    """
+
+    def __init__(self, cache_dir, context):
+        self._context_hash = get_hash(context)
+        self._context_dir = os.path.join(cache_dir, self._context_hash)
+
+        self._key_to_file = {}
+        self._open_file_path = None
+        self._open_file = None
+
+        # build an index of all objects in the cache
+        if os.path.isdir(self._context_dir):
+            for _filename in sorted(os.listdir(self._context_dir)):
+                if not _filename.endswith('.root'):
+                    continue
+                _file_path = os.path.join(self._context_dir, _filename)
+                _tfile = ROOT.TFile(_file_path, "READ")
+                if not _tfile:
+                    continue
+                for _key in _tfile.GetListOfKeys():
+                    self._key_to_file[_key.GetName()] = _file_path
+                _tfile.Close()
+
+        print("[INFO] Result cache: found {} object(s) for context '{}'".format(len(self._key_to_file), self._context_hash))
+
+    def _open(self, file_path):
+        '''open a cache file for reading, closing the one opened previously'''
+        if self._open_file_path != file_path:
+            self.close()
+            self._open_file = ROOT.TFile(file_path, "READ")
+            self._open_file_path = file_path
+        return self._open_file
+
+    @staticmethod
+    def get_key(**object_spec):
+        '''compute the key under which an object is stored'''
+        return "obj_" + get_hash(object_spec)
+
+    def get(self, key):
+        '''retrieve a copy of the object stored under `key`, or `None` if not in the cache'''
+        _file_path = self._key_to_file.get(key, None)
+        if _file_path is None:
+            return None
+
+        _obj = self._open(_file_path).Get(key)
+        if not _obj:
+            return None
+
+        _obj = _obj.Clone()
+        try:
+            _obj.SetDirectory(0)
+        except AttributeError:
+            pass
+        return _obj
+
+    def store(self, keys_and_objects):
+        '''write objects to a new file in the cache. `keys_and_objects` is an iterable of (key, TObject) pairs.'''
+        keys_and_objects = list(keys_and_objects)
+        if not keys_and_objects:
+            return
+
+        make_directory(self._context_dir, exist_ok=True)
+
+        # write to temporary file first, then move into place
+        _file_path = os.path.join(self._context_dir, "{}.root".format(uuid.uuid4().hex))
+        _tmp_file_path = _file_path + ".tmp"
+
+        _tfile = ROOT.TFile(_tmp_file_path, "RECREATE")
+        for _key, _obj in keys_and_objects:
+            _tfile.WriteTObject(_obj, _key)
+            self._key_to_file[_key] = _file_path
+        _tfile.Close()
+
+        os.rename(_tmp_file_path, _file_path)
+
+        print("[INFO] Result cache: stored {} object(s) in '{}'".format(len(keys_and_objects), _file_path))
+
+    def close(self):
+        '''close the file opened for reading, if any'''
+        if self._open_file:
+            self._open_file.Close()
+        self._open_file_path = None
+        self._open_file = None
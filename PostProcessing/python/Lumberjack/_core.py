@@ -1,23 +1,31 @@
 from __future__ import print_function
 
 import numpy as np
+import re
 
 from collections import OrderedDict
 from copy import deepcopy
 
 
-__all__ = ['Quantity', 'apply_defines', 'apply_filters', 'define_quantities']
+__all__ = ['Quantity', 'apply_defines', 'apply_filters', 'define_quantities', 'get_column_dependencies', 'substitute_columns']
+
+# identifiers in C++ expressions (excluding members and namespace-qualified names)
+_RE_IDENTIFIER = re.compile(r"(?<![\w.:])(?<!->)[A-Za-z_]\w*")
+
+# `return` keyword in C++ expressions which are function bodies
+_RE_RETURN = re.compile(r"\breturn\b")
 
 class Quantity(object):
 
     __slots__ = ('_dict',)
 
-    def __init__(self, name, expression, binning, named_binnings=None):
+    def __init__(self, name, expression, binning, named_binnings=None, master_binning=None):
         self._dict = dict(
             name=name,
             expression=expression,
             binning=binning,
             named_binnings=named_binnings,
+            master_binning=master_binning,
         )
 
     def __repr__(self):
@@ -40,6 +48,11 @@ class Quantity(object):
         """Named binnings defined for this quantity."""
         return self._dict['named_binnings']
 
+    @property
+    def master_binning(self):
+        """Fine binning used for filling objects with `--master-binning` (if defined). Should contain the edges of all binnings requested for this quantity."""
+        return self._dict.get('master_binning', None)
+
     @property
     def expression(self):
         return self._dict['expression']
@@ -88,29 +101,39 @@ class Quantity(object):
         return _nb
 
 
-def apply_defines(data_frame, defines):
-    """Applies all 'Defines' specified in a dictionary to an data frame."""
+def apply_defines(data_frame, defines, profiler=None, category='defines'):
+    """Applies all 'Defines' specified in a dictionary to an data frame.
+    If a `DataFrameProfiler` is given, the Defines are booked via the profiler."""
     _df = data_frame
     for _k, _v in defines.iteritems():
         print("[apply_defines] Defining quantity '{}': {}".format(_k, _v))
         try:
-            _df = _df.Define(_k, _v)
+            if profiler is not None:
+                _df = profiler.define(_df, _k, _v, category=category)
+            else:
+                _df = _df.Define(_k, _v)
         except Exception as _e:
             print("[apply_defines] WARNING: Error defining quantity '{}': {}".format(_k, _e))
 
     return _df
 
 
-def apply_filters(data_frame, filters):
-    """Applies all 'Filters' specified in a list to an data frame."""
+def apply_filters(data_frame, filters, profiler=None, category='selections', name=None):
+    """Applies all 'Filters' specified in a list to an data frame.
+    If a `DataFrameProfiler` is given, the Filters are booked via the profiler
+    and named (using `name` as a prefix, if given), so they appear in the cut-flow report."""
     _df = data_frame
-    for _filter_expr in filters:
-        _df = _df.Filter(_filter_expr)
+    for _i_filter, _filter_expr in enumerate(filters):
+        if profiler is not None:
+            _filter_name = "{}[{}]: {}".format(name, _i_filter, _filter_expr) if name is not None else _filter_expr
+            _df = profiler.filter(_df, _filter_expr, category=category, name=_filter_name)
+        else:
+            _df = _df.Filter(_filter_expr)
 
     return _df
 
 
-def define_quantities(data_frame, quantities):
+def define_quantities(data_frame, quantities, profiler=None):
     """Define aliases for quantity expressions as specified in dictionary `quantities`."""
     _define_dict = OrderedDict()  # map of quantities by unique name
     for _q_key, _q in quantities.iteritems():
@@ -126,6 +149,26 @@ def define_quantities(data_frame, quantities):
 
         _define_dict[_q.name] = _q.expression
 
-    _df = apply_defines(data_frame, _define_dict)
+    _df = apply_defines(data_frame, _define_dict, profiler=profiler, category='quantities')
 
     return _df
+
+
+def get_column_dependencies(expression, column_expressions):
+    """Names of all columns in `column_expressions` (a dictionary mapping column names to their expressions)
+    on which `expression` depends, directly or via other columns."""
+    _dependencies = set()
+    _expressions_to_check = [expression]
+    while _expressions_to_check:
+        for _identifier in _RE_IDENTIFIER.findall(_expressions_to_check.pop()):
+            if _identifier in column_expressions and _identifier not in _dependencies:
+                _dependencies.add(_identifier)
+                _expressions_to_check.append(column_expressions[_identifier])
+
+    return _dependencies
+
+
+def substitute_columns(expression, substitutions):
+    """Replace the names of columns in `expression` according to `substitutions` (a dictionary
+    mapping column names to the names of the columns to use instead)."""
+    return _RE_IDENTIFIER.sub(lambda _match: substitutions.get(_match.group(0), _match.group(0)), expression)
@@ -0,0 +1,219 @@
+from __future__ import print_function
+
+import fcntl
+import os
+import re
+import ROOT
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .._util import make_directory
+from ._cache import get_hash
+from ._core import _RE_IDENTIFIER, _RE_RETURN
+
+
+__all__ = ['CompiledExpressionCache']
+
+
+# special columns provided by RDataFrame
+_SPECIAL_COLUMN_TYPES = {
+    'rdfentry_': 'ULong64_t',
+    'rdfslot_': 'unsigned int',
+}
+
+
+@contextmanager
+def _file_lock(lock_path):
+    '''hold an exclusive lock on the file `lock_path` (created if needed), shared across processes'''
+    with open(lock_path, 'a') as _lock_file:
+        fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(_lock_file, fcntl.LOCK_UN)
+
+
+class CompiledExpressionCache(object):
+    """Compiles the expressions of columns and filters into a shared library, cached by content hash.
+
+    For every column expression, a function taking the columns used in the expression as
+    arguments is generated. The argument types are the types of the input branches or,
+    for columns which are themselves defined via an expression, the return types of the
+    corresponding functions. All functions are placed in one C++ translation unit, which is
+    compiled using ACLiC and stored in the cache directory. Later runs with identical
+    expressions, macros and input branch types find the library in the cache and load it
+    directly.
+
+    The data frame is then set up using short expressions calling the compiled functions,
+    so that the interpreter does not need to compile the full expressions at every startup.
+
+    Several processes may use the same cache directory at the same time (e.g. with `--processes`):
+    a library is only looked up and compiled while holding a lock file, so that it is compiled
+    once and never loaded while it is still being written.
+    """
+
+    def __init__(self, cache_dir):
+        self._cache_dir = os.path.abspath(cache_dir)
+        self._macros_header = None
+        self._library_path = None
+
+    def get_macros_header(self, root_macros):
+        '''write `root_macros` to a header file (with include guard) in the cache directory and return its path'''
+        _macros_hash = get_hash(root_macros)
+        _header_path = os.path.join(self._cache_dir, "macros_{}.h".format(_macros_hash))
+        if not os.path.exists(_header_path):
+            make_directory(self._cache_dir, exist_ok=True)
+            _tmp_header_path = _header_path + ".tmp{}".format(os.getpid())
+            with open(_tmp_header_path, 'w') as _f:
+                _f.write("#ifndef KARMA_LUMBERJACK_MACROS_{0}\n#define KARMA_LUMBERJACK_MACROS_{0}\n".format(_macros_hash))
+                _f.write(root_macros)
+                _f.write("\n#endif\n")
+            os.rename(_tmp_header_path, _header_path)
+        self._macros_header = _header_path
+        return _header_path
+
+    @staticmethod
+    def _get_arguments(expression, available_columns, column_name=None):
+        '''columns used in `expression`, in order of first appearance'''
+        _arguments = []
+        for _identifier in _RE_IDENTIFIER.findall(expression):
+            if _identifier == column_name or _identifier in _arguments:
+                continue
+            if _identifier in available_columns or _identifier in _SPECIAL_COLUMN_TYPES:
+                _arguments.append(_identifier)
+        return _arguments
+
+    @staticmethod
+    def _get_function_body(expression):
+        '''expressions containing `return` are function bodies'''
+        if _RE_RETURN.search(expression):
+            return expression
+        return "return ({});".format(expression)
+
+    def compile(self, data_frame, column_expressions, filter_expressions, context=None):
+        """Compile the expressions into a shared library (or find it in the cache).
+
+        `column_expressions` is an ordered dictionary mapping column names to their
+        expressions, in the order in which the columns are defined. `filter_expressions`
+        is a list of filter expressions. `context` may contain any other information
+        affecting compilation (e.g. include paths).
+
+        Returns a tuple `(columns, filters)` of dictionaries mapping the column names and
+        filter expressions to expressions calling the compiled functions, or `None` if
+        compilation failed.
+        """
+
+        _branch_names = set([str(_c) for _c in data_frame.GetColumnNames()])
+
+        # -- determine function signatures
+        _column_types = dict(_SPECIAL_COLUMN_TYPES)
+        _functions = []  # tuples (function name, argument names, argument types, body)
+        _column_functions = OrderedDict()
+        _available_columns = set(_branch_names)
+
+        def _get_argument_types(arguments):
+            for _argument in arguments:
+                if _argument not in _column_types:
+                    _column_types[_argument] = str(data_frame.GetColumnType(_argument))
+            return [_column_types[_argument] for _argument in arguments]
+
+        # namespace name is only known after hashing, use a placeholder in the meantime
+        _ns_placeholder = "@NAMESPACE@"
+
+        for _i_column, (_column_name, _expression) in enumerate(column_expressions.iteritems()):
+            _arguments = self._get_arguments(_expression, _available_columns, column_name=_column_name)
+            _argument_types = _get_argument_types(_arguments)
+            _function_name = "define_{}_{}".format(_i_column, re.sub(r'\W', '_', _column_name))
+            _functions.append((_function_name, _arguments, _argument_types, self._get_function_body(_expression)))
+            _column_functions[_column_name] = (_function_name, _arguments)
+
+            # return type of the generated function
+            _column_types[_column_name] = "std::decay<decltype({}::{}({}))>::type".format(
+                _ns_placeholder, _function_name,
+                ", ".join(["std::declval<const {}&>()".format(_t) for _t in _argument_types]))
+            _available_columns.add(_column_name)
+
+        _filter_functions = OrderedDict()
+        for _i_filter, _expression in enumerate(filter_expressions):
+            if _expression in _filter_functions:
+                continue
+            _arguments = self._get_arguments(_expression, _available_columns)
+            _argument_types = _get_argument_types(_arguments)
+            _function_name = "filter_{}".format(_i_filter)
+            _functions.append((_function_name, _arguments, _argument_types, self._get_function_body(_expression)))
+            _filter_functions[_expression] = (_function_name, _arguments)
+
+        # -- library is identified by the content of the generated code
+        _hash = get_hash(dict(
+            root_version=ROOT.gROOT.GetVersion(),
+            macros_header=self._macros_header,
+            functions=_functions,
+            context=context,
+        ))
+        _namespace = "karma_lumberjack_jit_{}".format(_hash[:16])
+        _source_path = os.path.join(self._cache_dir, "{}.cxx".format(_namespace))
+        _library_path = os.path.join(self._cache_dir, "{}_cxx.{}".format(_namespace, ROOT.gSystem.GetSoExt()))
+
+        make_directory(self._cache_dir, exist_ok=True)
+        with _file_lock(os.path.join(self._cache_dir, "{}.lock".format(_namespace))):
+            if os.path.exists(_library_path):
+                print("[INFO] Found compiled expressions in cache: {}".format(_library_path))
+            else:
+                print("[INFO] Compiling {} expression(s) into shared library (this is only done once)...".format(len(_functions)))
+                _tmp_source_path = _source_path + ".tmp{}".format(os.getpid())
+                with open(_tmp_source_path, 'w') as _f:
+                    _f.write(self._get_source(_namespace, _functions).replace(_ns_placeholder, _namespace))
+                os.rename(_tmp_source_path, _source_path)
+
+                if not ROOT.gSystem.CompileMacro(_source_path, "kO"):
+                    print("[WARNING] Compilation of expressions failed: falling back to just-in-time compilation")
+                    # do not leave an incomplete library in the cache
+                    if os.path.exists(_library_path):
+                        os.remove(_library_path)
+                    return None
+
+                if not os.path.exists(_library_path):
+                    print("[WARNING] Compiled library not found: falling back to just-in-time compilation")
+                    return None
+
+        self._library_path = _library_path
+
+        # -- expressions calling the compiled functions
+        def _call(function_name, arguments):
+            return "{}::{}({})".format(_namespace, function_name, ", ".join(arguments))
+
+        _columns = {_column_name: _call(*_spec) for _column_name, _spec in _column_functions.iteritems()}
+        _filters = {_expression: _call(*_spec) for _expression, _spec in _filter_functions.iteritems()}
+
+        return _columns, _filters
+
+    @property
+    def library_path(self):
+        '''path to the compiled library (available after `compile`)'''
+        return self._library_path
+
+    def _get_source(self, namespace, functions):
+        '''C++ source code for the compiled expressions'''
+        _lines = [
+            "// generated by Lumberjack -- do not edit",
+            "#include <type_traits>",
+            "#include <utility>",
+            "#include <ROOT/RVec.hxx>",
+            "#include <TMath.h>",
+            "#include <Math/Vector4D.h>",
+            "using namespace ROOT::VecOps;",
+        ]
+        if self._macros_header is not None:
+            _lines.append('#include "{}"'.format(self._macros_header))
+
+        _lines.append("namespace {} {{".format(namespace))
+        for _function_name, _arguments, _argument_types, _body in functions:
+            _lines.append("auto {}({}) {{ {} }}".format(
+                _function_name,
+                ", ".join(["const {}& {}".format(_t, _a) for _t, _a in zip(_argument_types, _arguments)]),
+                _body,
+            ))
+        _lines.append("}}  // namespace {}".format(namespace))
+
+        return "\n".join(_lines) + "\n"
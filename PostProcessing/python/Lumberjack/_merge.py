@@ -0,0 +1,99 @@
+from __future__ import print_function
+
+import ROOT
+
+from collections import OrderedDict
+
+from ._output import open_output_file
+
+
+__all__ = ['merge_root_files']
+
+
+def _read_object(tdirectory, key_name):
+    '''read an object from a directory without attaching it to the directory'''
+    _tkey = tdirectory.GetKey(key_name)
+    if not _tkey:
+        return None
+    _obj = _tkey.ReadObj()
+    # Python takes ownership, so that the object is deleted once it is no longer needed
+    if not isinstance(_obj, ROOT.TDirectory):
+        ROOT.SetOwnership(_obj, True)
+    return _obj
+
+
+def _merge_directories(input_directories, output_directory):
+    '''merge the contents of several ROOT directories into `output_directory`, one object at a time'''
+
+    # collect key names from all inputs (order of first appearance)
+    _key_names = OrderedDict()
+    for _tdirectory in input_directories:
+        for _tkey in _tdirectory.GetListOfKeys():
+            _key_names.setdefault(_tkey.GetName(), _tkey.GetClassName())
+
+    for _key_name, _class_name in _key_names.iteritems():
+        _tclass = ROOT.TClass.GetClass(_class_name)
+
+        # -- subdirectories: create in output and recurse
+        if _tclass.InheritsFrom(ROOT.TDirectory.Class()):
+            _input_subdirectories = [
+                _tdirectory.GetDirectory(_key_name)
+                for _tdirectory in input_directories
+                if _tdirectory.GetKey(_key_name)
+            ]
+            _output_subdirectory = output_directory.mkdir(_key_name)
+            _merge_directories(_input_subdirectories, _output_subdirectory)
+
+            # release the memory held by the input subdirectories before moving on
+            for _input_subdirectory in _input_subdirectories:
+                _input_subdirectory.Close()
+            continue
+
+        # -- other objects: add histograms, profiles and sparse histograms, keep first instance of everything else
+        # (objects in disjoint splitting slices exist in only one input and are simply copied)
+        _merged_obj = None
+        for _tdirectory in input_directories:
+            _obj = _read_object(_tdirectory, _key_name)
+            if _obj is None:
+                continue
+            if _merged_obj is None:
+                _merged_obj = _obj
+            elif isinstance(_merged_obj, (ROOT.TH1, ROOT.THnBase)):
+                _merged_obj.Add(_obj)
+            elif isinstance(_merged_obj, ROOT.TNamed) and _merged_obj.GetTitle() == _obj.GetTitle():
+                # identical tags (e.g. the sample fraction)
+                continue
+            else:
+                print("[WARNING] Cannot merge object '{}/{}' of type '{}': keeping first instance".format(
+                    output_directory.GetPath(), _key_name, _class_name))
+                break
+
+        output_directory.WriteTObject(_merged_obj, _key_name)
+
+
+def merge_root_files(input_file_paths, output_file_path, compression_algorithm=None, compression_level=None):
+    """Merge ROOT files produced by Lumberjack into a single output file.
+
+    Directories are traversed recursively and histograms/profiles with
+    the same path are added. Objects and directories present in only
+    some of the inputs are copied to the output as they are. Objects
+    are processed one at a time, so memory usage does not grow with the
+    size of the inputs. The compression of the output file can be
+    configured as for `open_output_file`.
+    """
+    _add_directory_status = ROOT.TH1.AddDirectoryStatus()
+    ROOT.TH1.AddDirectory(False)
+
+    _input_files = [ROOT.TFile(_path, "READ") for _path in input_file_paths]
+    for _path, _tfile in zip(input_file_paths, _input_files):
+        if not _tfile or _tfile.IsZombie():
+            raise IOError("Cannot open file for merging: '{}'".format(_path))
+
+    _output_file = open_output_file(output_file_path, compression_algorithm, compression_level)
+    try:
+        _merge_directories(_input_files, _output_file)
+    finally:
+        _output_file.Close()
+        for _tfile in _input_files:
+            _tfile.Close()
+        ROOT.TH1.AddDirectory(_add_directory_status)
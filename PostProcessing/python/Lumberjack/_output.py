@@ -0,0 +1,78 @@
+from __future__ import print_function
+
+import ROOT
+
+
+__all__ = ['ObjectTreeWriter', 'open_output_file', 'COMPRESSION_ALGORITHMS']
+
+
+# compression algorithms which can be selected by name
+COMPRESSION_ALGORITHMS = ['zlib', 'lzma', 'lz4', 'zstd']
+
+
+def open_output_file(file_path, compression_algorithm=None, compression_level=None):
+    """Create (or overwrite) a ROOT file for writing output objects.
+
+    `compression_algorithm` is one of `COMPRESSION_ALGORITHMS` and `compression_level`
+    an integer between 0 (no compression) and 9. If not given, ROOT's defaults are used.
+    """
+    _tfile = ROOT.TFile(file_path, "RECREATE")
+    if not _tfile or _tfile.IsZombie():
+        raise IOError("Cannot open file for writing: '{}'".format(file_path))
+
+    if compression_algorithm is not None:
+        _tfile.SetCompressionAlgorithm(getattr(ROOT.ROOT, "k" + compression_algorithm.upper()))
+    if compression_level is not None:
+        _tfile.SetCompressionLevel(compression_level)
+
+    return _tfile
+
+
+class ObjectTreeWriter(object):
+    """Writes nested dictionaries of ROOT objects to directories in a ROOT file.
+
+    Dictionary keys are used as the names of subdirectories (for nested
+    dictionaries) and objects. Each directory is created only once and kept
+    for subsequent writes, and objects are written directly to their
+    directory, without changing the current directory. Objects are still
+    written (and compressed) one key at a time. If given, `transform` is
+    called on each object and the object it returns is written instead.
+    """
+
+    def __init__(self, output_directory, transform=None):
+        self._output_directory = output_directory
+        self._transform = transform
+        self._directories = {'': output_directory}
+        self._n_objects_written = 0
+
+    @property
+    def n_objects_written(self):
+        '''number of objects written so far'''
+        return self._n_objects_written
+
+    def _get_directory(self, path):
+        '''retrieve the directory at `path` (relative to the output directory), creating it if needed'''
+        _tdirectory = self._directories.get(path, None)
+        if _tdirectory is None:
+            _parent_path, _, _name = path.rpartition('/')
+            _parent = self._get_directory(_parent_path)
+            _tdirectory = _parent.GetDirectory(_name) or _parent.mkdir(_name)
+            self._directories[path] = _tdirectory
+        return _tdirectory
+
+    def write(self, object_tree, path=''):
+        '''write the objects in `object_tree` (a nested dictionary) to the directory at `path`'''
+        _tdirectory = self._get_directory(path.strip('/'))
+
+        # sort, so that the output inside the ROOT file is sorted
+        for _name, _object_or_dict in sorted(object_tree.iteritems()):
+            if isinstance(_object_or_dict, dict):
+                self.write(_object_or_dict, "{}/{}".format(path, _name))
+                continue
+
+            # unwrap result pointers and objects derived at write time
+            _obj = _object_or_dict.GetPtr() if hasattr(_object_or_dict, 'GetPtr') else _object_or_dict
+            if self._transform is not None:
+                _obj = self._transform(_obj)
+            _tdirectory.WriteTObject(_obj, _name)
+            self._n_objects_written += 1
@@ -1,16 +1,25 @@
 from __future__ import print_function
 
 import argparse
+import functools
+import itertools
 import numpy as np
 import os
 import ROOT
 import re
+import shutil
+import tempfile
 import time
+import uuid
 
 from array import array
 from enum import Enum
 from collections import OrderedDict
 
+from .._util import make_directory
+from ._core import substitute_columns
+from ._output import ObjectTreeWriter, open_output_file
+
 
 __all__ = ["PostProcessor", "Timer"]
 
@@ -51,18 +60,452 @@ class Timer:
             print("[INFO] Task '{}' took {} ({} seconds)".format(self._name, self.get_duration_string(), round(self._duration, 3)))
 
 
+class _DerivedObject(object):
+    """Placeholder for an output object which is only derived from a booked object when it is written out."""
+
+    __slots__ = ('_factory', '_name', '_title', '_obj')
+
+    def __init__(self, factory, name, title):
+        self._factory = factory
+        self._name = name
+        self._title = title
+        self._obj = None
+
+    def GetPtr(self):
+        if self._obj is None:
+            self._obj = self._factory()
+            # detach from current directory, so the object persists after the output file is closed
+            self._obj.SetDirectory(0)
+            self._obj.SetName(self._name)
+            self._obj.SetTitle(self._title)
+        return self._obj
+
+    def Write(self):
+        self.GetPtr().Write()
+
+
+class _SparseHistogramExpansion(object):
+    """Expands a sparse histogram with a split axis into one dense histogram per split.
+
+    All histograms are created in a single pass over the filled bins of the sparse
+    histogram, the first time any of them is requested.
+    """
+
+    def __init__(self, sparse, binnings, split_indices):
+        self._sparse = sparse
+        self._binnings = binnings
+        self._split_indices = split_indices
+        self._histograms = None
+
+    def _make_histogram(self):
+        _name = uuid.uuid4().hex
+        _edges = [array('d', _b) for _b in self._binnings]
+        if len(_edges) == 3:
+            _h = ROOT.TH3D(_name, "", len(_edges[0])-1, _edges[0], len(_edges[1])-1, _edges[1], len(_edges[2])-1, _edges[2])
+        elif len(_edges) == 2:
+            _h = ROOT.TH2D(_name, "", len(_edges[0])-1, _edges[0], len(_edges[1])-1, _edges[1])
+        else:
+            _h = ROOT.TH1D(_name, "", len(_edges[0])-1, _edges[0])
+        _h.SetDirectory(0)
+        _h.Sumw2()
+        return _h
+
+    def get(self, split_index):
+        '''histogram for the split with index `split_index`'''
+        if self._histograms is None:
+            self._histograms = {_split_index: self._make_histogram() for _split_index in self._split_indices}
+
+            # targets are indexed by the bin number on the split axis
+            _targets = ROOT.std.vector('TH1*')(max(self._split_indices) + 2)
+            for _split_index, _h in self._histograms.iteritems():
+                _targets[_split_index + 1] = _h
+            ROOT.karma.lumberjack.expandSparseHistogram(self._sparse.GetPtr(), _targets)
+
+            # the sparse histogram is no longer needed
+            self._sparse = None
+
+        return self._histograms[split_index]
+
+
+class _WeightBatch(object):
+    """Histograms with the same quantities and binnings, booked on the same data frame with different weights.
+
+    The histograms are filled by a single action, which looks up the bin once per entry. Each
+    histogram in the batch is represented by a `_WeightBatchMember`, which can be used like the
+    result of a regular booking once the batch has been booked.
+    """
+
+    def __init__(self, data_frame, vars_xyzt, binnings):
+        self.data_frame = data_frame
+        self.vars_xyzt = vars_xyzt
+        self.binnings = binnings
+        self.members = []  # tuples (name, title, weight)
+        self.result = None
+
+    def add(self, name, title, weight):
+        self.members.append((name, title, weight))
+        return _WeightBatchMember(self, len(self.members) - 1)
+
+
+class _WeightBatchMember(object):
+    """Placeholder for the result of one histogram in a `_WeightBatch`."""
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    def GetPtr(self):
+        # batches with a single member are booked as regular histograms
+        if len(self._batch.members) == 1:
+            return self._batch.result.GetPtr()
+        return self._batch.result.GetPtr().At(self._index)
+
+    def Write(self):
+        self.GetPtr().Write()
+
+
 class PostProcessor(object):
 
     class ObjectType(Enum):
         histogram = 1
         profile = 2
+        export = 3
 
-    def __init__(self, data_frame, splitting_spec, quantities):
+    class SplitMode(Enum):
+        filter = 1  # one chain of `Filter` nodes per split
+        index = 2   # one integer split index column, objects get an additional split axis
+        sparse = 3  # like `index`, but histograms are filled into one sparse histogram with a split axis
+
+    # C++ helper code declared to the interpreter on first use
+    _CPP_HELPERS = """
+    #include <algorithm>
+    #include <vector>
+    #include <cmath>
+    #include <memory>
+    #include <string>
+    #include "TH1.h"
+    #include "THnSparse.h"
+    #include "TObjArray.h"
+    #include "TTree.h"
+    #include "TTreeReader.h"
+    #include "TTreeReaderValue.h"
+    #include "ROOT/RDataFrame.hxx"
+
+    namespace karma {
+    namespace lumberjack {
+
+        /* Read at most `n` values of the scalar branch `branch` of `tree`, starting at entry `first`. */
+        template <typename T>
+        std::vector<T> readBranchChunk(TTree* tree, const std::string& branch, Long64_t first, Long64_t n) {
+            std::vector<T> result;
+            const Long64_t last = std::min(first + n, tree->GetEntries());
+            if (last <= first)
+                return result;
+            result.reserve(last - first);
+            TTreeReader reader(tree);
+            TTreeReaderValue<T> value(reader, branch.c_str());
+            reader.SetEntriesRange(first, last);
+            while (reader.Next())
+                result.push_back(*value);
+            return result;
+        }
+
+        /* Return `indices[i]` for the range [los[i], his[i]) that contains `value`, or -1 if none does.
+           Ranges must be sorted and non-overlapping. Ranges with los[i] == his[i] match `value == los[i]`. */
+        inline int findRangeIndex(double value, const std::vector<double>& los, const std::vector<double>& his, const std::vector<int>& indices) {
+            auto it = std::upper_bound(los.begin(), los.end(), value);
+            if (it == los.begin())
+                return -1;
+            const size_t i = (it - los.begin()) - 1;
+            if ((value < his[i]) || (los[i] == his[i] && value == los[i]))
+                return indices[i];
+            return -1;
+        }
+
+        /* Add the contents of `source` to `target`, whose bin edges must be a subset of the bin edges
+           of `source`. Each bin (including under- and overflow) of `source` is added to the bin of
+           `target` containing its center, which makes the rebinning exact. */
+        inline void rebinInto(const TH1& source, TH1& target) {
+            const int dim = source.GetDimension();
+            const int nx = source.GetNbinsX() + 2;
+            const int ny = (dim > 1) ? source.GetNbinsY() + 2 : 1;
+            const int nz = (dim > 2) ? source.GetNbinsZ() + 2 : 1;
+            const bool hasSumw2 = (source.GetSumw2N() > 0);
+
+            for (int iz = 0; iz < nz; ++iz) {
+                const int tz = (dim > 2) ? target.GetZaxis()->FindFixBin(source.GetZaxis()->GetBinCenter(iz)) : 0;
+                for (int iy = 0; iy < ny; ++iy) {
+                    const int ty = (dim > 1) ? target.GetYaxis()->FindFixBin(source.GetYaxis()->GetBinCenter(iy)) : 0;
+                    for (int ix = 0; ix < nx; ++ix) {
+                        const int tx = target.GetXaxis()->FindFixBin(source.GetXaxis()->GetBinCenter(ix));
+                        const int sourceBin = source.GetBin(ix, iy, iz);
+                        const int targetBin = target.GetBin(tx, ty, tz);
+                        target.AddBinContent(targetBin, source.GetBinContent(sourceBin));
+                        if (hasSumw2)
+                            target.GetSumw2()->AddAt(target.GetSumw2()->At(targetBin) + std::pow(source.GetBinError(sourceBin), 2), targetBin);
+                    }
+                }
+            }
+
+            // statistics are unaffected by the rebinning
+            double stats[TH1::kNstat];
+            source.GetStats(stats);
+            target.PutStats(stats);
+            target.SetEntries(source.GetEntries());
+        }
+
+        /* RDataFrame action filling a `THnSparseD`. Each slot fills its own copy, which are added at the end. */
+        class SparseHistogramHelper : public ROOT::Detail::RDF::RActionImpl<SparseHistogramHelper> {
+          public:
+            using Result_t = THnSparseD;
+
+            SparseHistogramHelper(const THnSparseD& model, unsigned int nSlots) : fResult(static_cast<THnSparseD*>(model.Clone())) {
+                for (unsigned int slot = 0; slot < nSlots; ++slot)
+                    fSlotResults.emplace_back(static_cast<THnSparseD*>(model.Clone()));
+            }
+            SparseHistogramHelper(SparseHistogramHelper&&) = default;
+            SparseHistogramHelper(const SparseHistogramHelper&) = delete;
+
+            std::shared_ptr<THnSparseD> GetResultPtr() const { return fResult; }
+            void Initialize() {}
+            void InitTask(TTreeReader*, unsigned int) {}
+            void Exec(unsigned int slot, const ROOT::RVec<double>& coordinates, double weight) {
+                fSlotResults[slot]->Fill(coordinates.data(), weight);
+            }
+            void Finalize() {
+                for (auto& slotResult : fSlotResults) {
+                    fResult->Add(slotResult.get());
+                    slotResult.reset();
+                }
+            }
+            std::string GetActionName() { return "SparseHistogram"; }
+
+          private:
+            std::shared_ptr<THnSparseD> fResult;
+            std::vector<std::unique_ptr<THnSparseD>> fSlotResults;
+        };
+
+        inline ROOT::RDF::RResultPtr<THnSparseD> bookSparseHistogram(ROOT::RDF::RNode df, const THnSparseD& model, const std::string& coordinates, const std::string& weight) {
+            const unsigned int nSlots = std::max(ROOT::GetImplicitMTPoolSize(), 1u);
+            return df.Book<ROOT::RVec<double>, double>(SparseHistogramHelper(model, nSlots), {coordinates, weight});
+        }
+
+        /* RDataFrame action filling several histograms with identical binnings and different weights.
+           The bin is looked up once per entry and the weights are added to the same bin of each histogram.
+           The statistics (sums of weights and weighted moments) are accumulated per entry as done by `TH1::Fill`. */
+        class MultiWeightHistogramHelper : public ROOT::Detail::RDF::RActionImpl<MultiWeightHistogramHelper> {
+          public:
+            using Result_t = TObjArray;
+
+            MultiWeightHistogramHelper(const std::vector<TH1*>& models, unsigned int nSlots) : fResult(std::make_shared<TObjArray>()), fSlots(nSlots) {
+                fResult->SetOwner(true);
+                for (auto model : models)
+                    fResult->Add(CloneModel(*model));
+                for (auto& slot : fSlots) {
+                    for (auto model : models)
+                        slot.histograms.emplace_back(CloneModel(*model));
+                    slot.stats.assign(models.size() * TH1::kNstat, 0.);
+                }
+            }
+            MultiWeightHistogramHelper(MultiWeightHistogramHelper&&) = default;
+            MultiWeightHistogramHelper(const MultiWeightHistogramHelper&) = delete;
+
+            std::shared_ptr<TObjArray> GetResultPtr() const { return fResult; }
+            void Initialize() {}
+            void InitTask(TTreeReader*, unsigned int) {}
+            void Exec(unsigned int slot, const ROOT::RVec<double>& coordinates, const ROOT::RVec<double>& weights) {
+                auto& slotData = fSlots[slot];
+                const TH1* first = slotData.histograms[0].get();
+                const int nDims = first->GetDimension();
+                const double x = coordinates[0];
+                const double y = (nDims > 1) ? coordinates[1] : 0.;
+                const double z = (nDims > 2) ? coordinates[2] : 0.;
+                const int bin = first->FindFixBin(x, y, z);
+                for (size_t k = 0; k < slotData.histograms.size(); ++k) {
+                    slotData.histograms[k]->AddBinContent(bin, weights[k]);
+                    slotData.histograms[k]->GetSumw2()->fArray[bin] += weights[k] * weights[k];
+                }
+                ++slotData.entries;
+
+                // like `TH1::Fill`, entries in underflow/overflow bins only enter the statistics if requested
+                if (!TH1::GetStatOverflows()) {
+                    int binX, binY, binZ;
+                    first->GetBinXYZ(bin, binX, binY, binZ);
+                    if (IsOutOfRange(binX, *first->GetXaxis()) ||
+                        (nDims > 1 && IsOutOfRange(binY, *first->GetYaxis())) ||
+                        (nDims > 2 && IsOutOfRange(binZ, *first->GetZaxis())))
+                        return;
+                }
+                for (size_t k = 0; k < slotData.histograms.size(); ++k) {
+                    const double w = weights[k];
+                    double* stats = &slotData.stats[k * TH1::kNstat];
+                    stats[0] += w;
+                    stats[1] += w * w;
+                    stats[2] += w * x;
+                    stats[3] += w * x * x;
+                    if (nDims > 1) {
+                        stats[4] += w * y;
+                        stats[5] += w * y * y;
+                        stats[6] += w * x * y;
+                    }
+                    if (nDims > 2) {
+                        stats[7] += w * z;
+                        stats[8] += w * z * z;
+                        stats[9] += w * x * z;
+                        stats[10] += w * y * z;
+                    }
+                }
+            }
+            void Finalize() {
+                ULong64_t entries = 0;
+                for (const auto& slotData : fSlots)
+                    entries += slotData.entries;
+                for (int k = 0; k < fResult->GetEntriesFast(); ++k) {
+                    auto result = static_cast<TH1*>(fResult->At(k));
+                    std::vector<double> stats(TH1::kNstat, 0.);
+                    for (auto& slotData : fSlots) {
+                        result->Add(slotData.histograms[k].get());
+                        slotData.histograms[k].reset();
+                        for (int i = 0; i < TH1::kNstat; ++i)
+                            stats[i] += slotData.stats[k * TH1::kNstat + i];
+                    }
+                    result->PutStats(stats.data());
+                    result->SetEntries(entries);
+                }
+            }
+            std::string GetActionName() { return "MultiWeightHistogram"; }
+
+          private:
+            static TH1* CloneModel(const TH1& model) {
+                auto histogram = static_cast<TH1*>(model.Clone());
+                histogram->SetDirectory(nullptr);
+                if (histogram->GetSumw2N() == 0)
+                    histogram->Sumw2();
+                return histogram;
+            }
+            static bool IsOutOfRange(int bin, const TAxis& axis) {
+                return bin == 0 || bin > axis.GetNbins();
+            }
+
+            // histograms, statistics and number of entries for one slot, on their own cache line to avoid false sharing
+            struct alignas(64) SlotData {
+                std::vector<std::unique_ptr<TH1>> histograms;
+                std::vector<double> stats;  // `TH1::kNstat` values per histogram, in the order used by `TH1::GetStats`
+                ULong64_t entries = 0;
+            };
+
+            std::shared_ptr<TObjArray> fResult;
+            std::vector<SlotData> fSlots;
+        };
+
+        inline ROOT::RDF::RResultPtr<TObjArray> bookMultiWeightHistograms(ROOT::RDF::RNode df, const std::vector<TH1*>& models, const std::string& coordinates, const std::string& weights) {
+            const unsigned int nSlots = std::max(ROOT::GetImplicitMTPoolSize(), 1u);
+            return df.Book<ROOT::RVec<double>, ROOT::RVec<double>>(MultiWeightHistogramHelper(models, nSlots), {coordinates, weights});
+        }
+
+        /* Add the filled bins of `sparse` to the histograms in `targets`, indexed by the bin on the last (split) axis
+           of `sparse`. The other axes of `sparse` must have the same binning as the targets. Null targets are skipped. */
+        inline void expandSparseHistogram(const THnSparse& sparse, const std::vector<TH1*>& targets) {
+            const int nDims = sparse.GetNdimensions();
+            std::vector<int> coordinates(nDims);
+            for (Long64_t i = 0; i < sparse.GetNbins(); ++i) {
+                const double content = sparse.GetBinContent(i, coordinates.data());
+                const int splitBin = coordinates[nDims - 1];
+                if (splitBin < 0 || splitBin >= static_cast<int>(targets.size()) || targets[splitBin] == nullptr)
+                    continue;
+                TH1* target = targets[splitBin];
+                const int bin = target->GetBin(coordinates[0], (nDims > 2) ? coordinates[1] : 0, (nDims > 3) ? coordinates[2] : 0);
+                target->AddBinContent(bin, content);
+                if (target->GetSumw2N() > 0)
+                    target->GetSumw2()->AddAt(target->GetSumw2()->At(bin) + sparse.GetBinError2(i), bin);
+            }
+            for (auto target : targets) {
+                if (target != nullptr)
+                    target->ResetStats();
+            }
+        }
+
+    }  // namespace lumberjack
+    }  // namespace karma
+    """
+
+    _cpp_helpers_declared = False
+    _split_index_counter = itertools.count()
+    _weight_batch_counter = itertools.count()
+
+    # pseudo split name under which sparse histograms are stored in the output (when not expanded)
+    _SPARSE_SPLIT_NAME = 'sparse'
+
+    def __init__(self, data_frame, splitting_spec, quantities, splitting_key_specs=None, split_mode=SplitMode.filter, result_cache=None, profiler=None,
+                 export_format='npz', export_chunk_size=1000000, master_binning=False, write_sparse=False,
+                 compression_algorithm=None, compression_level=None, sample_fraction=None, batch_weights=False, column_substitutions=None):
         self._df_bare = data_frame
         self._splitting_spec = splitting_spec
         self._qs = quantities
 
+        # columns read in place of the ones named in the object and splitting specifications (e.g. for systematic variations)
+        self._column_substitutions = column_substitutions or {}
+
+        # post-processors for systematic variations, written to subdirectories of the output file
+        self._variations = OrderedDict()
+
+        # per-key splitting specifications (needed for `SplitMode.index` and `SplitMode.sparse`)
+        self._splitting_key_specs = splitting_key_specs
+        self._split_mode = split_mode
+
+        # write sparse histograms as they are, instead of expanding them into one object per split
+        self._write_sparse = write_sparse
+
+        # optional cache for results of previous runs
+        self._result_cache = result_cache
+        self._results_to_cache = []
+
+        # optional profiler for splitting nodes and booked actions
+        self._profiler = profiler
+
+        # format and number of rows per file for exported columns (the values are written to
+        # temporary ROOT files during the event loop and converted chunk by chunk on output)
+        if export_format == 'parquet':
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("Export format 'parquet' requires the `pyarrow` package.")
+        self._export_format = export_format
+        self._export_chunk_size = export_chunk_size
+        self._export_tmp_dir = None
+
+        # compression of the output file (ROOT defaults if `None`)
+        self._compression_algorithm = compression_algorithm
+        self._compression_level = compression_level
+
+        # fill histograms differing only in their weights with a single action
+        self._batch_weights = batch_weights
+        self._weight_batches = OrderedDict()
+
+        # fraction of entries processed (histograms are scaled by the inverse on output)
+        self._sample_fraction = sample_fraction
+
+        # fill objects with the finest common refinement of all binnings of their quantities
+        self._master_binning = master_binning
+
         self._specs = []
+        self._export_specs = []
+        self._exports = {}
+        self._booked_output_ids = set()
+
+    @classmethod
+    def _declare_cpp_helpers(cls):
+        if not cls._cpp_helpers_declared:
+            ROOT.gInterpreter.Declare(cls._CPP_HELPERS)
+            cls._cpp_helpers_declared = True
+
+    @staticmethod
+    def get_export_directory(output_file_path):
+        '''directory to which exported quantities are written for the output file `output_file_path`'''
+        return os.path.splitext(output_file_path)[0] + "_export"
 
     @staticmethod
     def _get_directory_from_split_name(split_name):
@@ -72,16 +515,154 @@ class PostProcessor(object):
         _path_elements = [_pe.split(':', 1)[-1] for _pe in _path_elements]
         return '/'.join(_path_elements)
 
+    @staticmethod
+    def _get_split_dict_from_split_name(split_name):
+        '''split name "key1:value1/key2:value2" -> dict(key1='value1', key2='value2')'''
+        return dict([_path_element.split(':', 1) for _path_element in split_name.split('/')])
+
+    @staticmethod
+    def _get_split_ranges(splitting_key_spec):
+        '''convert the specification of a single splitting key to a variable name and a sorted list of
+        `(lo, hi, value_name)` ranges. Returns `None` if the key cannot be mapped to non-overlapping
+        ranges of a single variable.'''
+        _var = None
+        _ranges = []
+        for _value_name, _value_dict in splitting_key_spec.iteritems():
+            # only splittings on a single variable are supported
+            if len(_value_dict) != 1:
+                return None
+            _value_var, _bin_spec = list(_value_dict.items())[0]
+            if _var is None:
+                _var = _value_var
+            elif _var != _value_var:
+                return None
+
+            try:
+                if isinstance(_bin_spec, tuple):
+                    _ranges.append((float(_bin_spec[0]), float(_bin_spec[1]), _value_name))
+                else:
+                    _ranges.append((float(_bin_spec), float(_bin_spec), _value_name))
+            except (TypeError, ValueError):
+                return None
+
+        _ranges.sort(key=lambda _r: (_r[0], _r[1]))
+
+        # check ranges for overlaps
+        for (_lo, _hi, _), (_next_lo, _next_hi, _) in zip(_ranges[:-1], _ranges[1:]):
+            if _hi > _next_lo or (_lo == _hi and _lo >= _next_lo):
+                return None
+
+        return _var, _ranges
+
+    def _uses_split_index(self):
+        return self._split_mode in (self.__class__.SplitMode.index, self.__class__.SplitMode.sparse)
+
     def _split_df(self):
+        if self._split_mode == self.__class__.SplitMode.sparse and not hasattr(ROOT.RDF, 'AsRNode'):
+            print("[WARNING] ROOT version {} does not support booking custom actions on data frames. "
+                  "Falling back to index-based splitting.".format(ROOT.gROOT.GetVersion()))
+            self._split_mode = self.__class__.SplitMode.index
+
+        if self._uses_split_index():
+            if self._split_df_index():
+                return
+            print("[WARNING] Splitting cannot be expressed as non-overlapping ranges of one variable per key. "
+                  "Falling back to filter-based splitting.")
+            self._split_mode = self.__class__.SplitMode.filter
+
         # -- create splits
         self._split_dfs = {}
         for _split_name, _split_dict in self._splitting_spec.iteritems():
             self._split_dfs[_split_name] = self._df_bare
             for _var, _bin_spec in _split_dict.iteritems():
                 if isinstance(_bin_spec, tuple):
-                    self._split_dfs[_split_name] = self._split_dfs[_split_name].Filter("{lo}<={var}&&{var}<{hi}".format(lo=_bin_spec[0], hi=_bin_spec[1], var=_var))
+                    self._split_dfs[_split_name] = self._filter(self._split_dfs[_split_name], "{lo}<={var}&&{var}<{hi}".format(lo=_bin_spec[0], hi=_bin_spec[1], var=self._get_column(_var)))
                 else:
-                    self._split_dfs[_split_name] = self._split_dfs[_split_name].Filter("{var}=={value}".format(value=_bin_spec, var=_var))
+                    self._split_dfs[_split_name] = self._filter(self._split_dfs[_split_name], "{var}=={value}".format(value=_bin_spec, var=self._get_column(_var)))
+
+    def _get_column(self, expression):
+        '''column or expression to read in place of `expression`, after applying the column substitutions'''
+        if expression is None or not self._column_substitutions:
+            return expression
+        return substitute_columns(expression, self._column_substitutions)
+
+    def _filter(self, data_frame, expression):
+        '''book a splitting Filter (via the profiler, if any)'''
+        if self._profiler is not None:
+            return self._profiler.filter(data_frame, expression, category='splitting')
+        return data_frame.Filter(expression)
+
+    def _define(self, data_frame, name, expression):
+        '''book a splitting Define (via the profiler, if any)'''
+        if self._profiler is not None:
+            return self._profiler.define(data_frame, name, expression, category='splitting')
+        return data_frame.Define(name, expression)
+
+    def _split_df_index(self):
+        '''define one split index column per splitting key and a combined split index column.
+        Returns `False` if the splitting is not compatible with index-based splitting.'''
+        if not self._splitting_key_specs:
+            return False
+
+        _key_ranges = OrderedDict()
+        for _key, _key_spec in self._splitting_key_specs.iteritems():
+            _var_ranges = self._get_split_ranges(_key_spec)
+            if _var_ranges is None:
+                return False
+            _key_ranges[_key] = _var_ranges
+
+        self._declare_cpp_helpers()
+
+        _uid = next(self._split_index_counter)
+        _df = self._df_bare
+
+        # strides for computing the combined index (first key varies fastest)
+        self._split_index_strides = OrderedDict()
+        self._split_index_values = OrderedDict()
+        _stride = 1
+        _key_index_columns = []
+        for _i_key, (_key, (_var, _ranges)) in enumerate(_key_ranges.iteritems()):
+            _cpp_name = "karma_lumberjack_split_{}_{}".format(_uid, _i_key)
+            ROOT.gInterpreter.Declare(
+                "const std::vector<double> {name}_lo = {{{lo}}};\n"
+                "const std::vector<double> {name}_hi = {{{hi}}};\n"
+                "const std::vector<int> {name}_idx = {{{idx}}};\n".format(
+                    name=_cpp_name,
+                    lo=", ".join([repr(_lo) for _lo, _, _ in _ranges]),
+                    hi=", ".join([repr(_hi) for _, _hi, _ in _ranges]),
+                    idx=", ".join([str(_i) for _i in range(len(_ranges))]),
+                )
+            )
+            _column = "_split_idx_{}_{}".format(_uid, _i_key)
+            _df = self._define(_df, _column, "karma::lumberjack::findRangeIndex({var}, {name}_lo, {name}_hi, {name}_idx)".format(
+                var=self._get_column(_var), name=_cpp_name))
+            _key_index_columns.append(_column)
+
+            self._split_index_strides[_key] = _stride
+            self._split_index_values[_key] = {_value_name: _i for _i, (_, _, _value_name) in enumerate(_ranges)}
+            _stride *= len(_ranges)
+
+        self._split_index_size = _stride
+        self._sparse_df = None
+        self._split_index_column = "_split_idx_{}".format(_uid)
+        self._split_index_df = self._define(
+            _df,
+            self._split_index_column,
+            "({any_negative}) ? -1 : ({combined})".format(
+                any_negative=" || ".join(["{} < 0".format(_c) for _c in _key_index_columns]),
+                combined=" + ".join(["{}*{}".format(_stride, _c) for _stride, _c in zip(self._split_index_strides.values(), _key_index_columns)]),
+            )
+        )
+
+        return True
+
+    def _get_split_index(self, split_name):
+        '''combined split index corresponding to a split name'''
+        _split_dict = self._get_split_dict_from_split_name(split_name)
+        return sum([
+            _stride * self._split_index_values[_key][_split_dict[_key]]
+            for _key, _stride in self._split_index_strides.iteritems()
+        ])
 
     def _get_quantity_binning(self, quantity_name, split_dict):
         '''retrieve the binning for a quantity, taking named binnings into consideration.'''
@@ -106,118 +687,517 @@ class PostProcessor(object):
         else:
             return self._qs[quantity_name].binning
 
+    def _get_object_binnings(self, vars_xyzt, split_dict):
+        '''retrieve the binnings of all quantities of an object (`None` for unused axes)'''
+        return tuple([
+            self._get_quantity_binning(quantity_name=_var, split_dict=split_dict) if _var is not None else None
+            for _var in vars_xyzt
+        ])
+
+    def _get_master_binning(self, quantity_name):
+        '''master binning configured for a quantity or, if none is configured, the finest common refinement
+        of the default binning and all named binnings of the quantity (union of all bin edges)'''
+        if self._qs[quantity_name].master_binning is not None:
+            return list(self._qs[quantity_name].master_binning)
+
+        _edges = set(self._qs[quantity_name].binning)
+        for _named_binnings in (self._qs[quantity_name].named_binnings or {}).values():
+            for _binning in _named_binnings.values():
+                _edges.update(_binning)
+        return sorted(_edges)
+
+    def _get_fill_and_target_binnings(self, obj_type, vars_xyzt, split_dict):
+        '''binnings used for filling an object and binnings of the output object. These differ if objects
+        are filled with master binnings and rebinned to the requested binnings on output.'''
+        _target_binnings = self._get_object_binnings(vars_xyzt, split_dict)
+
+        # exact rebinning is possible for histograms and 1D profiles
+        _var_x, _var_y, _var_z, _var_t = vars_xyzt
+        if not self._master_binning or (obj_type == self.__class__.ObjectType.profile and _var_z is not None):
+            return _target_binnings, _target_binnings
+
+        # only binned axes are rebinned (not the 'y' quantity of profiles)
+        _n_binned_axes = 1 if obj_type == self.__class__.ObjectType.profile else 3
+        _fill_binnings = []
+        for _i_axis, (_var, _binning) in enumerate(zip(vars_xyzt, _target_binnings)):
+            if _var is None or _i_axis >= _n_binned_axes:
+                _fill_binnings.append(_binning)
+                continue
+            _master_binning = self._get_master_binning(_var)
+            if not set(_binning) <= set(_master_binning):
+                # exact rebinning impossible: fill the requested binning directly
+                print("[WARNING] Binning {} of quantity '{}' is not contained in its master binning {}: "
+                      "filling the requested binning directly.".format(list(_binning), _var, _master_binning))
+                _master_binning = _binning
+            _fill_binnings.append(_master_binning)
+        return tuple(_fill_binnings), _target_binnings
+
+    def _get_output_object(self, obj, obj_name, title, fill_binnings, target_binnings):
+        '''wrap an object filled with master binnings, so that it is rebinned to the target binnings on output'''
+        if [list(_b) if _b is not None else None for _b in fill_binnings] == [list(_b) if _b is not None else None for _b in target_binnings]:
+            return obj
+        return _DerivedObject(functools.partial(self._rebin_object, obj, target_binnings), obj_name, title)
+
+    @staticmethod
+    def _rebin_object(master, target_binnings):
+        '''rebin an object filled with master binnings exactly to the target binnings'''
+        _master = master.GetPtr() if hasattr(master, 'GetPtr') else master
+        _x_binning, _y_binning, _z_binning, _ = target_binnings
+        _name = uuid.uuid4().hex
+
+        if isinstance(_master, ROOT.TProfile):
+            return _master.Rebin(len(_x_binning)-1, _name, array('d', _x_binning))
+
+        _dimension = _master.GetDimension()
+        if _dimension == 3:
+            _target = ROOT.TH3D(_name, "",
+                len(_x_binning)-1, array('d', _x_binning),
+                len(_y_binning)-1, array('d', _y_binning),
+                len(_z_binning)-1, array('d', _z_binning))
+        elif _dimension == 2:
+            _target = ROOT.TH2D(_name, "",
+                len(_x_binning)-1, array('d', _x_binning),
+                len(_y_binning)-1, array('d', _y_binning))
+        else:
+            _target = ROOT.TH1D(_name, "",
+                len(_x_binning)-1, array('d', _x_binning))
+
+        if _master.GetSumw2N():
+            _target.Sumw2()
+
+        ROOT.karma.lumberjack.rebinInto(_master, _target)
+        return _target
+
+    def _get_object_path_name_title(self, obj_type, vars_xyzt, weight, option_string, split_name):
+        '''determine subdirectory path (tuple), name and title of an output object'''
+        _var_x, _var_y, _var_z, _var_t = vars_xyzt
+
+        _var_string_for_title = '_'.join([_v for _v in vars_xyzt if _v is not None])
+        _name_suffix = '_'.join([_s for _s in (_var_x, weight, option_string) if _s is not None])
+        _title = '_'.join([_s for _s in (_var_string_for_title, weight, option_string, split_name) if _s is not None])
+
+        if _var_t is not None:
+            assert(_var_z is not None)  # cannot have 't' without 'z'
+            assert(_var_y is not None)  # cannot have 'z' without 'y'
+        elif _var_z is not None:
+            assert(_var_y is not None)  # cannot have 'z' without 'y'
+
+        # objects are placed in subdirectories named after the 't', 'z' and 'y' quantities (in that order)
+        _path = tuple([_v for _v in (_var_t, _var_z, _var_y) if _v is not None])
+
+        if obj_type == self.__class__.ObjectType.histogram:
+            if _var_t is not None:
+                raise ValueError("4D histogram requested ({}), but this is not supported!".format(vars_xyzt))
+            _prefix = 'h3d_' if _var_z is not None else 'h2d_' if _var_y is not None else 'h_'
+        elif obj_type == self.__class__.ObjectType.profile:
+            assert _var_y is not None
+            _prefix = 'p3d_' if _var_t is not None else 'p2d_' if _var_z is not None else 'p_'
+
+        return _path, _prefix + _name_suffix, _title
+
+    def _book_object(self, data_frame, obj_type, obj_name, title, vars_xyzt, binnings, weight, option_string, allow_batching=True):
+        '''book a single histogram or profile on a data frame. Weighted histograms are only added to a
+        batch if weight batching is enabled (see `_book_weight_batches`).'''
+        _var_x, _var_y, _var_z, _var_t = vars_xyzt
+        _x_binning, _y_binning, _z_binning, _t_binning = binnings
+
+        if allow_batching and self._batch_weights and weight is not None and obj_type == self.__class__.ObjectType.histogram:
+            _batch_key = (id(data_frame), vars_xyzt, tuple([tuple(_b) if _b is not None else None for _b in binnings]))
+            if _batch_key not in self._weight_batches:
+                self._weight_batches[_batch_key] = _WeightBatch(data_frame, vars_xyzt, binnings)
+            return self._weight_batches[_batch_key].add(obj_name, title, weight)
+
+        _var_x, _var_y, _var_z, _var_t = [self._get_column(_v) for _v in vars_xyzt]
+        weight = self._get_column(weight)
+        _weight_args = (weight,) if weight is not None else ()
+
+        if obj_type == self.__class__.ObjectType.histogram:
+            if _var_z is not None:
+                # implied -> _var_y is also not `None`
+                _obj_model = ROOT.RDF.TH3DModel(obj_name, title,
+                    len(_x_binning)-1, array('f', _x_binning),
+                    len(_y_binning)-1, array('f', _y_binning),
+                    len(_z_binning)-1, array('f', _z_binning))
+                return data_frame.Histo3D(_obj_model, _var_x, _var_y, _var_z, *_weight_args)
+            elif _var_y is not None:
+                _obj_model = ROOT.RDF.TH2DModel(obj_name, title,
+                    len(_x_binning)-1, array('f', _x_binning),
+                    len(_y_binning)-1, array('f', _y_binning))
+                return data_frame.Histo2D(_obj_model, _var_x, _var_y, *_weight_args)
+            else:
+                _obj_model = ROOT.RDF.TH1DModel(obj_name, title,
+                    len(_x_binning)-1, array('f', _x_binning))
+                return data_frame.Histo1D(_obj_model, _var_x, *_weight_args)
+
+        elif obj_type == self.__class__.ObjectType.profile:
+            if _var_t is not None:
+                _obj_model = ROOT.RDF.TProfile3DModel(obj_name, title,
+                    len(_x_binning)-1, array('d', _x_binning),
+                    len(_y_binning)-1, array('d', _y_binning),
+                    len(_z_binning)-1, array('d', _z_binning),
+                    # profiles may have build options
+                    option_string or "")
+                return data_frame.Profile3D(_obj_model, _var_x, _var_y, _var_z, _var_t, *_weight_args)
+            elif _var_z is not None:
+                _obj_model = ROOT.RDF.TProfile2DModel(obj_name, title,
+                    len(_x_binning)-1, array('d', _x_binning),
+                    len(_y_binning)-1, array('d', _y_binning),
+                    # profiles may have build options
+                    option_string or "")
+                return data_frame.Profile2D(_obj_model, _var_x, _var_y, _var_z, *_weight_args)
+            else:
+                _obj_model = ROOT.RDF.TProfile1DModel(obj_name, title,
+                    len(_x_binning)-1, array('d', _x_binning),
+                    # profiles may have build options
+                    option_string or "")
+                return data_frame.Profile1D(_obj_model, _var_x, _var_y, *_weight_args)
+
+    def _book_weight_batches(self):
+        '''book one action per batch of histograms differing only in their weights'''
+        if self._weight_batches:
+            self._declare_cpp_helpers()
+
+        for _batch in self._weight_batches.values():
+            _vars_xyz = tuple([self._get_column(_v) for _v in _batch.vars_xyzt[:3] if _v is not None])
+
+            # single histograms are booked as usual
+            if len(_batch.members) == 1:
+                _name, _title, _weight = _batch.members[0]
+                _batch.result = self._book_object(_batch.data_frame, self.__class__.ObjectType.histogram, _name, _title,
+                    _batch.vars_xyzt, _batch.binnings, _weight, None, allow_batching=False)
+                continue
+
+            _models = ROOT.std.vector('TH1*')()
+            for _name, _title, _ in _batch.members:
+                _edges = [array('d', _b) for _b in _batch.binnings[:len(_vars_xyz)]]
+                if len(_edges) == 3:
+                    _model = ROOT.TH3D(_name, _title, len(_edges[0])-1, _edges[0], len(_edges[1])-1, _edges[1], len(_edges[2])-1, _edges[2])
+                elif len(_edges) == 2:
+                    _model = ROOT.TH2D(_name, _title, len(_edges[0])-1, _edges[0], len(_edges[1])-1, _edges[1])
+                else:
+                    _model = ROOT.TH1D(_name, _title, len(_edges[0])-1, _edges[0])
+                _model.SetDirectory(0)
+                _models.push_back(_model)
+
+            # coordinates and weights are passed to the action as one column each
+            _uid = next(self._weight_batch_counter)
+            _coordinates_column = "_weight_batch_coordinates_{}".format(_uid)
+            _weights_column = "_weight_batch_weights_{}".format(_uid)
+            _df = self._define(_batch.data_frame, _coordinates_column, "ROOT::RVec<double>{{{}}}".format(
+                ", ".join(["static_cast<double>({})".format(_v) for _v in _vars_xyz])))
+            _df = self._define(_df, _weights_column, "ROOT::RVec<double>{{{}}}".format(
+                ", ".join(["static_cast<double>({})".format(self._get_column(_weight)) for _, _, _weight in _batch.members])))
+
+            _batch.result = ROOT.karma.lumberjack.bookMultiWeightHistograms(ROOT.RDF.AsRNode(_df), _models, _coordinates_column, _weights_column)
+
+    def _store_object(self, split_name, path, obj_name, obj, booked=False):
+        '''place an object in the output tree under the given split name and subdirectory path.
+        `booked` indicates that the object is filled in the event loop.'''
+        if booked:
+            self._booked_output_ids.add(id(obj))
+        _subdict = self._root_objects.setdefault(split_name, {})
+        for _path_element in path:
+            _subdict = _subdict.setdefault(_path_element, {})  # ensure subdict exists
+        _subdict[obj_name] = obj
+
+    def _get_cached_object(self, split_name, obj_type, vars_xyzt, binnings, weight, option_string, obj_name, title):
+        '''look up an object in the result cache. Returns a tuple (cache key, cached object or `None`)'''
+        if self._result_cache is None:
+            return None, None
+
+        _object_spec = dict(
+            split=self._splitting_spec[split_name],
+            split_name=split_name,
+            obj_type=obj_type.name,
+            quantities=[(_var, self._qs[_var].expression) if _var is not None else None for _var in vars_xyzt],
+            binnings=[list(_b) if _b is not None else None for _b in binnings],
+            weight=weight,
+            option_string=option_string,
+            name=obj_name,
+            title=title,
+        )
+        # only included if set, so that existing cache keys remain valid
+        if self._column_substitutions:
+            _object_spec['column_substitutions'] = sorted(self._column_substitutions.items())
+
+        _key = self._result_cache.get_key(**_object_spec)
+
+        _obj = self._result_cache.get(_key)
+        if _obj is not None:
+            _obj.SetName(obj_name)
+            _obj.SetTitle(title)
+
+        return _key, _obj
+
     def _create_objects(self):
         # -- create quantity shape histograms for each split
         self._root_objects = {}  # keys are paths of the form 'splitting_key1:splitting_value1/.../splitting_keyN:splitting_valueN'
 
+        if self._uses_split_index():
+            self._create_objects_index()
+            return
+
         for _split_name, _split_df in self._split_dfs.iteritems():
             self._root_objects[_split_name] = {}
 
-            _split_dict = dict([_path_element.split(':', 1) for _path_element in _split_name.split('/')])
+            _split_dict = self._get_split_dict_from_split_name(_split_name)
 
             for _obj_type, _vars_xyzt, _weight, _option_string in self._specs:
-                _var_x, _var_y, _var_z, _var_t = _vars_xyzt
-
-                _var_string_for_title = '_'.join([_v for _v in _vars_xyzt if _v is not None])
-                _name_suffix = '_'.join([_s for _s in (_var_x, _weight, _option_string) if _s is not None])
-                _title = '_'.join([_s for _s in (_var_string_for_title, _weight, _option_string, _split_name) if _s is not None])
-
-                # -- determing binnings in 'x' (and 'y' and 'z', if specified)
-
-                _x_binning = self._get_quantity_binning(quantity_name=_var_x, split_dict=_split_dict)
-
-                if _var_t is not None:
-                    # Case 1: var 't' specified -> 3D profile requested
-                    assert(_var_z is not None)  # cannot have 't' without 'z'
-                    assert(_var_y is not None)  # cannot have 'z' without 'y'
-                    _y_binning = self._get_quantity_binning(quantity_name=_var_y, split_dict=_split_dict)
-                    _z_binning = self._get_quantity_binning(quantity_name=_var_z, split_dict=_split_dict)
-                    _t_binning = self._get_quantity_binning(quantity_name=_var_t, split_dict=_split_dict)
-
-                    _var_t_subdict = self._root_objects[_split_name].setdefault(_var_t, {})  # ensure '_var_t' subdict exists
-                    _var_z_subdict = _var_t_subdict.setdefault(_var_z, {})  # ensure '_var_z' subdict exists
-                    _var_y_subdict = _var_z_subdict.setdefault(_var_y, {})  # ensure '_var_y' subdict exists
-                elif _var_z is not None:
-                    # Case 2: var 'z' specified -> 3D histogram/2D profile requested
-                    assert(_var_y is not None)  # cannot have 'z' without 'y'
-                    _y_binning = self._get_quantity_binning(quantity_name=_var_y, split_dict=_split_dict)
-                    _z_binning = self._get_quantity_binning(quantity_name=_var_z, split_dict=_split_dict)
-
-                    _var_z_subdict = self._root_objects[_split_name].setdefault(_var_z, {})  # ensure '_var_z' subdict exists
-                    _var_y_subdict = _var_z_subdict.setdefault(_var_y, {})  # ensure '_var_y' subdict exists
-                elif _var_y is not None:
-                    # Case 3: no var 'z' specified, but var 'y' specified -> 2D histogram/profile requested
-                    _y_binning = self._get_quantity_binning(quantity_name=_var_y, split_dict=_split_dict)
-                    _var_y_subdict = self._root_objects[_split_name].setdefault(_var_y, {})  # ensure '_var_y' subdict exists
-
-                if _obj_type == self.__class__.ObjectType.histogram:
-                    if _var_t is not None:
-                        raise ValueError("4D histogram requested ({}), but this is not supported!".format(_vars_xyzt))
-                    elif _var_z is not None:
-                        # implied -> _var_y is also not `None`
-                        _obj_name = 'h3d_' + _name_suffix
-                        _obj_model = ROOT.RDF.TH3DModel(_obj_name, _title,
-                            len(_x_binning)-1, array('f', _x_binning),
-                            len(_y_binning)-1, array('f', _y_binning),
-                            len(_z_binning)-1, array('f', _z_binning))
-                        if _weight is None:
-                            self._root_objects[_split_name][_var_z][_var_y][_obj_name] = _split_df.Histo3D(_obj_model, _var_x, _var_y, _var_z)
-                        else:
-                            self._root_objects[_split_name][_var_z][_var_y][_obj_name] = _split_df.Histo3D(_obj_model, _var_x, _var_y, _var_z, _weight)
-                    elif _var_y is not None:
-                        _obj_name = 'h2d_' + _name_suffix
-                        _obj_model = ROOT.RDF.TH2DModel(_obj_name, _title,
-                            len(_x_binning)-1, array('f', _x_binning),
-                            len(_y_binning)-1, array('f', _y_binning))
-                        if _weight is None:
-                            self._root_objects[_split_name][_var_y][_obj_name] = _split_df.Histo2D(_obj_model, _var_x, _var_y)
-                        else:
-                            self._root_objects[_split_name][_var_y][_obj_name] = _split_df.Histo2D(_obj_model, _var_x, _var_y, _weight)
+                _path, _obj_name, _title = self._get_object_path_name_title(_obj_type, _vars_xyzt, _weight, _option_string, _split_name)
+
+                # -- determing binnings in 'x' (and 'y', 'z' and 't', if specified)
+                _binnings, _target_binnings = self._get_fill_and_target_binnings(_obj_type, _vars_xyzt, _split_dict)
+
+                # -- reuse cached object, if available
+                _cache_key, _obj = self._get_cached_object(_split_name, _obj_type, _vars_xyzt, _binnings, _weight, _option_string, _obj_name, _title)
+                _booked = _obj is None
+                if _booked:
+                    _obj = self._book_object(_split_df, _obj_type, _obj_name, _title, _vars_xyzt, _binnings, _weight, _option_string)
+                    self._results_to_cache.append((_cache_key, _obj))
+
+                _obj = self._get_output_object(_obj, _obj_name, _title, _binnings, _target_binnings)
+                self._store_object(_split_name, _path, _obj_name, _obj, booked=_booked)
+
+    def _get_split_df_by_filter(self, split_name):
+        '''filter-based data frame for a single split (used when index-based splitting is not possible for an object)'''
+        _split_df = self._filter(self._split_index_df, "{}=={}".format(self._split_index_column, self._get_split_index(split_name)))
+        return _split_df
+
+    def _create_objects_index(self):
+        '''book one object per specification (and binning) with an additional split index axis'''
+        _split_names = sorted(self._splitting_spec.keys())
+        for _split_name in _split_names:
+            self._root_objects[_split_name] = {}
+
+        _filter_dfs = {}
+
+        # edges of the split index axis: one bin per split index
+        _index_edges = [_i - 0.5 for _i in range(self._split_index_size + 1)]
+
+        for _obj_type, _vars_xyzt, _weight, _option_string in self._specs:
+            _var_x, _var_y, _var_z, _var_t = _vars_xyzt
+
+            # -- histograms in sparse mode: one sparse histogram for all splits
+            if self._split_mode == self.__class__.SplitMode.sparse and _obj_type == self.__class__.ObjectType.histogram:
+                self._create_objects_sparse(_split_names, _vars_xyzt, _weight, _option_string)
+                continue
+
+            # group splits with identical binnings
+            _splits_by_binnings = OrderedDict()
+            _target_binnings_by_split = {}
+            for _split_name in _split_names:
+                _binnings, _target_binnings_by_split[_split_name] = self._get_fill_and_target_binnings(
+                    _obj_type, _vars_xyzt, self._get_split_dict_from_split_name(_split_name))
+                _binnings_key = tuple([tuple(_b) if _b is not None else None for _b in _binnings])
+                _splits_by_binnings.setdefault(_binnings_key, (_binnings, []))[1].append(_split_name)
+
+            for _i_group, (_binnings, _group_split_names) in enumerate(_splits_by_binnings.values()):
+                _x_binning, _y_binning, _z_binning, _t_binning = _binnings
+
+                # -- reuse cached objects, if available
+                _group_split_names_uncached = []
+                for _split_name in _group_split_names:
+                    _path, _obj_name, _title = self._get_object_path_name_title(_obj_type, _vars_xyzt, _weight, _option_string, _split_name)
+                    _cache_key, _obj = self._get_cached_object(_split_name, _obj_type, _vars_xyzt, _binnings, _weight, _option_string, _obj_name, _title)
+                    if _obj is None:
+                        _group_split_names_uncached.append((_split_name, _cache_key))
                     else:
-                        _obj_name = 'h_' + _name_suffix
-                        _obj_model = ROOT.RDF.TH1DModel(_obj_name, _title,
-                            len(_x_binning)-1, array('f', _x_binning))
-                        if _weight is None:
-                            self._root_objects[_split_name][_obj_name] = _split_df.Histo1D(_obj_model, _var_x)
-                        else:
-                            self._root_objects[_split_name][_obj_name] = _split_df.Histo1D(_obj_model, _var_x, _weight)
-
-                elif _obj_type == self.__class__.ObjectType.profile:
-                    assert _var_y is not None
-                    if _var_t is not None:
-                        _obj_name = 'p3d_' + _name_suffix
-                        _obj_model = ROOT.RDF.TProfile3DModel(_obj_name, _title,
-                            len(_x_binning)-1, array('d', _x_binning),
-                            len(_y_binning)-1, array('d', _y_binning),
-                            len(_z_binning)-1, array('d', _z_binning),
-                            # profiles may have build options
-                            _option_string or "")
-                        if _weight is None:
-                            self._root_objects[_split_name][_var_t][_var_z][_var_y][_obj_name] = _split_df.Profile3D(_obj_model, _var_x, _var_y, _var_z, _var_t)
-                        else:
-                            self._root_objects[_split_name][_var_t][_var_z][_var_y][_obj_name] = _split_df.Profile3D(_obj_model, _var_x, _var_y, _var_z, _var_t, _weight)
-                    elif _var_z is not None:
-                        _obj_name = 'p2d_' + _name_suffix
-                        _obj_model = ROOT.RDF.TProfile2DModel(_obj_name, _title,
-                            len(_x_binning)-1, array('d', _x_binning),
-                            len(_y_binning)-1, array('d', _y_binning),
-                            # profiles may have build options
-                            _option_string or "")
-                        if _weight is None:
-                            self._root_objects[_split_name][_var_z][_var_y][_obj_name] = _split_df.Profile2D(_obj_model, _var_x, _var_y, _var_z)
-                        else:
-                            self._root_objects[_split_name][_var_z][_var_y][_obj_name] = _split_df.Profile2D(_obj_model, _var_x, _var_y, _var_z, _weight)
+                        _obj = self._get_output_object(_obj, _obj_name, _title, _binnings, _target_binnings_by_split[_split_name])
+                        self._store_object(_split_name, _path, _obj_name, _obj)
+
+                if not _group_split_names_uncached:
+                    continue
+
+                _combined_name = "_".join([_s for _s in ('combined', _var_x, _var_y, _var_z, _var_t, _weight, _option_string, str(_i_group)) if _s is not None])
+
+                # -- book combined object with an additional split index axis (if supported)
+                _combined = None
+                if _obj_type == self.__class__.ObjectType.histogram and _var_z is None and _var_y is None:
+                    _combined = self._book_object(self._split_index_df, _obj_type, _combined_name, _combined_name,
+                        (_var_x, self._split_index_column, None, None), (_x_binning, _index_edges, None, None), _weight, None)
+                    _slicer = self._slice_histogram_2d
+                elif _obj_type == self.__class__.ObjectType.histogram and _var_z is None:
+                    _combined = self._book_object(self._split_index_df, _obj_type, _combined_name, _combined_name,
+                        (_var_x, _var_y, self._split_index_column, None), (_x_binning, _y_binning, _index_edges, None), _weight, None)
+                    _slicer = self._slice_histogram_3d
+                elif _obj_type == self.__class__.ObjectType.profile and _var_z is None:
+                    _combined = self._book_object(self._split_index_df, _obj_type, _combined_name, _combined_name,
+                        (_var_x, self._split_index_column, _var_y, None), (_x_binning, _index_edges, None, None), _weight, _option_string)
+                    _slicer = self._slice_profile_2d
+
+                for _split_name, _cache_key in _group_split_names_uncached:
+                    _path, _obj_name, _title = self._get_object_path_name_title(_obj_type, _vars_xyzt, _weight, _option_string, _split_name)
+
+                    if _combined is not None:
+                        _obj = _DerivedObject(
+                            functools.partial(_slicer, _combined, self._get_split_index(_split_name) + 1),
+                            _obj_name, _title)
                     else:
-                        _obj_name = 'p_' + _name_suffix
-                        _obj_model = ROOT.RDF.TProfile1DModel(_obj_name, _title,
-                            len(_x_binning)-1, array('d', _x_binning),
-                            # profiles may have build options
-                            _option_string or "")
-                        if _weight is None:
-                            self._root_objects[_split_name][_var_y][_obj_name] = _split_df.Profile1D(_obj_model, _var_x, _var_y)
-                        else:
-                            self._root_objects[_split_name][_var_y][_obj_name] = _split_df.Profile1D(_obj_model, _var_x, _var_y, _weight)
+                        # no split axis available for this object type: book separately on a filtered data frame
+                        if _split_name not in _filter_dfs:
+                            _filter_dfs[_split_name] = self._get_split_df_by_filter(_split_name)
+                        _obj = self._book_object(_filter_dfs[_split_name], _obj_type, _obj_name, _title, _vars_xyzt, _binnings, _weight, _option_string)
+
+                    self._results_to_cache.append((_cache_key, _obj))
+                    _obj = self._get_output_object(_obj, _obj_name, _title, _binnings, _target_binnings_by_split[_split_name])
+                    self._store_object(_split_name, _path, _obj_name, _obj, booked=True)
+
+    def _get_sparse_df(self):
+        '''data frame with the events that belong to any split (events outside all splits need not be stored)'''
+        if self._sparse_df is None:
+            self._sparse_df = self._filter(self._split_index_df, "{} >= 0".format(self._split_index_column))
+        return self._sparse_df
+
+    def _book_sparse_histogram(self, name, vars_xyz, binnings, weight, split_labels):
+        '''book a `THnSparseD` with axes for the quantities in `vars_xyz` and an additional split index axis,
+        whose bins are labeled by `split_labels` (a dict mapping split indices to split names)'''
+        _binnings = list(binnings) + [[_i - 0.5 for _i in range(self._split_index_size + 1)]]
+        _n_dims = len(_binnings)
+        _model = ROOT.THnSparseD(name, name, _n_dims,
+            array('i', [len(_b) - 1 for _b in _binnings]),
+            array('d', [_b[0] for _b in _binnings]),
+            array('d', [_b[-1] for _b in _binnings]))
+        for _i_axis, _binning in enumerate(_binnings[:-1]):
+            _model.GetAxis(_i_axis).Set(len(_binning) - 1, array('d', _binning))
+            _model.GetAxis(_i_axis).SetName(vars_xyz[_i_axis])
+        _model.GetAxis(_n_dims - 1).SetName("split")
+        for _split_index, _split_label in split_labels.iteritems():
+            _model.GetAxis(_n_dims - 1).SetBinLabel(_split_index + 1, _split_label)
+        _model.Sumw2()
+
+        # all coordinates are passed to the action as a single column
+        _coordinates_column = "_sparse_coordinates_{}".format(name)
+        _weight_column = "_sparse_weight_{}".format(name)
+        _df = self._get_sparse_df()
+        _df = self._define(_df, _coordinates_column, "ROOT::RVec<double>{{{}}}".format(
+            ", ".join(["static_cast<double>({})".format(self._get_column(_v)) for _v in list(vars_xyz) + [self._split_index_column]])))
+        _df = self._define(_df, _weight_column, "static_cast<double>({})".format(self._get_column(weight)) if weight is not None else "1.0")
+
+        return ROOT.karma.lumberjack.bookSparseHistogram(ROOT.RDF.AsRNode(_df), _model, _coordinates_column, _weight_column)
+
+    def _create_objects_sparse(self, split_names, vars_xyzt, weight, option_string):
+        '''book one sparse histogram per binning for all splits and register the per-split objects expanded from it'''
+        _obj_type = self.__class__.ObjectType.histogram
+        _vars_xyz = tuple([_v for _v in vars_xyzt[:3] if _v is not None])
+
+        # group splits with identical binnings
+        _splits_by_binnings = OrderedDict()
+        _target_binnings_by_split = {}
+        for _split_name in split_names:
+            _binnings, _target_binnings_by_split[_split_name] = self._get_fill_and_target_binnings(
+                _obj_type, vars_xyzt, self._get_split_dict_from_split_name(_split_name))
+            _binnings_key = tuple([tuple(_b) if _b is not None else None for _b in _binnings])
+            _splits_by_binnings.setdefault(_binnings_key, (_binnings, []))[1].append(_split_name)
+
+        for _i_group, (_binnings, _group_split_names) in enumerate(_splits_by_binnings.values()):
+            # -- reuse cached objects, if available (not when writing sparse histograms directly)
+            _group_split_names_uncached = []
+            for _split_name in _group_split_names:
+                _path, _obj_name, _title = self._get_object_path_name_title(_obj_type, vars_xyzt, weight, option_string, _split_name)
+                if self._write_sparse:
+                    _group_split_names_uncached.append((_split_name, None))
+                    continue
+                _cache_key, _obj = self._get_cached_object(_split_name, _obj_type, vars_xyzt, _binnings, weight, option_string, _obj_name, _title)
+                if _obj is None:
+                    _group_split_names_uncached.append((_split_name, _cache_key))
+                else:
+                    _obj = self._get_output_object(_obj, _obj_name, _title, _binnings, _target_binnings_by_split[_split_name])
+                    self._store_object(_split_name, _path, _obj_name, _obj)
+
+            if not _group_split_names_uncached:
+                continue
+
+            _sparse_name = "_".join([_s for _s in ('sparse',) + _vars_xyz + (weight, str(_i_group)) if _s is not None])
+            _sparse = self._book_sparse_histogram(
+                _sparse_name, _vars_xyz, _binnings[:len(_vars_xyz)], weight,
+                {self._get_split_index(_split_name): _split_name for _split_name, _ in _group_split_names_uncached})
+
+            if self._write_sparse:
+                self._store_object(self.__class__._SPARSE_SPLIT_NAME, [], _sparse_name, _sparse, booked=True)
+                continue
+
+            _expansion = _SparseHistogramExpansion(_sparse, _binnings[:len(_vars_xyz)],
+                [self._get_split_index(_split_name) for _split_name, _ in _group_split_names_uncached])
+            for _split_name, _cache_key in _group_split_names_uncached:
+                _path, _obj_name, _title = self._get_object_path_name_title(_obj_type, vars_xyzt, weight, option_string, _split_name)
+                _obj = _DerivedObject(
+                    functools.partial(_expansion.get, self._get_split_index(_split_name)),
+                    _obj_name, _title)
+                self._results_to_cache.append((_cache_key, _obj))
+                _obj = self._get_output_object(_obj, _obj_name, _title, _binnings, _target_binnings_by_split[_split_name])
+                self._store_object(_split_name, _path, _obj_name, _obj, booked=True)
+
+    # -- functions for slicing combined objects at write time
+
+    @staticmethod
+    def _slice_histogram_2d(combined, split_bin):
+        return combined.GetPtr().ProjectionX(uuid.uuid4().hex, split_bin, split_bin, "e")
 
+    @staticmethod
+    def _slice_histogram_3d(combined, split_bin):
+        _h3 = combined.GetPtr()
+        _h3.GetZaxis().SetRange(split_bin, split_bin)
+        _h2 = _h3.Project3D("yxe")
+        _h2.SetName(uuid.uuid4().hex)
+        _h3.GetZaxis().SetRange()  # reset range
+        return _h2
+
+    @staticmethod
+    def _slice_profile_2d(combined, split_bin):
+        return combined.GetPtr().ProfileX(uuid.uuid4().hex, split_bin, split_bin)
+
+    # approximate memory per bin: contents and sums of squared weights (histograms), plus
+    # bin entries and their sums of squared weights (profiles)
+    _BYTES_PER_BIN = {
+        ObjectType.histogram: 16,
+        ObjectType.profile: 32,
+    }
+
+    # buffer size per exported column and slot (default basket size of the temporary trees)
+    _BYTES_PER_EXPORT_COLUMN = 32000
+
+    def estimate_memory(self, n_slots=1):
+        """Estimate the memory (in bytes) needed for filling the requested histograms, profiles and exports.
+
+        The estimate is computed from the binnings of all objects in all splits. Every processing
+        slot fills its own copy of each object, so the result scales with `n_slots`. Histograms
+        filled in a batch of several weights need one additional copy for the merged result.
+        Histograms in `SplitMode.sparse` only use memory for filled bins and are not included.
+        Exported values are buffered per column, split and slot before being written to disk.
+        Objects booked for variations are not included (see `add_variation`).
+        """
+        # number of weighted histograms differing only in their weights
+        _n_batch_members = {}
+        if self._batch_weights:
+            for _obj_type, _vars_xyzt, _weight, _option_string in self._specs:
+                if _obj_type == self.__class__.ObjectType.histogram and _weight is not None:
+                    _n_batch_members[_vars_xyzt] = _n_batch_members.get(_vars_xyzt, 0) + 1
+
+        _n_bytes = 0
+        for _obj_type, _vars_xyzt, _weight, _option_string in self._specs:
+            if self._split_mode == self.__class__.SplitMode.sparse and _obj_type == self.__class__.ObjectType.histogram:
+                continue
+
+            _n_copies = n_slots
+            if _obj_type == self.__class__.ObjectType.histogram and _weight is not None and _n_batch_members.get(_vars_xyzt, 0) > 1:
+                _n_copies += 1
+
+            # the last quantity of a profile is averaged, not binned
+            _n_binned_axes = len([_var for _var in _vars_xyzt if _var is not None])
+            if _obj_type == self.__class__.ObjectType.profile:
+                _n_binned_axes -= 1
+
+            for _split_name in self._splitting_spec:
+                _binnings, _ = self._get_fill_and_target_binnings(_obj_type, _vars_xyzt, self._get_split_dict_from_split_name(_split_name))
+                # include under- and overflow bins
+                _n_bins = np.prod([len(_binning) + 1 for _binning in _binnings[:_n_binned_axes]])
+                _n_bytes += _n_bins * self._BYTES_PER_BIN[_obj_type] * _n_copies
+
+        for _vars, _weight in self._export_specs:
+            _n_columns = len(_vars) + (_weight is not None)
+            _n_bytes += _n_columns * len(self._splitting_spec) * self._BYTES_PER_EXPORT_COLUMN * n_slots
+
+        return _n_bytes
 
     def add_histograms(self, histogram_specs):
         for _hspec in histogram_specs:
@@ -236,6 +1216,15 @@ class PostProcessor(object):
 
             self._specs.append((self.__class__.ObjectType.histogram, (_x, _y, _z, _t), _weight_spec, None))
 
+    def add_exports(self, export_specs):
+        """Request the values of quantities to be exported (spec: 'q1[:q2[:...]][@weight]')."""
+        for _espec in export_specs:
+            _weight_spec = None
+            if '@' in _espec:
+                _espec, _weight_spec = _espec.split('@', 1)
+
+            self._export_specs.append((tuple(_espec.split(':')), _weight_spec))
+
     def add_profiles(self, profile_specs):
         for _pspec in profile_specs:
             # determine weights and build options
@@ -254,45 +1243,206 @@ class PostProcessor(object):
 
             self._specs.append((self.__class__.ObjectType.profile, (_x, _y, _z, _t), _weight_spec or None, _option_string or None))
 
-    @staticmethod
-    def _write_output_recursively(object_or_dict, output_file, output_path):
-        '''write `object_or_dict` to path `output_path` if ROOT object or call recursively for all subobjects'''
-
-        # write out ROOT objects
-        if isinstance(object_or_dict, dict):
-            # sort dict, so that the output inside the root file is sorted
-            _od = OrderedDict(sorted(object_or_dict.iteritems()))
-            # create the output directory inside the ROOT file (if it does not exist)
-            if not output_file.GetDirectory(output_path):
-                output_file.mkdir(output_path)
-            # recurse through all the subdictionaries
-            for _subkey, _subobject_or_dict in _od.iteritems():
-                _subdir = "{}/{}".format(output_path, _subkey)
-                PostProcessor._write_output_recursively(_subobject_or_dict, output_file, _subdir)
-        else:
-            # write out the ROOT objects to the output directory
-            _output_dir = '/'.join(output_path.split('/')[:-1])
-            if _output_dir:
-                output_file.cd(_output_dir)
-            object_or_dict.Write()
+    def _create_exports(self):
+        '''book the writing of the values of exported quantities for each split to temporary ROOT files'''
+        self._exports = {}
+        if not self._export_specs:
+            return
 
-    def run(self, output_file_path):
+        self._declare_cpp_helpers()
+        self._export_tmp_dir = tempfile.mkdtemp(prefix='lumberjack_export_')
 
-        if not self._specs:
-            print("[WARNING] No histograms and/or profiles booked for output. No file written.")
-            return
+        # written lazily, in the same event loop as the other objects
+        _snapshot_options = ROOT.RDF.RSnapshotOptions()
+        _snapshot_options.fLazy = True
+
+        for _i_split, _split_name in enumerate(sorted(self._splitting_spec.keys())):
+            if self._uses_split_index():
+                _split_df = self._get_split_df_by_filter(_split_name)
+            else:
+                _split_df = self._split_dfs[_split_name]
+
+            for _i_export, (_vars, _weight) in enumerate(self._export_specs):
+                _name = 'e_' + '_'.join(_vars + ((_weight,) if _weight is not None else ()))
+                _columns = list(_vars) + ([_weight] if _weight is not None else [])
+
+                # exported columns: (name in output, branch name, type)
+                _branches = []
+                for _column in _columns:
+                    _column_type = str(self._df_bare.GetColumnType(self._get_column(_column)))
+                    if 'vector' in _column_type or 'RVec' in _column_type:
+                        raise ValueError("Cannot export column '{}' of non-scalar type '{}'".format(_column, _column_type))
+                    _branches.append((_column, self._get_column(_column), _column_type))
+
+                _branch_names = ROOT.std.vector('string')()
+                for _, _branch_name, _ in _branches:
+                    _branch_names.push_back(_branch_name)
+
+                _file_path = os.path.join(self._export_tmp_dir, "{}_{}.root".format(_i_split, _i_export))
+                _snapshot = _split_df.Snapshot("exports", _file_path, _branch_names, _snapshot_options)
+                self._exports[(_split_name, _name)] = (_snapshot, _file_path, _branches)
+
+    def _write_exports(self, export_dir):
+        '''write the values of exported quantities to files, splitting them into chunks of at most `export_chunk_size` rows.
+        The values are read from the temporary files chunk by chunk, so only one chunk is held in memory at a time.'''
+        for (_split_name, _name), (_, _tmp_file_path, _branches) in sorted(self._exports.items()):
+            _dir = os.path.join(export_dir, self._get_directory_from_split_name(_split_name))
+            make_directory(_dir, exist_ok=True)
+
+            _tmp_file = ROOT.TFile(_tmp_file_path, "READ")
+            _tree = _tmp_file.Get("exports") if _tmp_file and not _tmp_file.IsZombie() else None
+            _n_rows = _tree.GetEntries() if _tree else 0
+
+            # always write at least one (possibly empty) chunk
+            for _i_chunk, _start in enumerate(range(0, max(_n_rows, 1), self._export_chunk_size)):
+                _chunk = OrderedDict([
+                    (_column, np.array(ROOT.karma.lumberjack.readBranchChunk[_column_type](_tree, _branch_name, _start, self._export_chunk_size)
+                                       if _tree else []))
+                    for _column, _branch_name, _column_type in _branches
+                ])
+                _file_path = os.path.join(_dir, "{}_{:04d}.{}".format(_name, _i_chunk, self._export_format))
+                if self._export_format == 'parquet':
+                    import pyarrow
+                    import pyarrow.parquet
+                    pyarrow.parquet.write_table(pyarrow.Table.from_arrays(list(_chunk.values()), names=list(_chunk.keys())), _file_path)
+                else:
+                    np.savez(_file_path, **_chunk)
+
+            if _tmp_file:
+                _tmp_file.Close()
+
+        if self._export_tmp_dir is not None:
+            shutil.rmtree(self._export_tmp_dir)
+            self._export_tmp_dir = None
+
+    def book(self):
+        """Book all requested objects on the data frame, without triggering the event loop.
+
+        Returns `False` if no objects have been requested, `True` otherwise."""
+
+        if not self._specs and not self._export_specs:
+            print("[WARNING] No histograms, profiles or exports booked for output. No file written.")
+            return False
+
+        self._book_objects()
+        for _name, _variation in self._variations.iteritems():
+            print("[INFO] Booking objects for variation '{}'...".format(_name))
+            _variation._book_objects()
+
+        if self._result_cache is not None:
+            _n_booked = len(self._results_to_cache) + sum([len(_variation._results_to_cache) for _variation in self._variations.values()])
+            print("[INFO] Result cache: reusing {} object(s), booking {} object(s)".format(
+                self.get_number_of_objects() - _n_booked, _n_booked))
+
+        if self._profiler is not None:
+            self._profiler.add_actions(self.get_booked_objects())
+
+        return True
+
+    def _book_objects(self):
+        '''split the data frame and book the objects and exports'''
+        if self._batch_weights and not hasattr(ROOT.RDF, 'AsRNode'):
+            print("[WARNING] ROOT version {} does not support booking custom actions on data frames. "
+                  "Booking one object per weight.".format(ROOT.gROOT.GetVersion()))
+            self._batch_weights = False
 
         self._split_df()
         self._create_objects()
+        self._book_weight_batches()
+        self._create_exports()
 
-        _outfile = ROOT.TFile(output_file_path, "RECREATE")
-        _split_names = set(self._root_objects.keys())
+    def add_variation(self, name, post_processor):
+        """Add a post-processor for a systematic variation, set up with the same object specifications on the
+        data frame for the variation. Its objects are booked and written together with the objects of this
+        post-processor, and placed in the subdirectory `variations/<name>` of the output file."""
+        self._variations[name] = post_processor
 
-        for _split_name in sorted(_split_names):
-            _directory_path = self._get_directory_from_split_name(_split_name)
-            _object_or_dict = self._root_objects.get(_split_name, {})
+    @staticmethod
+    def _get_variation_directory(name):
+        return "variations/{}".format(name)
+
+    def get_booked_objects(self):
+        """List of `(path, object)` pairs for all objects filled in the event loop (i.e. not taken from the result cache)."""
+        _booked_ids = self._booked_output_ids
+
+        def _collect(object_or_dict, path):
+            if isinstance(object_or_dict, dict):
+                _objects = []
+                for _key in sorted(object_or_dict.keys()):
+                    _objects.extend(_collect(object_or_dict[_key], path + [_key]))
+                return _objects
+            if id(object_or_dict) in _booked_ids:
+                return [('/'.join(path), object_or_dict)]
+            return []
+
+        _objects = []
+        for _split_name in sorted(self._root_objects.keys()):
+            _objects.extend(_collect(self._root_objects[_split_name], [self._get_directory_from_split_name(_split_name)]))
+        for _name, _variation in self._variations.iteritems():
+            _objects.extend([
+                ("{}/{}".format(self._get_variation_directory(_name), _path), _obj)
+                for _path, _obj in _variation.get_booked_objects()
+            ])
+        return _objects
+
+    def get_number_of_objects(self):
+        """Total number of output objects."""
+        def _count(object_or_dict):
+            if isinstance(object_or_dict, dict):
+                return sum([_count(_v) for _v in object_or_dict.values()])
+            return 1
+        return _count(self._root_objects) + sum([_variation.get_number_of_objects() for _variation in self._variations.values()])
+
+    def has_booked_objects(self):
+        """Whether any objects need to be filled in the event loop (i.e. were not taken from the result cache)."""
+        return bool(self._booked_output_ids) or bool(self._exports) or any([_variation.has_booked_objects() for _variation in self._variations.values()])
+
+    def write(self, output_file_path):
+        """Write all booked objects to a ROOT file. Triggers the event loop if it has not been run yet."""
 
-            PostProcessor._write_output_recursively(_object_or_dict, _outfile, _directory_path)
+        _outfile = open_output_file(output_file_path, self._compression_algorithm, self._compression_level)
+        _writer = ObjectTreeWriter(_outfile, transform=self._scale_to_sample_fraction if self._sample_fraction is not None else None)
+
+        self._write_objects(_writer)
+        for _name, _variation in self._variations.iteritems():
+            _variation._write_objects(_writer, self._get_variation_directory(_name))
+
+        # tag output produced from a sample of the entries
+        if self._sample_fraction is not None:
+            _outfile.WriteTObject(ROOT.TNamed("sample_fraction", repr(self._sample_fraction)), "sample_fraction")
 
         _outfile.Close()
 
+        # exported quantities are written to a directory next to the output file
+        _export_dir = self.get_export_directory(output_file_path)
+        if self._exports:
+            print("[INFO] Writing exported quantities to directory: {}".format(_export_dir))
+            self._write_exports(_export_dir)
+        for _name, _variation in self._variations.iteritems():
+            if _variation._exports:
+                _variation._write_exports(os.path.join(_export_dir, self._get_variation_directory(_name)))
+
+        # store newly filled objects in the result cache
+        for _post_processor in [self] + list(self._variations.values()):
+            if _post_processor._result_cache is not None:
+                _post_processor._result_cache.store([(_key, _obj.GetPtr()) for _key, _obj in _post_processor._results_to_cache])
+
+    def _write_objects(self, writer, path=''):
+        '''write the objects of all splits to the directory at `path` via `writer` (an `ObjectTreeWriter`)'''
+        for _split_name in sorted(self._root_objects.keys()):
+            writer.write(self._root_objects[_split_name], "/".join([_p for _p in (path, self._get_directory_from_split_name(_split_name)) if _p]))
+
+    def _scale_to_sample_fraction(self, obj):
+        '''copy of a histogram scaled by the inverse of the sample fraction (profiles are returned unchanged)'''
+        if isinstance(obj, (ROOT.TProfile, ROOT.TProfile2D, ROOT.TProfile3D)) or not isinstance(obj, (ROOT.TH1, ROOT.THnBase)):
+            return obj
+        _scaled = obj.Clone()
+        if isinstance(_scaled, ROOT.TH1):
+            _scaled.SetDirectory(0)
+        _scaled.Scale(1.0 / self._sample_fraction)
+        return _scaled
+
+    def run(self, output_file_path):
+        """Book all requested objects, run the event loop and write the objects to a ROOT file."""
+        if self.book():
+            self.write(output_file_path)
@@ -0,0 +1,255 @@
+from __future__ import print_function
+
+import json
+import ROOT
+import yaml
+
+from collections import OrderedDict
+
+from ._core import _RE_RETURN
+
+
+__all__ = ['DataFrameProfiler']
+
+
+class DataFrameProfiler(object):
+    """Collects per-node statistics for the Defines, Filters and actions booked on a data frame.
+
+    Defines and Filters registered via the profiler are wrapped in a call to a
+    C++ helper, which counts the number of times the node is evaluated (and,
+    for filters, how often it passes) and measures the time spent evaluating
+    the expression. Counters are kept separately for each processing slot, so
+    no locking is needed in the event loop.
+
+    The time spent in booked actions (filling histograms/profiles) cannot be
+    measured directly. It is estimated by distributing the remaining event loop
+    time (after subtracting the time spent in Defines and Filters) among the
+    actions, in proportion to the number of entries filled.
+    """
+
+    _CPP_HELPERS = """
+    #include <chrono>
+    #include <deque>
+    #include <vector>
+
+    namespace karma {
+    namespace lumberjack {
+    namespace profiling {
+
+        // counters for one slot, on their own cache line to avoid false sharing
+        struct alignas(64) SlotStats {
+            ULong64_t calls = 0;
+            ULong64_t passed = 0;
+            ULong64_t nanoseconds = 0;
+        };
+
+        struct NodeStats {
+            NodeStats(unsigned int nSlots) : slots(nSlots) {}
+            std::vector<SlotStats> slots;
+        };
+
+        std::deque<NodeStats> gNodeStats;
+
+        unsigned int RegisterNode(unsigned int nSlots) {
+            gNodeStats.emplace_back(nSlots);
+            return gNodeStats.size() - 1;
+        }
+
+        ULong64_t GetCalls(unsigned int id) {
+            ULong64_t total = 0;
+            for (const auto& stats : gNodeStats[id].slots) total += stats.calls;
+            return total;
+        }
+
+        ULong64_t GetPassed(unsigned int id) {
+            ULong64_t total = 0;
+            for (const auto& stats : gNodeStats[id].slots) total += stats.passed;
+            return total;
+        }
+
+        ULong64_t GetNanoseconds(unsigned int id) {
+            ULong64_t total = 0;
+            for (const auto& stats : gNodeStats[id].slots) total += stats.nanoseconds;
+            return total;
+        }
+
+        void ResetNode(unsigned int id) {
+            for (auto& stats : gNodeStats[id].slots)
+                stats = SlotStats();
+        }
+
+        template <typename F>
+        auto TimeDefine(unsigned int slot, unsigned int id, F&& f) -> decltype(f()) {
+            auto& stats = gNodeStats[id].slots[slot];
+            const auto start = std::chrono::steady_clock::now();
+            auto result = f();
+            stats.nanoseconds += std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - start).count();
+            ++stats.calls;
+            return result;
+        }
+
+        template <typename F>
+        bool TimeFilter(unsigned int slot, unsigned int id, F&& f) {
+            auto& stats = gNodeStats[id].slots[slot];
+            const auto start = std::chrono::steady_clock::now();
+            const bool result = f();
+            stats.nanoseconds += std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - start).count();
+            ++stats.calls;
+            if (result)
+                ++stats.passed;
+            return result;
+        }
+
+    }  // namespace profiling
+    }  // namespace lumberjack
+    }  // namespace karma
+    """
+
+    _cpp_helpers_declared = False
+
+    def __init__(self):
+        if not DataFrameProfiler._cpp_helpers_declared:
+            ROOT.gInterpreter.Declare(self._CPP_HELPERS)
+            DataFrameProfiler._cpp_helpers_declared = True
+
+        self._n_slots = max(ROOT.ROOT.GetImplicitMTPoolSize(), 1)
+        self._nodes = []
+        self._actions = []
+        self._scope = None
+
+    def set_scope(self, scope):
+        '''nodes and actions registered after this call are attributed to `scope` (e.g. a task name)'''
+        self._scope = scope
+
+    @staticmethod
+    def _wrap_expression(expression):
+        '''wrap an expression in a lambda (expressions containing `return` are function bodies)'''
+        if _RE_RETURN.search(expression):
+            return "[&]() {{ {} }}".format(expression)
+        return "[&]() {{ return ({}); }}".format(expression)
+
+    def _register_node(self, kind, category, name, expression):
+        _id = ROOT.karma.lumberjack.profiling.RegisterNode(self._n_slots)
+        self._nodes.append(dict(
+            id=_id,
+            scope=self._scope,
+            kind=kind,
+            category=category,
+            name=name,
+            expression=expression,
+        ))
+        return _id
+
+    def define(self, data_frame, name, expression, category):
+        '''book a profiled Define on `data_frame`'''
+        _id = self._register_node('define', category, name, expression)
+        return data_frame.Define(name, "karma::lumberjack::profiling::TimeDefine(rdfslot_, {}, {})".format(
+            _id, self._wrap_expression(expression)))
+
+    def filter(self, data_frame, expression, category, name=None):
+        '''book a profiled Filter on `data_frame`'''
+        _id = self._register_node('filter', category, name, expression)
+        _filter_expression = "karma::lumberjack::profiling::TimeFilter(rdfslot_, {}, {})".format(
+            _id, self._wrap_expression(expression))
+        if name is not None:
+            return data_frame.Filter(_filter_expression, name)
+        return data_frame.Filter(_filter_expression)
+
+    def reset(self):
+        '''reset the statistics of all nodes registered via this profiler'''
+        for _node in self._nodes:
+            ROOT.karma.lumberjack.profiling.ResetNode(_node['id'])
+
+    def get_node_stats(self):
+        '''list of dictionaries with the number of calls, passed events and seconds spent, for each registered node'''
+        return [
+            dict(
+                _node,
+                calls=int(ROOT.karma.lumberjack.profiling.GetCalls(_node['id'])),
+                passed=int(ROOT.karma.lumberjack.profiling.GetPassed(_node['id'])),
+                seconds=ROOT.karma.lumberjack.profiling.GetNanoseconds(_node['id']) * 1e-9,
+            )
+            for _node in self._nodes
+        ]
+
+    def add_actions(self, names_and_objects):
+        '''register booked actions (histograms, profiles) as (name, result) pairs'''
+        for _name, _obj in names_and_objects:
+            self._actions.append(dict(scope=self._scope, name=_name, result=_obj))
+
+    def get_report(self, scope, event_loop_seconds, cutflow_report=None):
+        '''compile the profiling report for the nodes and actions in `scope` (and those not attributed to any scope)'''
+
+        # -- Defines and Filters
+        _nodes = []
+        _node_seconds_all_scopes = 0.0
+        for _node in self.get_node_stats():
+            _seconds = _node['seconds']
+            _node_seconds_all_scopes += _seconds
+            if _node['scope'] not in (None, scope):
+                continue
+
+            _calls = _node['calls']
+            _entry = OrderedDict([
+                ('kind', _node['kind']),
+                ('category', _node['category']),
+                ('name', _node['name']),
+                ('expression', _node['expression']),
+                ('events_processed', _calls),
+            ])
+            if _node['kind'] == 'filter':
+                _passed = _node['passed']
+                _entry['events_passed'] = _passed
+                _entry['pass_fraction'] = float(_passed) / _calls if _calls else None
+            _entry['cpu_seconds'] = _seconds
+            _entry['cpu_microseconds_per_event'] = 1e6 * _seconds / _calls if _calls else None
+            _nodes.append(_entry)
+
+        # -- actions: distribute remaining time according to the number of entries
+        _action_entries = [_action['result'].GetPtr().GetEntries() for _action in self._actions]
+        _total_entries = sum(_action_entries)
+        _remaining_seconds = max(event_loop_seconds * self._n_slots - _node_seconds_all_scopes, 0.0)
+
+        _actions = []
+        for _action, _entries in zip(self._actions, _action_entries):
+            if _action['scope'] not in (None, scope):
+                continue
+            _actions.append(OrderedDict([
+                ('name', _action['name']),
+                ('entries', int(_entries)),
+                ('estimated_cpu_seconds', _remaining_seconds * _entries / _total_entries if _total_entries else 0.0),
+            ]))
+
+        _report = OrderedDict([
+            ('scope', scope),
+            ('slots', self._n_slots),
+            ('event_loop_seconds', event_loop_seconds),
+        ])
+
+        # -- cumulative cut-flow of named filters, as reported by RDataFrame
+        if cutflow_report is not None:
+            _report['cutflow'] = [
+                OrderedDict([
+                    ('name', _cut.GetName()),
+                    ('events_processed', int(_cut.GetAll())),
+                    ('events_passed', int(_cut.GetPass())),
+                    ('pass_fraction', float(_cut.GetEff()) / 100.0),
+                ])
+                for _cut in cutflow_report.GetValue()
+            ]
+
+        _report['nodes'] = _nodes
+        _report['actions'] = _actions
+
+        return _report
+
+    @staticmethod
+    def write_report(report, file_path):
+        '''write a profiling report to a YAML or JSON file, depending on the file extension'''
+        # convert to built-in types for serialization
+        _report = json.loads(json.dumps(report))
+        with open(file_path, 'w') as _f:
+            if file_path.endswith('.json'):
+                json.dump(_report, _f, indent=2)
+            else:
+                yaml.safe_dump(_report, _f, default_flow_style=False)
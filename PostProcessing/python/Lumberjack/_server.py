@@ -0,0 +1,203 @@
+from __future__ import print_function
+
+import gc
+import json
+import os
+import socket
+import sys
+import traceback
+
+from collections import OrderedDict
+
+
+__all__ = ['LumberjackServer', 'WarmState']
+
+
+class WarmState(object):
+    """State kept in memory by a `LumberjackServer` across requests.
+
+    Contains the interpreter setup steps already run (e.g. declaring ROOT macros),
+    the bare data frames for each set of input files and the data frames with all
+    defines and global selections applied, so that the expressions compiled for
+    these nodes can be reused by subsequent requests.
+
+    Bare data frames are kept for at most `max_data_frames` sets of input files, and
+    prepared data frames for at most `max_data_frames` sets of defines and selections
+    per set of input files. The least recently used ones are discarded first. Since
+    each request books new actions on the kept data frames, which are only released
+    together with the data frame, a bare data frame is set up again from scratch after
+    it has been used for `max_requests` requests.
+    """
+
+    def __init__(self, max_data_frames=4, max_requests=20):
+        self.interpreter_setup = set()
+        self._max_data_frames = max_data_frames
+        self._max_requests = max_requests
+        # input key -> dict(bare=..., data_frames=OrderedDict(key -> attributes), n_requests=...)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        '''number of sets of input files for which data frames are kept'''
+        return len(self._entries)
+
+    @staticmethod
+    def _touch(ordered_dict, key):
+        '''mark `key` as the most recently used item of `ordered_dict`'''
+        ordered_dict[key] = ordered_dict.pop(key)
+
+    def _discard_least_recently_used(self, ordered_dict):
+        while len(ordered_dict) > self._max_data_frames:
+            ordered_dict.popitem(last=False)
+
+    def get_bare_data_frame(self, input_key):
+        '''bare data frame kept for the input files identified by `input_key`, as a tuple
+        (data frame, size, input chain). Returns `None` if there is none or if it has
+        already been used for the maximum number of requests.'''
+        _entry = self._entries.get(input_key)
+        if _entry is None:
+            return None
+        if _entry['n_requests'] >= self._max_requests:
+            # release the data frame together with all nodes booked on it
+            del self._entries[input_key]
+            return None
+        _entry['n_requests'] += 1
+        self._touch(self._entries, input_key)
+        return _entry['bare']
+
+    def set_bare_data_frame(self, input_key, bare_data_frame):
+        '''keep a bare data frame (tuple of data frame, size and input chain) for `input_key`'''
+        self._entries.pop(input_key, None)
+        self._entries[input_key] = dict(bare=bare_data_frame, data_frames=OrderedDict(), n_requests=1)
+        self._discard_least_recently_used(self._entries)
+
+    def get_data_frame(self, input_key, key):
+        '''attributes of the prepared data frame identified by `key` for the input files
+        identified by `input_key`, or `None` if there is none'''
+        _data_frames = self._entries[input_key]['data_frames'] if input_key in self._entries else {}
+        if key not in _data_frames:
+            return None
+        self._touch(_data_frames, key)
+        return _data_frames[key]
+
+    def set_data_frame(self, input_key, key, attributes):
+        '''keep the attributes of a prepared data frame for `key`, if the bare data frame
+        for `input_key` is kept'''
+        if input_key not in self._entries:
+            return
+        _data_frames = self._entries[input_key]['data_frames']
+        _data_frames[key] = attributes
+        self._discard_least_recently_used(_data_frames)
+
+
+class _ConnectionStream(object):
+    """File-like object sending all output written to it to a client, as one JSON message per write."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._closed = False
+
+    def write(self, text):
+        if self._closed or not text:
+            return
+        try:
+            self._connection.sendall(json.dumps(dict(output=text)) + "\n")
+        except socket.error:
+            # client has gone away: discard further output
+            self._closed = True
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class LumberjackServer(object):
+    """Processes Lumberjack requests sent via a local UNIX socket in a single long-lived process.
+
+    Each request consists of the command-line arguments of a Lumberjack invocation
+    and the working directory of the client. Requests are processed one at a time,
+    exactly as `lumberjack.py` would process them, with all output sent back to the
+    client. The ROOT interpreter, the analysis configuration modules and the prepared
+    data frames (see `WarmState`) are kept across requests, so that repeated requests
+    do not need to compile the same expressions again. All other objects created for a
+    request (e.g. its booked results) are released once the request is finished.
+
+    Only output written via Python is forwarded to the client. Output written by
+    C++ code (e.g. ROOT warnings) appears in the output of the server process.
+    """
+
+    def __init__(self, socket_path, max_data_frames=4, max_requests=20):
+        self._socket_path = os.path.abspath(socket_path)
+        self._warm_state = WarmState(max_data_frames=max_data_frames, max_requests=max_requests)
+
+    def serve_forever(self):
+        '''listen for requests until interrupted'''
+        import ROOT  # import once, before the first request
+        ROOT.gROOT.SetBatch(True)
+
+        # remove socket left over from a previous server
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+
+        _server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        _server_socket.bind(self._socket_path)
+        _server_socket.listen(1)
+        print("[INFO] Lumberjack server listening on socket: {}".format(self._socket_path))
+
+        try:
+            while True:
+                _connection, _ = _server_socket.accept()
+                try:
+                    self._handle_request(_connection)
+                finally:
+                    _connection.close()
+        except KeyboardInterrupt:
+            print("[INFO] Shutting down Lumberjack server...")
+        finally:
+            _server_socket.close()
+            os.remove(self._socket_path)
+
+    def _handle_request(self, connection):
+        '''run a single request and send its output and exit code to the client'''
+        from ._ui import LumberjackCLI
+
+        _request = json.loads(connection.makefile('r').readline() or 'null')
+        if not _request:
+            return
+
+        _argv = [str(_arg) for _arg in _request['argv']]
+        print("[INFO] Processing request: {}".format(" ".join(_argv)))
+
+        _stream = _ConnectionStream(connection)
+        _cli = None
+        _old_stdout, _old_stderr, _old_cwd = sys.stdout, sys.stderr, os.getcwd()
+        sys.stdout = sys.stderr = _stream
+        try:
+            os.chdir(_request['cwd'])
+            _cli = LumberjackCLI(argv=_argv, warm_state=self._warm_state)
+            if _cli._args.subparser_name == 'serve':
+                print("[ERROR] Cannot start a server from within a request")
+                _exit_code = 1
+            else:
+                _cli.run()
+                _exit_code = 0
+        except SystemExit as _e:
+            # raised by `exit()` calls and by `argparse` on errors or when displaying the help
+            _exit_code = _e.code if isinstance(_e.code, int) else int(_e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            _exit_code = 1
+        finally:
+            sys.stdout, sys.stderr = _old_stdout, _old_stderr
+            os.chdir(_old_cwd)
+
+        # release the results and data frame nodes of the request not kept in the warm state
+        del _cli
+        gc.collect()
+
+        print("[INFO] Request finished with exit code {}".format(_exit_code))
+        try:
+            connection.sendall(json.dumps(dict(exit_code=_exit_code)) + "\n")
+        except socket.error:
+            pass
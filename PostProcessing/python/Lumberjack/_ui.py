@@ -3,15 +3,19 @@ from __future__ import print_function
 import abc
 import argparse
 import datetime
-import hashlib
+import glob
 import time
+import uuid
 import numpy as np
 import os
 import re
+import shutil
 import sys
+import threading
 import yaml
 #import ROOT
 
+from collections import OrderedDict
 from contextlib import contextmanager
 from tqdm import tqdm
 try:
@@ -25,6 +29,7 @@ except ImportError:
     from tqdm._utils import _unicode
 
 from .._util import product_dict, make_directory, group_by
+from ._output import COMPRESSION_ALGORITHMS
 
 class tqdm_always_newline(tqdm):
     @staticmethod
@@ -77,7 +82,7 @@ class StreamDup:
 
 
 @contextmanager
-def log_stdout_to_file(filename):
+def log_stdout_to_file(filename, mode='w'):
     if filename is None:
         yield
     else:
@@ -86,7 +91,7 @@ def log_stdout_to_file(filename):
         make_directory(_out_dir, exist_ok=True)
 
         _old_stdout = sys.stdout
-        with open(filename, 'w') as _log:
+        with open(filename, mode) as _log:
             sys.stdout = StreamDup([sys.stdout, _log])
             yield
             sys.stdout.flush()
@@ -97,10 +102,103 @@ class LumberjackInterfaceBase(object):
 
     RE_SPLITTING_KEY_SPEC = re.compile(r"([^[\]]*)(\[(.*)\])?")
 
-    def __init__(self, **kwargs):
+    # expressions accessing elements of containers or pointers (cannot be safely moved before other filters)
+    RE_ELEMENT_ACCESS = re.compile(r"\[|->|\.(at|front|back)\s*\(")
+
+    # number of events processed in a slot between two updates of the progress counter
+    _PROGRESS_COUNTER_INTERVAL = 1000
+
+    _PROGRESS_CPP_HELPERS = """
+    #include <Python.h>
+    #include <atomic>
+    #include <functional>
+    #include <vector>
+
+    namespace karma {
+    namespace lumberjack {
+
+        // event counter for one slot, on its own cache line to avoid false sharing
+        struct alignas(64) SlotCounter {
+            std::atomic<ULong64_t> value{0};
+        };
+
+        // event counters for all slots: written in the event loop, sampled from Python
+        class ProgressCounter {
+          public:
+            ProgressCounter(unsigned int nSlots) : m_counters(nSlots) {}
+
+            std::function<void(unsigned int, ULong64_t&)> GetCallback() {
+                std::vector<SlotCounter>* counters = &m_counters;
+                return [counters](unsigned int slot, ULong64_t& count) {
+                    if (slot < counters->size())
+                        (*counters)[slot].value.store(count, std::memory_order_relaxed);
+                };
+            }
+
+            ULong64_t GetTotal() const {
+                ULong64_t total = 0;
+                for (const auto& counter : m_counters)
+                    total += counter.value.load(std::memory_order_relaxed);
+                return total;
+            }
+
+          private:
+            std::vector<SlotCounter> m_counters;
+        };
+
+        // trigger the event loop with the GIL released, so Python threads can run
+        ULong64_t RunEventLoop(ROOT::RDF::RResultPtr<ULong64_t>& count) {
+            ULong64_t result;
+            Py_BEGIN_ALLOW_THREADS
+            result = *count;
+            Py_END_ALLOW_THREADS
+            return result;
+        }
+
+    }  // namespace lumberjack
+    }  // namespace karma
+    """
+    _progress_cpp_helpers_declared = False
+
+    _SAMPLING_CPP_HELPERS = """
+    namespace karma {
+    namespace lumberjack {
+
+        // select a deterministic, uniformly distributed fraction of entries based on a hash of `key`
+        inline bool sampleEntry(ULong64_t key, double fraction) {
+            // splitmix64 finalizer: maps consecutive keys to uniformly distributed values
+            key += 0x9e3779b97f4a7c15ULL;
+            key = (key ^ (key >> 30)) * 0xbf58476d1ce4e5b9ULL;
+            key = (key ^ (key >> 27)) * 0x94d049bb133111ebULL;
+            key = key ^ (key >> 31);
+            return (key >> 11) * (1.0 / 9007199254740992.0) < fraction;
+        }
+
+    }  // namespace lumberjack
+    }  // namespace karma
+    """
+    _sampling_cpp_helpers_declared = False
+
+    # attributes restored when reusing a data frame prepared for a previous request (server mode)
+    _WARM_DATA_FRAME_ATTRIBUTES = ('_df_bare', '_df_size', '_df', '_df_report', '_compiled_filters', '_optimized_selection_filters', '_variation_dfs')
+
+    def __init__(self, warm_state=None, **kwargs):
+        # state kept across requests when running as a server (see `LumberjackServer`)
+        self._warm_state = warm_state
+
         # retrieve runner arguments and analysis config
         self._args, self._config = self._get_args_config(**kwargs)
 
+    def _run_once(self, key):
+        '''whether an interpreter setup step identified by `key` needs to be run. When running as a server,
+        steps already run for a previous request (e.g. declaring the same ROOT macros) are skipped.'''
+        if self._warm_state is None:
+            return True
+        if key in self._warm_state.interpreter_setup:
+            return False
+        self._warm_state.interpreter_setup.add(key)
+        return True
+
     @abc.abstractmethod
     def _get_args_config(self, **kwargs):
         '''parse CLI arguments and retrieve analysis config'''
@@ -109,30 +207,40 @@ class LumberjackInterfaceBase(object):
     def _prepare_bare_data_frame(self):
 
         import ROOT  # do this here to avoid ROOT overriding standard Python behavior
+        from Karma.PostProcessing.Lumberjack import get_hash
 
         # -- add ROOT include paths
-        if hasattr(self._config, 'ROOT_INCLUDE_PATHS'):
+        if hasattr(self._config, 'ROOT_INCLUDE_PATHS') and self._run_once(('include_paths', tuple(self._config.ROOT_INCLUDE_PATHS))):
             print("[INFO] Adding include paths to ROOT interpreter:")
             for _path in self._config.ROOT_INCLUDE_PATHS:
                 print("    {}".format(_path))
                 ROOT.gInterpreter.AddIncludePath('{}'.format(_path))
 
         # -- load external libraries in ROOT
-        if hasattr(self._config, 'ROOT_LOAD_EXTERNAL_LIBRARIES'):
-            print("[INFO] Loading external libraries in ROOT interpreter:")
-            for _so_path in self._config.ROOT_LOAD_EXTERNAL_LIBRARIES:
-                print("    {}".format(_so_path))
-                ROOT.gInterpreter.Load(_so_path)
+        if hasattr(self._config, 'ROOT_LOAD_EXTERNAL_LIBRARIES') and self._run_once(('libraries', tuple(self._config.ROOT_LOAD_EXTERNAL_LIBRARIES))):
+            self._load_external_libraries(self._config.ROOT_LOAD_EXTERNAL_LIBRARIES)
 
         # -- execute user-defined ROOT initialization code
-        if hasattr(self._config, 'ROOT_INIT_FUNC'):
+        if hasattr(self._config, 'ROOT_INIT_FUNC') and self._run_once(('init_func', id(self._config))):
             print("[INFO] Executing ROOT_INIT_FUNC...")
             self._config.ROOT_INIT_FUNC()
 
+        # -- cache for compiled expressions
+        self._jit_cache = None
+        if getattr(self._args, 'jit_cache_dir', None) is not None:
+            from Karma.PostProcessing.Lumberjack import CompiledExpressionCache
+            self._jit_cache = CompiledExpressionCache(self._args.jit_cache_dir)
+
         # -- execute ROOT macro code in interpreter
         if hasattr(self._config, 'ROOT_MACROS'):
-            print("[INFO] Defining ROOT macros...")
-            ROOT.gInterpreter.Declare(self._config.ROOT_MACROS)
+            # write macros to a header, so they can also be included in the compiled expressions
+            _macros_header = self._jit_cache.get_macros_header(self._config.ROOT_MACROS) if self._jit_cache is not None else None
+            if self._run_once(('macros', get_hash(self._config.ROOT_MACROS))):
+                print("[INFO] Defining ROOT macros...")
+                if _macros_header is not None:
+                    ROOT.gInterpreter.Declare('#include "{}"'.format(_macros_header))
+                else:
+                    ROOT.gInterpreter.Declare(self._config.ROOT_MACROS)
 
         # -- set up data frame
 
@@ -149,6 +257,7 @@ class LumberjackInterfaceBase(object):
                 print("[ERROR] ROOT version {} does not contain an implementation of RDataFrames. Please switch to a newer "
                       "version of ROOT (>=6.14).".format(ROOT.gROOT.GetVersion()))
                 exit(1)
+        self._df_class = ROOT_DF_CLASS
 
         # enable multithreading
         if int(self._args.jobs) > 1:
@@ -157,17 +266,57 @@ class LumberjackInterfaceBase(object):
         else:
             ROOT.ROOT.DisableImplicitMT()  # exlicitly disable multithreading
 
+        _input_files = self._get_input_files()
+
+        # -- reuse data frame set up for a previous request (server mode)
+        self._warm_input_key = None
+        if self._warm_state is not None:
+            self._warm_input_key = get_hash(dict(input_files=self._get_input_file_identity(), tree=self._args.tree, jobs=int(self._args.jobs)))
+            _bare_data_frame = self._warm_state.get_bare_data_frame(self._warm_input_key)
+            if _bare_data_frame is not None:
+                print("[INFO] Reusing data frame set up for a previous request")
+                self._df_bare, self._df_size, self._input_chain = _bare_data_frame
+                self._df_input = (self._df_bare, self._df_size)
+                return
+
+        self._input_chain = None
+        self._setup_bare_data_frame(_input_files)
+
+        if self._warm_input_key is not None:
+            self._warm_state.set_bare_data_frame(self._warm_input_key, (self._df_bare, self._df_size, self._input_chain))
+
+        # data frame for the input files, from which each task starts (see `_prepare_data_frame`)
+        self._df_input = (self._df_bare, self._df_size)
+
+    def _setup_bare_data_frame(self, input_files):
+        '''create the data frame for the input files (without any defines)'''
+
+        import ROOT
+
+        ROOT_DF_CLASS = self._df_class
+        _input_files = input_files
+
         print("[INFO] Setting up data frame...")
-        print("[INFO] Sample file: {}".format(self._args.input_file))
+        if len(_input_files) == 1:
+            print("[INFO] Sample file: {}".format(_input_files[0]))
+        else:
+            print("[INFO] Sample files ({}):".format(len(_input_files)))
+            for _input_file in _input_files:
+                print("    {}".format(_input_file))
         print("[INFO] Sample type: {}".format(self._args.input_type))
 
-        # exit if input file does not exist
-        if not os.path.exists(self._args.input_file):
-            print("[ERROR] Input file does not exist: '{}'".format(self._args.input_file))
-            exit(1)
+        # -- multiple input files: chain together trees
+        if len(_input_files) > 1:
+            self._input_chain = ROOT.TChain(self._args.tree)
+            for _input_file in _input_files:
+                self._input_chain.Add(_input_file)
+            print("[INFO] Loading TTrees from all input files to compute the total number of entries...")
+            self._df_size = self._input_chain.GetEntries()
+            self._df_bare = ROOT_DF_CLASS(self._input_chain)
+            return
 
         # exit if tree does not exist in file
-        _f = ROOT.TFile(self._args.input_file, "READ")
+        _f = ROOT.TFile(_input_files[0], "READ")
         _tree = _f.Get(self._args.tree)
         if not isinstance(_tree, ROOT.TTree):
             print("[ERROR] Input file does not contain TTree '{}'".format(self._args.tree))
@@ -186,28 +335,84 @@ class LumberjackInterfaceBase(object):
         else:
             self._df_size = _tree.GetEntries()
             # construct dataframe from file and tree names
-            self._df_bare = ROOT_DF_CLASS(self._args.tree, self._args.input_file)
-
-    def _prepare_data_frame(self):
+            self._df_bare = ROOT_DF_CLASS(self._args.tree, _input_files[0])
 
-        from Karma.PostProcessing.Lumberjack import apply_defines, apply_filters, define_quantities
-
-        QUANTITIES = self._config.QUANTITIES
-        DEFINES = self._config.DEFINES
-        SELECTIONS = self._config.SELECTIONS
+    @staticmethod
+    def _load_external_libraries(so_paths):
+        '''load shared libraries in the ROOT interpreter'''
+        import ROOT
+        print("[INFO] Loading external libraries in ROOT interpreter:")
+        for _so_path in so_paths:
+            print("    {}".format(_so_path))
+            ROOT.gInterpreter.Load(_so_path)
+
+    def _get_input_files(self):
+        '''list of input files, with glob patterns expanded'''
+        _input_files = []
+        for _input_file_spec in self._args.input_file:
+            # keep remote files (e.g. 'root://...') as they are
+            if '://' in _input_file_spec:
+                _input_files.append(_input_file_spec)
+                continue
 
-        # -- limit the number of processed events
-        if int(self._args.num_events) >= 0:
-            print("[INFO] Limiting number of processed events to: ".format(self._args.num_events))
-            self._df_bare = self._df_bare.Range(0, int(self._args.num_events))
-            self._df_size = min(self._df_size, int(self._args.num_events))
-            self._df_count_increment = max(self._df_size//100, 10)
+            _expanded = sorted(glob.glob(_input_file_spec))
+            if not _expanded:
+                # exit if input file does not exist
+                print("[ERROR] Input file does not exist: '{}'".format(_input_file_spec))
+                exit(1)
+            _input_files.extend(_expanded)
+
+        return _input_files
+
+    def _prepare_data_frame(self, task_specs=None):
+        '''define quantities and apply the global selections. If `task_specs` are given, only
+        the columns needed by these tasks are defined (unless `--keep-all-defines` is set).'''
+
+        from Karma.PostProcessing.Lumberjack import DataFrameProfiler
+
+        # -- start from the data frame for the input files (replaced or limited for a previous task)
+        self._df_bare, self._df_size = self._df_input
+
+        # -- use a snapshot of the selected events, if available
+        _use_snapshot = False
+        if self._args.snapshot_dir is not None and task_specs is not None and self._args.subparser_name != 'snapshot':
+            _use_snapshot = self._use_snapshot(task_specs)
+
+        # -- set up profiling of data frame nodes
+        self._profiler = None
+        self._df_report = None
+        self._event_loop_duration = None
+        if self._args.profile:
+            print("[INFO] Profiling of data frame nodes enabled")
+            self._profiler = DataFrameProfiler()
+
+        # -- reuse data frame with the same defines and selections prepared for a previous request (server mode)
+        _warm_key = self._get_warm_data_frame_key()
+        _warm_attributes = self._warm_state.get_data_frame(self._warm_input_key, _warm_key) if _warm_key is not None else None
+        if _warm_attributes is not None:
+            print("[INFO] Reusing defines and selections set up for a previous request")
+            for _attr, _value in _warm_attributes.iteritems():
+                setattr(self, _attr, _value)
+        else:
+            # all columns are defined for data frames kept across requests, so they can be reused by any task
+            # number of events already limited when creating the snapshot
+            self._define_columns_and_selections(task_specs if _warm_key is None else None, limit_events=not _use_snapshot)
+            if _warm_key is not None:
+                self._warm_state.set_data_frame(self._warm_input_key, _warm_key, {
+                    _attr: getattr(self, _attr, None) for _attr in self._WARM_DATA_FRAME_ATTRIBUTES
+                })
 
         # -- set up event counter (for progress reporting)
         self._df_count = self._df_bare.Count()
-        self._df_count_increment = 100000
+        self._progress = None
 
         if self._args.progress:
+            import ROOT
+
+            if not LumberjackInterfaceBase._progress_cpp_helpers_declared:
+                ROOT.gInterpreter.Declare(self._PROGRESS_CPP_HELPERS)
+                LumberjackInterfaceBase._progress_cpp_helpers_declared = True
+
             _tqdm_class = tqdm_always_newline if self._args.progress_always_newline else tqdm
             self._progress = _tqdm_class(
                 unit=" events",
@@ -217,57 +422,549 @@ class LumberjackInterfaceBase(object):
                 total=self._df_size,
                 mininterval=self._args.progress_mininterval,
             )
-            def _progress_callback(count):
-                self._progress.update(self._df_count_increment)
 
-            _func_basename = "my_callback_py_f"
-            _func_idstring = hashlib.md5(hex(id(_progress_callback))).hexdigest()  # unique ID
-            _func_fullname = _func_basename + '_' + _func_idstring
-            _func_slotcallback_fullname = _func_basename + '_slot_' + _func_idstring
+            # per-slot atomic counters, updated in the event loop without locking or calling into Python
+            self._progress_counter = ROOT.karma.lumberjack.ProgressCounter(max(ROOT.ROOT.GetImplicitMTPoolSize(), 1))
+            self._df_count.OnPartialResultSlot(self._PROGRESS_COUNTER_INTERVAL, self._progress_counter.GetCallback())
 
-            import ROOT
+        # -- set up cache for results of previous runs
+        self._result_cache = None
+        if self._args.cache_dir is not None:
+            from Karma.PostProcessing.Lumberjack import ResultCache
+            self._result_cache = ResultCache(self._args.cache_dir, self._get_result_cache_context())
 
-            # black magic to obtain pointer to Python function in ROOT's interpreter
-            ROOT.gInterpreter.ProcessLine("#include <Python.h>")
-            ROOT.gInterpreter.ProcessLine("long long "+_func_fullname+"_addr = " + hex(id(_progress_callback)) + ";")
-            ROOT.gInterpreter.ProcessLine("PyObject* "+_func_fullname+" = reinterpret_cast<PyObject*>("+_func_fullname+"_addr);")
-            ROOT.gInterpreter.ProcessLine("Py_INCREF("+_func_fullname+");")  # prevent garbage collection
-
-            # define a thread-safe std::function for the progress callback and register it
-            ROOT.gInterpreter.ProcessLine("std::mutex partialResultMutex_"+_func_idstring+";")
-            ROOT.gInterpreter.ProcessLine(
-                "std::function<void(unsigned int, ULong64_t&)> "+_func_slotcallback_fullname+" = [](unsigned int /*slot*/, ULong64_t& count) { "
-                    "std::lock_guard<std::mutex> lock(partialResultMutex_"+_func_idstring+"); "
-                    "PyEval_CallObject("+_func_fullname+", Py_BuildValue(\"(i)\", count)); "
-                "};"
-            )
-            self._df_count.OnPartialResultSlot(self._df_count_increment, getattr(ROOT, _func_slotcallback_fullname))
+    def _get_warm_data_frame_key(self):
+        '''key identifying the defines and selections of the prepared data frame, for reuse across requests in
+        server mode. Returns `None` if the data frame should not be reused.'''
+        from Karma.PostProcessing.Lumberjack import get_hash
+
+        # profiling counters and snapshots are specific to a single request
+        if getattr(self, '_warm_input_key', None) is None or self._args.profile or self._args.snapshot_dir is not None:
+            return None
+
+        return get_hash(dict(
+            self._get_result_cache_context(),
+            jobs=int(self._args.jobs),
+            jit_cache_dir=self._args.jit_cache_dir,
+            optimize_selections=self._args.optimize_selections,
+            variations=self._args.variations,
+        ))
+
+    def _define_columns_and_selections(self, task_specs=None, limit_events=True):
+        '''limit the number of events (if `limit_events` is true), define the columns and apply the global selections'''
+
+        from Karma.PostProcessing.Lumberjack import apply_defines, apply_filters, define_quantities, get_column_dependencies, substitute_columns
+
+        QUANTITIES = self._config.QUANTITIES
+        DEFINES = self._config.DEFINES
+        SELECTIONS = self._config.SELECTIONS
+        VARIATIONS = getattr(self._config, 'VARIATIONS', {})
+
+        # -- limit the number of processed events
+        if limit_events and int(self._args.num_events) >= 0:
+            print("[INFO] Limiting number of processed events to: {}".format(self._args.num_events))
+            self._df_bare = self._df_bare.Range(0, int(self._args.num_events))
+            self._df_size = min(self._df_size, int(self._args.num_events))
 
         # -- apply basic analysis selection
 
         self._df = self._df_bare  #start from "bare" DataFrame (without defines)
 
+        # -- determine the columns which are actually needed
+        _quantities_global = QUANTITIES['global']
+        _quantities_input_type = QUANTITIES.get(self._args.input_type, {})
+        _defines_global = DEFINES['global']
+        _defines_input_type = DEFINES.get(self._args.input_type, {})
+        if task_specs is not None and not self._args.keep_all_defines:
+            _required_columns = self._get_required_columns(task_specs)
+            _n_columns = len(self._get_column_expressions())
+            print("[INFO] Defining {} of {} column(s) needed by the task(s)".format(len(_required_columns), _n_columns))
+
+            _quantities_global = self._filter_quantities(_quantities_global, _required_columns)
+            _quantities_input_type = self._filter_quantities(_quantities_input_type, _required_columns)
+            _defines_global = self._filter_defines(_defines_global, _required_columns)
+            _defines_input_type = self._filter_defines(_defines_input_type, _required_columns)
+
+        # -- replace expressions by calls to compiled functions
+        self._compiled_filters = {}
+        if self._jit_cache is not None:
+            _quantities_global, _quantities_input_type, _defines_global, _defines_input_type = self._compile_expressions(
+                _quantities_global, _quantities_input_type, _defines_global, _defines_input_type)
+
         print("[INFO] Defining quantities...")
         # "main" quantities (with binning)
-        self._df = define_quantities(self._df, QUANTITIES['global'])
+        self._df = define_quantities(self._df, _quantities_global, profiler=self._profiler)
         if self._args.input_type in QUANTITIES:
-            self._df = define_quantities(self._df, QUANTITIES[self._args.input_type])
+            self._df = define_quantities(self._df, _quantities_input_type, profiler=self._profiler)
 
         # other quantities (only given as expressions, no binning)
-        self._df = apply_defines(self._df, DEFINES['global'])
+        self._df = apply_defines(self._df, _defines_global, profiler=self._profiler)
         if self._args.input_type in DEFINES:
-            self._df = apply_defines(self._df, DEFINES[self._args.input_type])
+            self._df = apply_defines(self._df, _defines_input_type, profiler=self._profiler)
+
+        # -- process only a sample of the entries
+        if self._args.sample_fraction is not None:
+            import ROOT
+
+            if not LumberjackInterfaceBase._sampling_cpp_helpers_declared:
+                ROOT.gInterpreter.Declare(self._SAMPLING_CPP_HELPERS)
+                LumberjackInterfaceBase._sampling_cpp_helpers_declared = True
+
+            print("[INFO] Processing a sample of {:g}% of entries, selected by hashing: {}".format(
+                100.0 * self._args.sample_fraction, self._args.sample_key))
+            self._df = apply_filters(self._df, ["karma::lumberjack::sampleEntry(static_cast<ULong64_t>({}), {!r})".format(
+                self._args.sample_key, self._args.sample_fraction)], profiler=self._profiler, name="sampling")
 
         if self._args.selections is not None:
             for _sel in self._args.selections:
                 if _sel not in SELECTIONS:
                     print("[ERROR] Applying global selection '{}'...".format(_sel))
                     raise ValueError("Unknown selection '{}'".format(_sel))
-                print("[INFO] Applying global selection '{}': {}".format(_sel, ' && '.join(SELECTIONS[_sel])))
-                self._df = apply_filters(self._df, SELECTIONS[_sel])
+
+        # -- define varied copies of all columns depending on a column substituted by a variation
+        _defined_columns = OrderedDict()
+        for _quantities in (_quantities_global, _quantities_input_type):
+            for _q in _quantities.values():
+                if _q.name != _q.expression:
+                    _defined_columns[_q.name] = _q.expression
+        for _defines in (_defines_global, _defines_input_type):
+            _defined_columns.update(_defines)
+
+        _variation_substitutions = OrderedDict()
+        for _variation in (self._args.variations or []):
+            if _variation not in VARIATIONS:
+                print("[ERROR] Setting up variation '{}'...".format(_variation))
+                raise ValueError("Unknown variation '{}'".format(_variation))
+
+            # columns are defined in order, so substitutions of earlier columns propagate to later ones
+            _substitutions = dict(VARIATIONS[_variation])
+            _varied_defines = OrderedDict()
+            for _column, _expression in _defined_columns.iteritems():
+                if _column in _substitutions:
+                    continue
+                _varied_expression = substitute_columns(_expression, _substitutions)
+                if _varied_expression != _expression:
+                    _substitutions[_column] = "{}__{}".format(_column, re.sub(r'\W', '_', _variation))
+                    _varied_defines[_substitutions[_column]] = _varied_expression
+
+            print("[INFO] Setting up variation '{}': {} substituted column(s), {} varied define(s)".format(
+                _variation, len(VARIATIONS[_variation]), len(_varied_defines)))
+            self._df = apply_defines(self._df, _varied_defines, profiler=self._profiler, category='variations')
+            _variation_substitutions[_variation] = _substitutions
+
+        # -- the sampling pass for optimizing the filter order needs `Range`, which is not available
+        #    in multithreaded mode (a filter on the entry number would still read all events)
+        _optimize_selections = bool(self._args.optimize_selections)
+        if _optimize_selections and int(self._args.jobs) > 1:
+            print("[WARNING] `--optimize-selections` is not supported with multithreading: "
+                  "applying the selection filters in the configured order")
+            _optimize_selections = False
+
+        # -- apply the global selections, as a list of steps (log message, name, filter expressions)
+        _selection_steps = []
+        if self._args.selections is not None and _optimize_selections:
+            # apply filters of all selections in the order determined by sampling the first events
+            for _sel, _i_filter, _filter_expr in self._get_optimized_selection_filters():
+                _selection_steps.append((
+                    "[INFO] Applying filter {}[{}]: {}".format(_sel, _i_filter, _filter_expr),
+                    "{}[{}]: {}".format(_sel, _i_filter, _filter_expr),
+                    [self._compiled_filters.get(_filter_expr, _filter_expr)]))
+        elif self._args.selections is not None:
+            for _sel in self._args.selections:
+                _selection_steps.append((
+                    "[INFO] Applying global selection '{}': {}".format(_sel, ' && '.join(SELECTIONS[_sel])),
+                    _sel,
+                    [self._compiled_filters.get(_f, _f) for _f in SELECTIONS[_sel]]))
+
+        # steps up to the first one affected by any variation are shared by the data frames of all variations
+        _substituted_columns = dict.fromkeys([_column for _substitutions in _variation_substitutions.values() for _column in _substitutions], "")
+        _df_shared = None
+        _varied_steps = []
+        for _message, _name, _filters in _selection_steps:
+            if _df_shared is None and get_column_dependencies(" ".join(_filters), _substituted_columns):
+                _df_shared = self._df
+            if _df_shared is not None:
+                _varied_steps.append((_name, _filters))
+            print(_message)
+            self._df = apply_filters(self._df, _filters, profiler=self._profiler, name=_name)
+
+        # -- data frames for each variation (with the varied selections applied)
+        self._variation_dfs = OrderedDict()
+        for _variation, _substitutions in _variation_substitutions.iteritems():
+            _df_variation = _df_shared if _df_shared is not None else self._df
+            for _name, _filters in _varied_steps:
+                _df_variation = apply_filters(_df_variation, [substitute_columns(_f, _substitutions) for _f in _filters],
+                                              profiler=self._profiler, name="{} ({})".format(_name, _variation))
+            self._variation_dfs[_variation] = (_df_variation, _substitutions)
+
+        # cut-flow report for the global selections
+        if self._profiler is not None:
+            self._df_report = self._df.Report()
+
+    def _compile_expressions(self, *quantities_and_defines):
+        '''compile the expressions of the given quantities and defines (in definition order) and of the global
+        selections into a shared library, and return quantities and defines with expressions calling the compiled functions'''
+        from Karma.PostProcessing.Lumberjack import Quantity
+
+        SELECTIONS = self._config.SELECTIONS
+
+        _column_expressions = OrderedDict()
+        for _quantities_or_defines in quantities_and_defines:
+            for _name, _value in _quantities_or_defines.iteritems():
+                if isinstance(_value, Quantity):
+                    if _value.name != _value.expression:
+                        _column_expressions[_value.name] = _value.expression
+                else:
+                    _column_expressions[_name] = _value
+
+        _filter_expressions = [
+            _filter_expr
+            for _sel in (self._args.selections or [])
+            for _filter_expr in SELECTIONS[_sel]
+        ]
+
+        _compiled = self._jit_cache.compile(
+            self._df_bare, _column_expressions, _filter_expressions,
+            context=dict(
+                include_paths=getattr(self._config, 'ROOT_INCLUDE_PATHS', None),
+                external_libraries=getattr(self._config, 'ROOT_LOAD_EXTERNAL_LIBRARIES', None),
+            ),
+        )
+        if _compiled is None:
+            return quantities_and_defines
+
+        self._load_external_libraries([self._jit_cache.library_path])
+        _compiled_columns, self._compiled_filters = _compiled
+
+        _compiled_quantities_and_defines = []
+        for _quantities_or_defines in quantities_and_defines:
+            _compiled_quantities_or_defines = _quantities_or_defines.__class__()
+            for _name, _value in _quantities_or_defines.iteritems():
+                if isinstance(_value, Quantity):
+                    if _value.name in _compiled_columns:
+                        _value = _value.clone(expression=_compiled_columns[_value.name])
+                else:
+                    _value = _compiled_columns.get(_name, _value)
+                _compiled_quantities_or_defines[_name] = _value
+            _compiled_quantities_and_defines.append(_compiled_quantities_or_defines)
+
+        return _compiled_quantities_and_defines
+
+    def _get_column_expressions(self):
+        '''expressions of all columns defined via `QUANTITIES` and `DEFINES` for the current input type'''
+        QUANTITIES = self._config.QUANTITIES
+        DEFINES = self._config.DEFINES
+
+        _column_expressions = {}
+        for _quantities in (QUANTITIES['global'], QUANTITIES.get(self._args.input_type, {})):
+            for _q in _quantities.values():
+                if _q.name != _q.expression:
+                    _column_expressions[_q.name] = _q.expression
+        _column_expressions.update(DEFINES['global'])
+        _column_expressions.update(DEFINES.get(self._args.input_type, {}))
+
+        return _column_expressions
+
+    def _get_task_expressions(self, task_specs):
+        '''expressions and column names used by the objects, splittings and global selections of the given tasks'''
+
+        SPLITTINGS = self._config.SPLITTINGS
+        SELECTIONS = self._config.SELECTIONS
+
+        _expressions = []
+
+        # global selections
+        for _sel in (self._args.selections or []):
+            _expressions.extend(SELECTIONS.get(_sel, []))
+
+        # key used for selecting a sample of the entries
+        if self._args.sample_fraction is not None:
+            _expressions.append(self._args.sample_key)
+
+        # columns substituted by the requested variations
+        for _variation in (self._args.variations or []):
+            _expressions.extend(getattr(self._config, 'VARIATIONS', {}).get(_variation, {}).values())
+
+        for _task_spec in task_specs:
+            _quantities = _task_spec['_quantities']
+
+            # quantities and weights of histograms, profiles and exports (spec: 'x[:y[:z[:t]]][@weight][!options]')
+            for _obj_spec in (_task_spec.get('histograms') or []) + (_task_spec.get('profiles') or []) + (_task_spec.get('exports') or []):
+                _obj_spec = re.sub(r'![^@]*', '', _obj_spec)
+                for _column in re.split('[:@]', _obj_spec):
+                    _expressions.append(_column)
+                    if _column in _quantities:
+                        _expressions.append(_quantities[_column].name)
+
+            # variables used for splitting (key spec: 'key', 'key[value1,value2]' or 'key@N')
+            for _key_spec in _task_spec.get('splittings', []):
+                _key = re.match(self.RE_SPLITTING_KEY_SPEC, _key_spec.split('@', 1)[0]).groups()[0]
+                for _split_dict in SPLITTINGS.get(_key, {}).values():
+                    _expressions.extend(_split_dict.keys())
+
+        return _expressions
+
+    def _get_required_columns(self, task_specs):
+        '''names of all columns defined via `QUANTITIES` and `DEFINES` which are needed (directly or
+        indirectly) by the objects, splittings and global selections of the given tasks'''
+
+        from Karma.PostProcessing.Lumberjack import get_column_dependencies
+
+        return get_column_dependencies(" ".join(self._get_task_expressions(task_specs)), self._get_column_expressions())
+
+    def _get_required_branches(self, task_specs):
+        '''names of all input branches needed (directly or indirectly) by the given tasks'''
+
+        from Karma.PostProcessing.Lumberjack import get_column_dependencies
+
+        _column_expressions = self._get_column_expressions()
+        _expressions = self._get_task_expressions(task_specs)
+        _expressions += [_column_expressions[_column] for _column in self._get_required_columns(task_specs)]
+
+        # look up branch names as "columns" without dependencies
+        _branch_names = dict.fromkeys([str(_c) for _c in self._df_bare.GetColumnNames()], "")
+        return get_column_dependencies(" ".join(_expressions), _branch_names)
+
+    def _get_snapshot_key(self):
+        '''key identifying the events selected from the input: input files, tree, number of events, global selections
+        and the expressions of all columns the selections depend on'''
+        from Karma.PostProcessing.Lumberjack import get_column_dependencies, get_hash
+
+        SELECTIONS = self._config.SELECTIONS
+
+        _selections = [(_sel, SELECTIONS[_sel]) for _sel in (self._args.selections or [])]
+
+        _column_expressions = self._get_column_expressions()
+        _selection_columns = get_column_dependencies(
+            " ".join([_filter_expr for _, _filter_exprs in _selections for _filter_expr in _filter_exprs]),
+            _column_expressions)
+
+        return get_hash(dict(
+            input_files=self._get_input_file_identity(),
+            tree=self._args.tree,
+            num_events=int(self._args.num_events),
+            selections=_selections,
+            selection_columns=sorted((_column, _column_expressions[_column]) for _column in _selection_columns),
+        ))
+
+    def _find_snapshot(self, required_branches):
+        '''look up a snapshot of the selected events containing all required branches. Returns its metadata or `None`.'''
+        _snapshot_key_dir = os.path.join(self._args.snapshot_dir, self._get_snapshot_key())
+        if not os.path.isdir(_snapshot_key_dir):
+            return None
+
+        for _filename in sorted(os.listdir(_snapshot_key_dir)):
+            if not _filename.endswith('.yml'):
+                continue
+            with open(os.path.join(_snapshot_key_dir, _filename)) as _f:
+                _snapshot_meta = yaml.safe_load(_f)
+            if set(required_branches).issubset(_snapshot_meta['branches']):
+                _snapshot_meta['file'] = os.path.join(_snapshot_key_dir, _snapshot_meta['file'])
+                return _snapshot_meta
+
+        return None
+
+    def _use_snapshot(self, task_specs):
+        '''replace the input data frame by a snapshot of the selected events, if available.
+        Returns whether a snapshot is used.'''
+        _snapshot_meta = self._find_snapshot(self._get_required_branches(task_specs))
+        if _snapshot_meta is None:
+            print("[INFO] No suitable snapshot found for the input and selections")
+            return False
+
+        print("[INFO] Using snapshot of selected events ({} entries): {}".format(_snapshot_meta['entries'], _snapshot_meta['file']))
+        self._df_bare = self._df_class(_snapshot_meta['tree'], _snapshot_meta['file'])
+        self._df_size = _snapshot_meta['entries']
+        return True
+
+    @staticmethod
+    def _filter_quantities(quantities, required_columns):
+        '''only keep quantities which are required or need no Define'''
+        return quantities.__class__(
+            (_q_key, _q) for _q_key, _q in quantities.iteritems()
+            if _q.name in required_columns or _q.name == _q.expression
+        )
+
+    @staticmethod
+    def _filter_defines(defines, required_columns):
+        '''only keep defines which are required'''
+        return defines.__class__(
+            (_name, _expression) for _name, _expression in defines.iteritems()
+            if _name in required_columns
+        )
+
+    def _get_optimized_selection_filters(self):
+        '''order the filters of all global selections by measured cost and rejection rate.
+        Returns a list of `(selection name, filter index, filter expression)`.'''
+
+        from Karma.PostProcessing.Lumberjack import DataFrameProfiler, get_column_dependencies
+
+        SELECTIONS = self._config.SELECTIONS
+
+        _selection_filters = [
+            (_sel, _i_filter, _filter_expr)
+            for _sel in self._args.selections
+            for _i_filter, _filter_expr in enumerate(SELECTIONS[_sel])
+        ]
+
+        # reuse order determined for a previous task
+        _cached = getattr(self, '_optimized_selection_filters', None)
+        if _cached is not None and sorted(_cached) == sorted(_selection_filters):
+            return _cached
+
+        # -- filters which access container elements (directly or via a defined column) may rely on
+        #    preceding filters as guards (e.g. 'nJets > 0' before 'Jet_pt[0] > 50'): keep these in place
+        _column_expressions = self._get_column_expressions()
+        def _is_movable(filter_expr):
+            _exprs = [filter_expr] + [_column_expressions[_c] for _c in get_column_dependencies(filter_expr, _column_expressions)]
+            return not any([self.RE_ELEMENT_ACCESS.search(_expr) for _expr in _exprs])
+
+        # split into segments of movable filters, separated by filters kept in place
+        _segments = [[]]
+        _fixed_filters = []
+        for _selection_filter in _selection_filters:
+            if _is_movable(_selection_filter[2]):
+                _segments[-1].append(_selection_filter)
+            else:
+                _fixed_filters.append(_selection_filter)
+                _segments.append([])
+
+        # -- measure cost and pass fraction of movable filters on a sample of events
+        _n_sample = int(self._args.optimize_selections)
+        print("[INFO] Sampling {} events to optimize the order of {} selection filter(s)...".format(_n_sample, len(_selection_filters)))
+        _df_base = self._df.Range(0, _n_sample)
+
+        _sample_profiler = DataFrameProfiler()
+        _counts = []
+        for _segment, _fixed_filter in zip(_segments, _fixed_filters + [None]):
+            # evaluate each movable filter separately on the events passing all filters of the preceding segments
+            for _sel, _i_filter, _filter_expr in _segment:
+                _counts.append(_sample_profiler.filter(_df_base, _filter_expr, category='selection-optimizer').Count())
+            for _sel, _i_filter, _filter_expr in _segment + ([_fixed_filter] if _fixed_filter is not None else []):
+                _df_base = _df_base.Filter(_filter_expr)
+
+        if _counts:
+            _counts[0].GetValue()  # run the event loop
+
+        # discard statistics accumulated by the sampling in the main profiler
+        if self._profiler is not None:
+            self._profiler.reset()
+
+        # -- order movable filters in each segment by cost per rejected event (cheap, high-rejection filters first)
+        _node_stats = iter(_sample_profiler.get_node_stats())
+        _optimized_selection_filters = []
+        print("[INFO] Optimized order of selection filters:")
+        for _segment, _fixed_filter in zip(_segments, _fixed_filters + [None]):
+            _ranked_segment = []
+            for _selection_filter in _segment:
+                _stats = next(_node_stats)
+                _rejection = 1.0 - float(_stats['passed']) / _stats['calls'] if _stats['calls'] else 0.0
+                _cost = _stats['seconds'] / _stats['calls'] if _stats['calls'] else 0.0
+                _rank = _cost / _rejection if _rejection > 0 else float('inf')
+                _ranked_segment.append((_rank, _selection_filter, _rejection, _cost))
+
+            # note: sort is stable, so filters with identical ranks keep their order
+            _ranked_segment.sort(key=lambda _r: _r[0])
+            for _rank, (_sel, _i_filter, _filter_expr), _rejection, _cost in _ranked_segment:
+                print("    - {}[{}]: {} (rejection: {:.3f}, cost: {:.3g} us/event)".format(_sel, _i_filter, _filter_expr, _rejection, 1e6*_cost))
+                _optimized_selection_filters.append((_sel, _i_filter, _filter_expr))
+
+            if _fixed_filter is not None:
+                print("    - {}[{}]: {} (kept in place)".format(*_fixed_filter))
+                _optimized_selection_filters.append(_fixed_filter)
+
+        self._optimized_selection_filters = _optimized_selection_filters
+        return _optimized_selection_filters
+
+    def _run_event_loop(self):
+        '''run the event loop and return the number of processed events. Progress is reported from a separate thread.'''
+        _start = time.time()
+        try:
+            return self._run_event_loop_with_progress()
+        finally:
+            self._event_loop_duration = time.time() - _start
+
+    def _run_event_loop_with_progress(self):
+        if self._progress is None:
+            return self._df_count.GetValue()
+
+        import ROOT
+
+        _stop = threading.Event()
+
+        def _update_progress():
+            while not _stop.wait(self._args.progress_mininterval):
+                self._progress.update(self._progress_counter.GetTotal() - self._progress.n)
+
+        _thread = threading.Thread(target=_update_progress)
+        _thread.daemon = True
+        _thread.start()
+        try:
+            _count = ROOT.karma.lumberjack.RunEventLoop(self._df_count)
+        finally:
+            _stop.set()
+            _thread.join()
+
+        self._progress.update(_count - self._progress.n)
+        self._progress.close()
+        self._progress = None
+
+        return _count
+
+    def _write_profile_report(self, task_name, task_spec):
+        '''write the profiling report for a task next to its output file'''
+        if self._profiler is None or self._event_loop_duration is None:
+            return
+
+        _report = self._profiler.get_report(task_name, self._event_loop_duration, cutflow_report=self._df_report)
+        _report['task'] = _report.pop('scope')
+        _report['events'] = int(self._df_count.GetValue())
+
+        _report_filename = ".".join(task_spec['_filename'].split('.')[:-1]) + "_profile." + self._args.profile
+        print("[INFO] Writing profiling report for task '{}' to file: {}".format(task_name, _report_filename))
+        self._profiler.write_report(_report, _report_filename)
+
+    def _get_input_file_identity(self):
+        '''information identifying the contents of the input files: path, size and modification time'''
+        _identity = []
+        for _input_file in self._get_input_files():
+            if '://' in _input_file:
+                # no metadata available for remote files
+                _identity.append((_input_file, None, None))
+            else:
+                _stat = os.stat(_input_file)
+                _identity.append((os.path.realpath(_input_file), _stat.st_size, _stat.st_mtime))
+        return _identity
+
+    def _get_result_cache_context(self):
+        '''information affecting all objects produced from the prepared data frame (used as key for the result cache)'''
+        QUANTITIES = self._config.QUANTITIES
+        DEFINES = self._config.DEFINES
+        SELECTIONS = self._config.SELECTIONS
+
+        _context = dict(
+            input_files=self._get_input_file_identity(),
+            tree=self._args.tree,
+            input_type=self._args.input_type,
+            num_events=int(self._args.num_events),
+            selections=[(_sel, SELECTIONS[_sel]) for _sel in (self._args.selections or [])],
+            quantities={
+                _q_key: (_q.name, _q.expression)
+                for _q_key, _q in dict(QUANTITIES['global'], **QUANTITIES.get(self._args.input_type, {})).iteritems()
+            },
+            defines=[DEFINES['global'], DEFINES.get(self._args.input_type, {})],
+            root_macros=getattr(self._config, 'ROOT_MACROS', None),
+        )
+
+        # only included if set, so that existing caches remain valid
+        if self._args.sample_fraction is not None:
+            _context['sampling'] = (self._args.sample_fraction, self._args.sample_key)
+
+        return _context
 
     def _cleanup_data_frame(self):
-        pass  # what to do here?
+        if getattr(self, '_result_cache', None) is not None:
+            self._result_cache.close()
 
 
     def _expand_subtasks(self, task_configs):
@@ -324,144 +1021,501 @@ class LumberjackInterfaceBase(object):
 
             task_configs = _tasks_with_subtasks
 
+        # split tasks further if they would not fit into the memory budget
+        if self._args.max_memory is not None:
+            task_configs = self._split_tasks_by_memory(task_configs)
+
         return task_configs
 
+    def _estimate_task_memory(self, task_spec):
+        '''estimate the memory (in bytes) needed for filling the objects of a task'''
 
-    def _run_tasks(self, task_configs):
+        from Karma.PostProcessing.Lumberjack import PostProcessor
+
+        _, _, _combined_splittings = self._get_task_splittings(task_spec)
+        _pp = PostProcessor(
+            data_frame=None,
+            splitting_spec=_combined_splittings,
+            quantities=task_spec['_quantities'],
+            split_mode=PostProcessor.SplitMode[self._args.split_mode],
+            master_binning=self._args.master_binning,
+            batch_weights=self._args.batch_weights,
+        )
+        _pp.add_histograms(task_spec.get('histograms', None) or [])
+        _pp.add_profiles(task_spec.get('profiles', None) or [])
+        _pp.add_exports(task_spec.get('exports', None) or [])
+
+        # all objects are booked once more for each variation
+        _n_variations = len(self._args.variations or [])
 
-        from Karma.PostProcessing.Lumberjack import PostProcessor, Timer
+        return _pp.estimate_memory(n_slots=max(int(self._args.jobs), 1)) * (1 + _n_variations)
 
+    def _split_tasks_by_memory(self, task_configs):
+        '''split tasks exceeding the memory budget into subtasks (as with the '@' syntax) over their largest splitting key'''
         SPLITTINGS = self._config.SPLITTINGS
 
-        task_configs = self._expand_subtasks(task_configs)
+        _max_bytes = self._args.max_memory * 1024**2
 
-        # -- run all queued tasks
+        _tasks_within_budget = []
         for _task_name, _task_spec in task_configs:
+            _n_bytes = self._estimate_task_memory(_task_spec)
+            if _n_bytes <= _max_bytes:
+                _tasks_within_budget.append((_task_name, _task_spec))
+                continue
 
-            # skip task if output file exists
-            if os.path.exists(_task_spec['_filename']) and not self._args.overwrite:
-                print("[INFO] Task output file exists: '{}' and `--overwrite` not set. Skipping...".format(_task_spec['_filename']))
+            # choose the largest splitting key not yet sliced
+            _unsliced_keys = [
+                (len(SPLITTINGS[_splitting_key]), _i_splitting_key, _splitting_key)
+                for _i_splitting_key, _splitting_key in enumerate(_task_spec['splittings'])
+                if re.match(self.RE_SPLITTING_KEY_SPEC, _splitting_key).groups()[2] is None and len(SPLITTINGS[_splitting_key]) > 1
+            ]
+            if not _unsliced_keys:
+                print("[WARNING] Task '{}' needs an estimated {:.0f} MB, exceeding the memory budget of {} MB, "
+                      "but cannot be split any further.".format(_task_name, _n_bytes / 1024.0**2, self._args.max_memory))
+                _tasks_within_budget.append((_task_name, _task_spec))
                 continue
 
-            # create output directory (and intermediate directories) if they do not exist
-            _out_dir = os.path.dirname(_task_spec['_filename'])
-            make_directory(_out_dir, exist_ok=True)
+            _n_values, _i_splitting_key, _splitting_key = max(_unsliced_keys)
+            _n_passes = int(np.ceil(float(_n_bytes) / _max_bytes))
+            _n_values_per_subtask = max(_n_values // _n_passes, 1)
+
+            print("[INFO] Task '{}' needs an estimated {:.0f} MB, exceeding the memory budget of {} MB: "
+                  "splitting into subtasks with {} value(s) of splitting key '{}' each.".format(
+                      _task_name, _n_bytes / 1024.0**2, self._args.max_memory, _n_values_per_subtask, _splitting_key))
+
+            _new_splittings = _task_spec['splittings'][:]
+            _new_splittings[_i_splitting_key] = "{}@{}".format(_splitting_key, _n_values_per_subtask)
+
+            # subtasks are checked again (and split further, if needed) after the expansion
+            _tasks_within_budget.extend(self._expand_subtasks([(_task_name, dict(_task_spec, splittings=_new_splittings))]))
+
+        return _tasks_within_budget
+
+    def _group_tasks_by_memory(self, task_configs):
+        '''group tasks into passes (each run in a single event loop) whose objects fit into the memory budget together'''
+        if self._args.max_memory is None:
+            return [task_configs]
+
+        _max_bytes = self._args.max_memory * 1024**2
+
+        _passes = [[]]
+        _pass_bytes = 0
+        for _task_name, _task_spec in task_configs:
+            _n_bytes = self._estimate_task_memory(_task_spec)
+            if _passes[-1] and _pass_bytes + _n_bytes > _max_bytes:
+                _passes.append([])
+                _pass_bytes = 0
+            _passes[-1].append((_task_name, _task_spec))
+            _pass_bytes += _n_bytes
+
+        if len(_passes) > 1:
+            print("[INFO] Objects of all tasks exceed the memory budget of {} MB: running {} event loops "
+                  "over {} task(s).".format(self._args.max_memory, len(_passes), len(task_configs)))
+
+        return _passes
+
+    def _get_task_splittings(self, task_spec):
+        '''determine the splitting specifications of a task. Returns a tuple containing a dict of splitting
+        specifications per key, a list of keys (in order) and the combined splitting specification
+        (cross product of all keys).'''
+
+        SPLITTINGS = self._config.SPLITTINGS
+
+        _splittings_key_specs = task_spec.get('splittings')
+
+        _splitting_specs = {}
+        _splittings_keys = []
+        for _key_spec in _splittings_key_specs:
+            # support for slicing of individual splittings
+            # key can be '<name>' (no slicing) or '<name>[<splitting_value_1>,<splitting_value_2>,...]'
+            _key_spec_groups = re.match(self.RE_SPLITTING_KEY_SPEC, _key_spec).groups()
+            if _key_spec_groups[2] is None:
+                _key = _key_spec
+                # no slicing -> direct lookup
+                if _key not in SPLITTINGS:
+                    raise KeyError("[ERROR] Cannot find splitting for key '{}'".format(_key))
+                _splitting_specs[_key] = SPLITTINGS[_key]
+            else:
+                # slicing -> lookup and slice
+                _key = _key_spec_groups[0]
+                if _key not in SPLITTINGS:
+                    raise KeyError("[ERROR] Cannot find splitting for key '{}'".format(_key))
+
+                _subkeys = [_subkey.strip() for _subkey in _key_spec_groups[2].split(',')]
+                try:
+                    _splitting_specs[_key] = {_subkey: SPLITTINGS[_key][_subkey] for _subkey in _subkeys}
+                except KeyError as e:
+                    raise KeyError("[ERROR] Cannot find splitting for subkey '{}[{}]'".format(_key, e))
+
+            _splittings_keys.append(_key)  # store key w/o slicing syntax
+
+        # create combined splitting specification out of the cross product
+        # of specified keys
+        _combined_splittings = {}
+        for _splitting_combination in product_dict(**_splitting_specs):
+            _splitting_dict = {}
+            for _key in _splittings_keys:
+                _splitting_dict.update(SPLITTINGS[_key][_splitting_combination[_key]])
+            _splitting_name = "/".join([_key + ':' + _splitting_combination[_key] for _key in _splittings_keys])
+
+            _combined_splittings[_splitting_name] = _splitting_dict
+
+        return _splitting_specs, _splittings_keys, _combined_splittings
+
+    def _setup_task(self, task_name, task_spec):
+        '''set up a PostProcessor for a single task, based on the current data frame. Returns `None` if nothing to do.'''
+
+        from Karma.PostProcessing.Lumberjack import PostProcessor
 
-            # dump task configuration to yml
-            if self._args.dump_yaml:
-                _yaml_dump_filename = ".".join(_task_spec['_filename'].split('.')[:-1]) + "_configdump.yml"
-                with open(_yaml_dump_filename, 'w') as _f:
-                    yaml.dump(_task_spec, _f, default_flow_style=False)
+        _splitting_specs, _splittings_keys, _combined_splittings = self._get_task_splittings(task_spec)
+
+        _hs = task_spec.get('histograms', None)
+        _ps = task_spec.get('profiles', None)
+        _es = task_spec.get('exports', None)
+
+        if _hs is None and _ps is None and _es is None:
+            print("[ERROR] No `histograms`, `profiles` or `exports` configured for task '{}': skipping...".format(task_name))
+            return None
+
+
+        if _hs:
+            print("[INFO] Requested histograms:")
+            for _h in _hs:
+                print("    - {}".format(_h))
+        else:
+            print("[INFO] Requested histograms: <none>")
+
+        if _ps:
+            print("[INFO] Requested profiles:")
+            for _p in _ps:
+                print("    - {}".format(_p))
+        else:
+            print("[INFO] Requested profiles: <none>")
+
+        if _es:
+            print("[INFO] Requested exports:")
+            for _e in _es:
+                print("    - {}".format(_e))
+
+        # record the order in which the global selection filters are applied
+        if self._args.selections is not None and getattr(self, '_optimized_selection_filters', None) is not None:
+            task_spec['_selection_filter_order'] = [
+                "{}[{}]: {}".format(_sel, _i_filter, _filter_expr)
+                for _sel, _i_filter, _filter_expr in self._optimized_selection_filters
+            ]
+            self._dump_task_config(task_spec)
+
+        print("[INFO] Setting up PostProcessor...")
+        if self._profiler is not None:
+            self._profiler.set_scope(task_name)
+        _pp_kwargs = dict(
+            splitting_spec=_combined_splittings,
+            quantities=task_spec['_quantities'],
+            splitting_key_specs=OrderedDict([(_key, _splitting_specs[_key]) for _key in _splittings_keys]),
+            split_mode=PostProcessor.SplitMode[self._args.split_mode],
+            result_cache=self._result_cache,
+            profiler=self._profiler,
+            export_format=self._args.export_format,
+            export_chunk_size=self._args.export_chunk_size,
+            master_binning=self._args.master_binning,
+            write_sparse=self._args.write_sparse,
+            compression_algorithm=self._args.output_compression_algorithm,
+            compression_level=self._args.output_compression_level,
+            sample_fraction=self._args.sample_fraction,
+            batch_weights=self._args.batch_weights,
+        )
+        _pp = PostProcessor(data_frame=self._df, **_pp_kwargs)
+
+        # the same objects are booked for each variation, on the data frame for the variation
+        _variation_pps = []
+        for _variation, (_df_variation, _substitutions) in getattr(self, '_variation_dfs', {}).iteritems():
+            _variation_pp = PostProcessor(data_frame=_df_variation, column_substitutions=_substitutions, **_pp_kwargs)
+            _pp.add_variation(_variation, _variation_pp)
+            _variation_pps.append(_variation_pp)
+
+        for _p in [_pp] + _variation_pps:
+            if _hs is not None:
+                _p.add_histograms(_hs)
+            if _ps is not None:
+                _p.add_profiles(_ps)
+            if _es is not None:
+                _p.add_exports(_es)
+        _n_obj = len(_hs or []) + len(_ps or []) + len(_es or [])
+
+        _n_subdiv = np.prod([len(_splitting) for _splitting in _splitting_specs.values()])
+
+        print("[INFO] Running Task '{}':".format(task_name))
+        print("    - splitting RDataFrame by keys: {}".format(
+            ", ".join(["{} ({} subdivisions)".format(_key, len(_splitting)) for _key, _splitting in _splitting_specs.iteritems()])
+        ))
+        print("        -> total number of subdivisions: {}\n".format(_n_subdiv))
+        print("    - requested number of objects per subdivision: {}\n".format(_n_obj))
+        if _variation_pps:
+            print("    - variations: {}\n".format(", ".join(getattr(self, '_variation_dfs', {}).keys())))
+        print("    -> total number of objects: {}\n".format(_n_obj * _n_subdiv * (1 + len(_variation_pps))))
+        print("    - output file: {}".format(task_spec['_filename']))
+
+        return _pp
+
+    def _prepare_task_output(self, task_spec):
+        '''create output directory and dump task configuration. Returns `False` if the task should be skipped.'''
+
+        # skip task if output file exists
+        if os.path.exists(task_spec['_filename']) and not self._args.overwrite:
+            print("[INFO] Task output file exists: '{}' and `--overwrite` not set. Skipping...".format(task_spec['_filename']))
+            return False
+
+        # create output directory (and intermediate directories) if they do not exist
+        _out_dir = os.path.dirname(task_spec['_filename'])
+        make_directory(_out_dir, exist_ok=True)
+
+        self._dump_task_config(task_spec)
+
+        return True
+
+    def _dump_task_config(self, task_spec):
+        '''dump task configuration to yml (if requested)'''
+        if self._args.dump_yaml:
+            _yaml_dump_filename = ".".join(task_spec['_filename'].split('.')[:-1]) + "_configdump.yml"
+            with open(_yaml_dump_filename, 'w') as _f:
+                yaml.dump(task_spec, _f, default_flow_style=False)
+
+    def _run_tasks(self, task_configs):
+
+        from Karma.PostProcessing.Lumberjack import Timer
+
+        task_configs = self._expand_subtasks(task_configs)
+
+        if self._args.single_event_loop:
+            # tasks are run in several event loops if they do not fit into the memory budget together
+            for _pass_task_configs in self._group_tasks_by_memory(task_configs):
+                self._run_tasks_single_event_loop(_pass_task_configs)
+            return
+
+        # -- run all queued tasks
+        for _task_name, _task_spec in task_configs:
+
+            if not self._prepare_task_output(_task_spec):
+                continue
 
             with log_stdout_to_file(_task_spec['_log_filename']):
                 print("[INFO] Running task '{}'...".format(_task_name))
 
                 # apply defines, basic selection, etc.
-                self._prepare_data_frame()
-
-                _splittings_key_specs = _task_spec.get('splittings')
-
-                _splitting_specs = {}
-                _splittings_keys = []
-                for _key_spec in _splittings_key_specs:
-                    # support for slicing of individual splittings
-                    # key can be '<name>' (no slicing) or '<name>[<splitting_value_1>,<splitting_value_2>,...]'
-                    _key_spec_groups = re.match(self.RE_SPLITTING_KEY_SPEC, _key_spec).groups()
-                    if _key_spec_groups[2] is None:
-                        _key = _key_spec
-                        # no slicing -> direct lookup
-                        if _key not in SPLITTINGS:
-                            raise KeyError("[ERROR] Cannot find splitting for key '{}'".format(_key))
-                        _splitting_specs[_key] = SPLITTINGS[_key]
-                    else:
-                        # slicing -> lookup and slice
-                        _key = _key_spec_groups[0]
-                        if _key not in SPLITTINGS:
-                            raise KeyError("[ERROR] Cannot find splitting for key '{}'".format(_key))
-
-                        _subkeys = [_subkey.strip() for _subkey in _key_spec_groups[2].split(',')]
-                        try:
-                            _splitting_specs[_key] = {_subkey: SPLITTINGS[_key][_subkey] for _subkey in _subkeys}
-                        except KeyError as e:
-                            raise KeyError("[ERROR] Cannot find splitting for subkey '{}[{}]'".format(_key, e))
-
-                    _splittings_keys.append(_key)  # store key w/o slicing syntax
-
-                # create combined splitting specification out of the cross product
-                # of specified keys
-                _combined_splittings = {}
-                for _splitting_combination in product_dict(**_splitting_specs):
-                    _splitting_dict = {}
-                    for _key in _splittings_keys:
-                        _splitting_dict.update(SPLITTINGS[_key][_splitting_combination[_key]])
-                    _splitting_name = "/".join([_key + ':' + _splitting_combination[_key] for _key in _splittings_keys])
-
-                    _combined_splittings[_splitting_name] = _splitting_dict
-
-                _hs = _task_spec.get('histograms', None)
-                _ps = _task_spec.get('profiles', None)
-
-                if _hs is None and _ps is None:
-                    print("[ERROR] No `histograms` or `profiles` configured for task '{}': skipping...".format(_task_name))
-                    continue
-
+                self._prepare_data_frame(task_specs=[_task_spec])
 
-                if _hs:
-                    print("[INFO] Requested histograms:")
-                    for _h in _hs:
-                        print("    - {}".format(_h))
-                else:
-                    print("[INFO] Requested histograms: <none>")
-
-                if _ps:
-                    print("[INFO] Requested profiles:")
-                    for _p in _ps:
-                        print("    - {}".format(_p))
-                else:
-                    print("[INFO] Requested profiles: <none>")
-
-                print("[INFO] Setting up PostProcessor...")
-                _pp = PostProcessor(
-                    data_frame=self._df,
-                    splitting_spec=_combined_splittings,
-                    quantities=_task_spec['_quantities'],
-                )
-
-                _n_obj = 0
-                if _hs is not None:
-                    _pp.add_histograms(_hs)
-                    _n_obj += len(_hs)
-                if _ps is not None:
-                    _pp.add_profiles(_ps)
-                    _n_obj += len(_ps)
-
-                _n_subdiv = np.prod([len(_splitting) for _splitting in _splitting_specs.values()])
-
-                print("[INFO] Running Task '{}':".format(_task_name))
-                print("    - splitting RDataFrame by keys: {}".format(
-                    ", ".join(["{} ({} subdivisions)".format(_key, len(_splitting)) for _key, _splitting in _splitting_specs.iteritems()])
-                ))
-                print("        -> total number of subdivisions: {}\n".format(_n_subdiv))
-                print("    - requested number of objects per subdivision: {}\n".format(_n_obj))
-                print("    -> total number of objects: {}\n".format(_n_obj * _n_subdiv))
-                print("    - output file: {}".format(_task_spec['_filename']))
+                _pp = self._setup_task(_task_name, _task_spec)
+                if _pp is None:
+                    continue
 
                 # run PostProcessor and time execution
                 with Timer(_task_name) as _t:
                     if self._args.dry_run:
                         print("[INFO] `--dry-run` has been specified: not running task '{}'".format(_task_name))
                         time.sleep(0.1)
-                    else:
-                        _pp.run(output_file_path=_task_spec['_filename'])
+                    elif _pp.book():
+                        if _pp.has_booked_objects():
+                            self._run_event_loop()
+                        _pp.write(output_file_path=_task_spec['_filename'])
+                        self._write_profile_report(_task_name, _task_spec)
 
                 # print report
-                if not self._args.dry_run:
+                if not self._args.dry_run and _pp.has_booked_objects():
                     print("[INFO] Processed a total of {} events.".format(self._df_count.GetValue()))
                 _t.report()
 
                 print("[INFO] Cleaning up after task '{}'...".format(_task_name))
                 self._cleanup_data_frame()
 
+    def _run_tasks_single_event_loop(self, task_configs):
+        '''book the objects of all tasks on a shared data frame and fill them in a single event loop'''
+
+        from Karma.PostProcessing.Lumberjack import Timer
+
+        # skip tasks before preparing the data frame, so that only the columns needed by the remaining tasks are defined
+        task_configs = [
+            (_task_name, _task_spec)
+            for _task_name, _task_spec in task_configs
+            if self._prepare_task_output(_task_spec)
+        ]
+        if not task_configs:
+            print("[INFO] No tasks left to run. Exiting...")
+            return
+
+        # apply defines, basic selection, etc. (once for all tasks)
+        self._prepare_data_frame(task_specs=[_task_spec for _, _task_spec in task_configs])
+
+        # -- book objects for all queued tasks
+        _booked_tasks = []
+        for _task_name, _task_spec in task_configs:
+
+            with log_stdout_to_file(_task_spec['_log_filename']):
+                print("[INFO] Booking objects for task '{}'...".format(_task_name))
+
+                _pp = self._setup_task(_task_name, _task_spec)
+                if _pp is None:
+                    continue
+
+                if not self._args.dry_run and _pp.book():
+                    _booked_tasks.append((_task_name, _task_spec, _pp))
+
+        if self._args.dry_run:
+            print("[INFO] `--dry-run` has been specified: not running event loop")
+            return
+
+        if not _booked_tasks:
+            print("[INFO] No objects booked for any task. Exiting...")
+            return
+
+        # -- run the event loop (once for all tasks)
+        if any([_pp.has_booked_objects() for _, _, _pp in _booked_tasks]):
+            print("[INFO] Running shared event loop for {} task(s): {}".format(
+                len(_booked_tasks), ", ".join([_task_name for _task_name, _, _ in _booked_tasks])))
+            with Timer("event loop") as _t:
+                self._run_event_loop()
+            print("[INFO] Processed a total of {} events.".format(self._df_count.GetValue()))
+            _t.report()
+        else:
+            print("[INFO] All objects taken from result cache: not running event loop")
+
+        # -- write out the results of each task to its own file
+        for _task_name, _task_spec, _pp in _booked_tasks:
+            with log_stdout_to_file(_task_spec['_log_filename'], mode='a'):
+                print("[INFO] Writing output of task '{}' to file: {}".format(_task_name, _task_spec['_filename']))
+                with Timer(_task_name) as _t:
+                    _pp.write(output_file_path=_task_spec['_filename'])
+                _t.report()
+                self._write_profile_report(_task_name, _task_spec)
+
+        self._cleanup_data_frame()
+
+
+    def _run_tasks_on_input(self, task_configs):
+        '''set up the data frame for the input files and run the tasks, possibly in parallel processes over chunks of files'''
+        if int(self._args.processes) > 1 and len(self._get_input_files()) > 1:
+            self._run_tasks_parallel(task_configs)
+        else:
+            self._prepare_bare_data_frame()
+            self._run_tasks(task_configs)
+
+    def _run_tasks_parallel(self, task_configs):
+        '''run tasks in a pool of processes, each processing a chunk of the input files, and merge the partial outputs'''
+
+        from multiprocessing import Pool
+        from Karma.PostProcessing.Lumberjack import merge_root_files, PostProcessor, Timer
+
+        global _PARALLEL_RUN_STATE
+
+        _input_files = self._get_input_files()
+        _n_chunks = min(int(self._args.processes), len(_input_files))
+        _input_file_chunks = group_by(_input_files, len(_input_files)//_n_chunks + (len(_input_files)%_n_chunks>0))
+
+        task_configs = [
+            (_task_name, _task_spec)
+            for _task_name, _task_spec in self._expand_subtasks(task_configs)
+            if self._prepare_task_output(_task_spec)
+        ]
+        if not task_configs:
+            print("[INFO] No tasks left to run. Exiting...")
+            return
+
+        print("[INFO] Running {} task(s) in {} processes over {} input files...".format(len(task_configs), len(_input_file_chunks), len(_input_files)))
+
+        # state is passed to worker processes via `fork`
+        _PARALLEL_RUN_STATE = (self, task_configs)
+        with Timer("parallel run") as _t:
+            _pool = Pool(len(_input_file_chunks))
+            try:
+                _partial_filenames_by_chunk = _pool.map(_run_tasks_for_input_chunk, list(enumerate(_input_file_chunks)))
+            finally:
+                _pool.close()
+                _pool.join()
+                _PARALLEL_RUN_STATE = None
+        _t.report()
+
+        # -- merge the partial outputs
+        for _i_task, (_task_name, _task_spec) in enumerate(task_configs):
+            # logs of the worker processes are collected in the task log
+            self._merge_partial_logs(_task_spec.get('_log_filename', None), len(_input_file_chunks))
+
+            _partial_filenames = [
+                _partial_filenames[_i_task]
+                for _partial_filenames in _partial_filenames_by_chunk
+                if os.path.exists(_partial_filenames[_i_task])
+            ]
+            if not _partial_filenames:
+                print("[WARNING] No partial outputs found for task '{}'".format(_task_name))
+                continue
+
+            print("[INFO] Merging {} partial outputs for task '{}' into file: {}".format(len(_partial_filenames), _task_name, _task_spec['_filename']))
+            with Timer("merge {}".format(_task_name)) as _t:
+                merge_root_files(_partial_filenames, _task_spec['_filename'],
+                    compression_algorithm=self._args.output_compression_algorithm,
+                    compression_level=self._args.output_compression_level)
+            _t.report()
+
+            for _partial_filename in _partial_filenames:
+                os.remove(_partial_filename)
+
+            self._merge_partial_export_directories(
+                [PostProcessor.get_export_directory(_partial_filename) for _partial_filename in _partial_filenames],
+                PostProcessor.get_export_directory(_task_spec['_filename']))
+
+    def _merge_partial_logs(self, log_filename, n_chunks):
+        '''append the logs written by the worker processes to `log_filename` and remove them'''
+        if log_filename is None:
+            return
+
+        _partial_log_filenames = [
+            self._get_partial_filename(log_filename, _i_chunk)
+            for _i_chunk in range(n_chunks)
+        ]
+        with open(log_filename, 'w') as _log:
+            for _i_chunk, _partial_log_filename in enumerate(_partial_log_filenames):
+                if not os.path.exists(_partial_log_filename):
+                    continue
+                _log.write("[INFO] Log of process for input chunk {}:\n".format(_i_chunk))
+                with open(_partial_log_filename) as _partial_log:
+                    shutil.copyfileobj(_partial_log, _log)
+                os.remove(_partial_log_filename)
+
+    @staticmethod
+    def _merge_partial_export_directories(partial_export_dirs, export_dir):
+        '''move the files with exported quantities written by the worker processes to `export_dir`, numbering
+        the chunks of each export consecutively, and remove the partial export directories'''
+        _n_chunks = {}
+        for _partial_export_dir in partial_export_dirs:
+            if not os.path.isdir(_partial_export_dir):
+                continue
+            print("[INFO] Moving exported quantities from directory '{}' to: {}".format(_partial_export_dir, export_dir))
+            for _dir_path, _, _filenames in sorted(os.walk(_partial_export_dir)):
+                _relative_dir_path = os.path.relpath(_dir_path, _partial_export_dir)
+                _output_dir_path = os.path.normpath(os.path.join(export_dir, _relative_dir_path))
+                for _filename in sorted(_filenames):
+                    # chunk files are named '<export name>_<chunk number>.<format>'
+                    _match = re.match(r"^(.*)_(\d+)\.(\w+)$", _filename)
+                    if _match is None:
+                        continue
+                    _name, _, _extension = _match.groups()
+                    _key = (_relative_dir_path, _name, _extension)
+                    _i_chunk = _n_chunks.get(_key, 0)
+                    _n_chunks[_key] = _i_chunk + 1
+
+                    make_directory(_output_dir_path, exist_ok=True)
+                    os.rename(
+                        os.path.join(_dir_path, _filename),
+                        os.path.join(_output_dir_path, "{}_{:04d}.{}".format(_name, _i_chunk, _extension)))
+
+            shutil.rmtree(_partial_export_dir)
+
+    @staticmethod
+    def _get_partial_filename(filename, i_chunk):
+        '''"path/to/file.ext" -> "path/to/file.part<i_chunk>.ext"'''
+        if filename is None:
+            return None
+        _filename = filename.split('.')
+        _filename[-2] += '.part{}'.format(i_chunk)
+        return '.'.join(_filename)
 
     # -- subcommand methods
 
@@ -497,11 +1551,11 @@ class LumberjackInterfaceBase(object):
             splittings = self._args.SPLITTING_KEY,
             histograms = self._args.histograms,
             profiles = self._args.profiles,
+            exports = self._args.exports,
         )
         _tasks = [("Freestyle", _task_spec)]
 
-        self._prepare_bare_data_frame()
-        self._run_tasks(_tasks)
+        self._run_tasks_on_input(_tasks)
 
 
     def _subcommand_task(self):
@@ -535,8 +1589,139 @@ class LumberjackInterfaceBase(object):
             print("[INFO] No tasks in queue. Exiting...")
             exit(1)
 
+        self._run_tasks_on_input(_tasks)
+
+
+    def _subcommand_merge(self):
+
+        from Karma.PostProcessing.Lumberjack import merge_root_files, Timer
+
+        # expand glob patterns
+        _input_files = []
+        for _input_file_spec in self._args.INPUT_FILE:
+            _expanded = sorted(glob.glob(_input_file_spec))
+            if not _expanded:
+                print("[ERROR] Input file does not exist: '{}'".format(_input_file_spec))
+                exit(1)
+            _input_files.extend(_expanded)
+
+        # exit if output filename exists
+        if os.path.exists(self._args.output_file) and not self._args.overwrite:
+            print("[INFO] Output file exists: '{}' and `--overwrite` not set. Exiting...".format(self._args.output_file))
+            exit(1)
+
+        if os.path.realpath(self._args.output_file) in map(os.path.realpath, _input_files):
+            print("[ERROR] Output file is also an input file: '{}'".format(self._args.output_file))
+            exit(1)
+
+        print("[INFO] Merging {} input file(s) into file: {}".format(len(_input_files), self._args.output_file))
+        for _input_file in _input_files:
+            print("    {}".format(_input_file))
+
+        _out_dir = os.path.dirname(self._args.output_file)
+        if _out_dir:
+            make_directory(_out_dir, exist_ok=True)
+
+        with Timer("merge") as _t:
+            merge_root_files(_input_files, self._args.output_file,
+                compression_algorithm=self._args.output_compression_algorithm,
+                compression_level=self._args.output_compression_level)
+        _t.report()
+
+
+    def _subcommand_snapshot(self):
+
+        import ROOT
+        from Karma.PostProcessing.Lumberjack import Timer
+
+        QUANTITIES = self._config.QUANTITIES
+        TASKS = self._config.TASKS
+
+        if self._args.snapshot_dir is None:
+            print("[ERROR] No snapshot directory given: use `--snapshot-dir`")
+            exit(1)
+
+        # snapshots always contain all selected events (sampling is applied when using them)
+        if self._args.sample_fraction is not None:
+            print("[ERROR] Cannot write a snapshot of a sample of the events: remove `--sample-fraction`")
+            exit(1)
+
+        # events are selected with the nominal columns only
+        if self._args.variations is not None:
+            print("[ERROR] Cannot write a snapshot for variations: remove `--variations`")
+            exit(1)
+
+        # -- tasks for which the snapshot should contain all needed branches
+        _task_specs = []
+        for _task_name in (self._args.TASK_NAME or sorted(TASKS.keys())):
+            if _task_name not in TASKS:
+                raise ValueError("[ERROR] Unknown task '{}': expected one of {}".format(_task_name, set(TASKS.keys())))
+            _task_spec = dict(TASKS[_task_name])
+            _task_spec['_quantities'] = dict(QUANTITIES['global'], **QUANTITIES.get(self._args.input_type, {}))
+            _task_specs.append(_task_spec)
+
         self._prepare_bare_data_frame()
-        self._run_tasks(_tasks)
+        _branches = sorted(self._get_required_branches(_task_specs))
+        self._prepare_data_frame(task_specs=_task_specs)
+
+        _snapshot_key = self._get_snapshot_key()
+        _snapshot_key_dir = os.path.join(self._args.snapshot_dir, _snapshot_key)
+        make_directory(_snapshot_key_dir, exist_ok=True)
+
+        _snapshot_name = "snapshot_{}".format(uuid.uuid4().hex)
+        _snapshot_file = os.path.join(_snapshot_key_dir, _snapshot_name + ".root")
+
+        print("[INFO] Writing snapshot of selected events with {} branch(es) to file: {}".format(len(_branches), _snapshot_file))
+        for _branch in _branches:
+            print("    {}".format(_branch))
+
+        _options = ROOT.RDF.RSnapshotOptions()
+        _options.fCompressionAlgorithm = getattr(ROOT.ROOT, "k" + self._args.compression_algorithm.upper())
+        _options.fCompressionLevel = self._args.compression_level
+
+        _branch_vector = ROOT.std.vector('string')()
+        for _branch in _branches:
+            _branch_vector.push_back(_branch)
+
+        # write to temporary file first, so incomplete snapshots are never picked up
+        with Timer("snapshot") as _t:
+            self._df.Snapshot(self._args.tree, _snapshot_file + ".tmp", _branch_vector, _options)
+        _t.report()
+        os.rename(_snapshot_file + ".tmp", _snapshot_file)
+
+        _f = ROOT.TFile(_snapshot_file, "READ")
+        _entries = int(_f.Get(self._args.tree).GetEntries())
+        _f.Close()
+        print("[INFO] Snapshot contains {} of {} entries".format(_entries, self._df_size))
+
+        # metadata for looking up the snapshot in later runs
+        with open(os.path.join(_snapshot_key_dir, _snapshot_name + ".yml"), 'w') as _f:
+            yaml.safe_dump(dict(
+                file=_snapshot_name + ".root",
+                tree=self._args.tree,
+                entries=_entries,
+                branches=_branches,
+                input_files=[_path for _path, _, _ in self._get_input_file_identity()],
+                selections=list(self._args.selections or []),
+                num_events=int(self._args.num_events),
+            ), _f, default_flow_style=False)
+
+        self._cleanup_data_frame()
+
+
+    def _subcommand_serve(self):
+
+        from Karma.PostProcessing.Lumberjack import LumberjackServer
+
+        if self._args.socket is None:
+            print("[ERROR] No socket path given: use `--socket` or set the environment variable LUMBERJACK_SOCKET")
+            exit(1)
+
+        LumberjackServer(
+            self._args.socket,
+            max_data_frames=self._args.max_data_frames,
+            max_requests=self._args.max_requests,
+        ).serve_forever()
 
 
     # -- public API
@@ -552,10 +1737,66 @@ class LumberjackInterfaceBase(object):
         elif self._args.subparser_name == 'load':
             self._subcommand_load()
 
+        elif self._args.subparser_name == 'merge':
+            self._subcommand_merge()
+
+        elif self._args.subparser_name == 'snapshot':
+            self._subcommand_snapshot()
+
+        elif self._args.subparser_name == 'serve':
+            self._subcommand_serve()
+
         else:
             raise ValueError("Unknown operation '{}'! Exiting...".format(_args.subparser_name))
 
 
+# analysis configuration modules already loaded: name -> (file path, modification time, module)
+_ANALYSIS_CONFIG_CACHE = {}
+
+def _load_analysis_config(importer, analysis_name):
+    '''load an analysis configuration module. Modules are only loaded again if their file has changed
+    since the last time (relevant when handling several requests in server mode).'''
+    _loader = importer.find_module(analysis_name)
+    _file_path = _loader.get_filename(analysis_name)
+    _mtime = os.path.getmtime(_file_path)
+
+    _cached = _ANALYSIS_CONFIG_CACHE.get(analysis_name, None)
+    if _cached is not None and _cached[:2] == (_file_path, _mtime):
+        return _cached[2]
+
+    _analysis_config = _loader.load_module(analysis_name)
+    _ANALYSIS_CONFIG_CACHE[analysis_name] = (_file_path, _mtime, _analysis_config)
+    return _analysis_config
+
+
+# state shared with worker processes when running in parallel
+_PARALLEL_RUN_STATE = None
+
+def _run_tasks_for_input_chunk(i_chunk_and_input_files):
+    '''worker function: run all tasks for a chunk of input files and write to partial output files'''
+    _i_chunk, _input_files = i_chunk_and_input_files
+    _lumberjack, _task_configs = _PARALLEL_RUN_STATE
+
+    # restrict input to the chunk
+    _lumberjack._args.input_file = _input_files
+    # task configuration is dumped by the parent process, partial outputs are always overwritten
+    _lumberjack._args.dump_yaml = False
+    _lumberjack._args.overwrite = True
+
+    _partial_task_configs = [
+        (_task_name, dict(_task_spec,
+            _filename=_lumberjack._get_partial_filename(_task_spec['_filename'], _i_chunk),
+            _log_filename=_lumberjack._get_partial_filename(_task_spec.get('_log_filename', None), _i_chunk),
+        ))
+        for _task_name, _task_spec in _task_configs
+    ]
+
+    _lumberjack._prepare_bare_data_frame()
+    _lumberjack._run_tasks(_partial_task_configs)
+
+    return [_task_spec['_filename'] for _, _task_spec in _partial_task_configs]
+
+
 class LumberjackCLI(LumberjackInterfaceBase):
 
     class _LumberjackCLIHelpAction(argparse._HelpAction):
@@ -584,11 +1825,11 @@ class LumberjackCLI(LumberjackInterfaceBase):
 
             parser.exit()
 
-    def __init__(self):
-        super(LumberjackCLI, self).__init__()  # no kwargs
+    def __init__(self, argv=None, warm_state=None):
+        super(LumberjackCLI, self).__init__(warm_state=warm_state, argv=argv)
 
-    def _get_args_config(self):
-        '''parse CLI arguments and retrieve analysis config'''
+    def _get_args_config(self, argv=None):
+        '''parse CLI arguments (`sys.argv` if `argv` is not given) and retrieve analysis config'''
         import pkgutil
 
         import Karma.PostProcessing.Lumberjack.cfg as cfg_module
@@ -615,7 +1856,7 @@ class LumberjackCLI(LumberjackInterfaceBase):
             choices=_available_analysis_configs.keys(),
             nargs='?')
 
-        _analysis_name = _pre_parser.parse_known_args()[0].analysis
+        _analysis_name = _pre_parser.parse_known_args(argv)[0].analysis
 
         # -- main parser: read other flags and populate help based on content of '--analysis' flag
 
@@ -628,17 +1869,91 @@ class LumberjackCLI(LumberjackInterfaceBase):
         _required_args.add_argument(
             '-a', '--analysis', metavar='ANALYSIS_NAME', type=str,
             help="Name of the analysis configuration to load (must have a configuration module under 'Lumberjack/cfg/ANALYSIS_NAME')",
-            required=True,
             choices=_available_analysis_configs.keys())
-        _required_args.add_argument('-i', '--input-file', metavar='FILE', type=str, help='Input file', required=True)
+        _required_args.add_argument('-i', '--input-file', metavar='FILE', type=str, nargs='+',
+            help="Input file(s). Glob patterns are expanded. If more than one file is given, the trees are processed as a chain.")
         _required_args.add_argument('--selections', metavar='SELECTION', help='Specification of event selection cuts', nargs='+')
 
         _optional_args = _top_parser.add_argument_group('optional arguments', '')
         _optional_args.add_argument('-h', '--help', action=self.__class__._LumberjackCLIHelpAction, help="Display help and exit")
         _optional_args.add_argument('-t', '--tree', metavar='TREE', help="Name of the TTree containng the ntuple (default: 'Events')", default='Events')
         _optional_args.add_argument('-j', '--jobs', help="Number of jobs (threads) to use with EnableImplicitMT (default: 1)", default=1)
+        _optional_args.add_argument('--output-compression-algorithm', choices=COMPRESSION_ALGORITHMS, default=None,
+            help="Compression algorithm to use for the output files (default: ROOT default).")
+        _optional_args.add_argument('--output-compression-level', metavar='LEVEL', type=int, default=None,
+            help="Compression level to use for the output files, between 0 (no compression) and 9 (default: ROOT default).")
+        _optional_args.add_argument('--max-memory', metavar='MB', type=int, default=None,
+            help="Memory budget (in MB) for the objects filled by a single task. The memory needed is estimated from the "
+                 "binnings, object types, exports, number of variations and number of threads. Tasks exceeding the budget are split into subtasks run in "
+                 "sequence, as with the 'key@N' splitting syntax. With `--single-event-loop`, the tasks are grouped into "
+                 "several event loops, each filling objects within the budget.")
+        _optional_args.add_argument('-p', '--processes', type=int, default=1,
+            help="Number of processes to use. If larger than 1, the input files are split into chunks processed in parallel "
+                 "and the partial outputs (ROOT files, exported quantities and logs) are merged afterwards (default: 1)")
         _optional_args.add_argument('-n', '--num-events', help="Number of events to process. Incompatible with multithreading. Use 0 or negative for all (default)", default=-1)
+        _optional_args.add_argument('--sample-fraction', metavar='FRACTION', type=float, default=None,
+            help="Process only a uniformly distributed fraction (between 0 and 1) of the entries, selected by hashing "
+                 "the value of `--sample-key`. The sample is reproducible as long as the key identifies each entry "
+                 "independently of how the input is processed. Histograms are scaled by the inverse of the fraction and "
+                 "the output file is tagged with the fraction used.")
+        _optional_args.add_argument('--sample-key', metavar='EXPR', default=None,
+            help="Integer expression identifying each entry, used for selecting the sample, e.g. an event number. "
+                 "Defaults to the entry number 'rdfentry_' in the input chain, which is only reproducible when running "
+                 "with a single thread and process: a key is therefore required with `-j` or `-p` larger than 1.")
+        _optional_args.add_argument('--variations', metavar='VARIATION', nargs='+', default=None,
+            help="Systematic variations (defined in `VARIATIONS` in the analysis config) for which to produce all objects in "
+                 "addition to the nominal ones, in the same event loop. The output for each variation is written to the "
+                 "subdirectory 'variations/<VARIATION>' of the output file.")
         _optional_args.add_argument('--dry-run', help="Set up post-processing tasks, but do not execute", action='store_true')
+        _optional_args.add_argument('--single-event-loop',
+            help="Book the objects of all tasks on a single data frame and fill them in one event loop, instead of running "
+                 "one event loop per task.", action='store_true')
+        _optional_args.add_argument('--split-mode', choices=['filter', 'index', 'sparse'], default='filter',
+            help="How to split the data frame into subsamples. 'filter' creates a chain of `Filter` nodes per subsample. "
+                 "'index' computes one split index per splitting key (binary search over the range edges) and fills objects "
+                 "with an additional split axis, which are sliced into per-subsample objects on output. 'sparse' is like "
+                 "'index', but fills histograms into sparse histograms, so that only occupied bins use memory "
+                 "(default: 'filter').")
+        _optional_args.add_argument('--write-sparse', action='store_true',
+            help="With `--split-mode sparse`, write the sparse histograms (with one labeled bin per subsample on the "
+                 "last axis) to the directory 'sparse' in the output file, instead of expanding them into one histogram "
+                 "per subsample.")
+        _optional_args.add_argument('--batch-weights', action='store_true',
+            help="Fill histograms which only differ in their weights (e.g. systematic weight variations) with a single "
+                 "action, which looks up the bin once per event and adds each weight to its own histogram.")
+        _optional_args.add_argument('--cache-dir', metavar='DIR', default=None,
+            help="Directory for caching produced objects across runs. Objects are cached individually, keyed by the input file, "
+                 "tree, selections, column definitions and object specification. On subsequent runs, only objects not found "
+                 "in the cache are filled.")
+        _optional_args.add_argument('--jit-cache-dir', metavar='DIR', default=None,
+            help="Directory for caching compiled expressions. The expressions in QUANTITIES, DEFINES and SELECTIONS "
+                 "are compiled into a shared library once and loaded on subsequent runs, instead of being compiled "
+                 "just-in-time at every startup.")
+        _optional_args.add_argument('--keep-all-defines', action='store_true',
+            help="Define all columns in QUANTITIES and DEFINES, even those not needed by any of the tasks to run.")
+        _optional_args.add_argument('--optimize-selections', metavar='N', type=int, default=0,
+            help="Reorder the filters of the global selections based on their cost and rejection rate, as measured on the "
+                 "first N events. Filters accessing container elements are kept in place. Not available with "
+                 "multithreading. (default: 0, i.e. keep order)")
+        _optional_args.add_argument('--profile', choices=['yml', 'json'], nargs='?', const='yml', default=None,
+            help="Profile the data frame nodes: report the number of processed events, pass fractions and (estimated) time "
+                 "spent for each Define, Filter and booked object, as well as the cut-flow of the global selections. "
+                 "The report is written next to each output file, in YAML (default) or JSON format. "
+                 "Not supported with more than one process (`-p`).")
+        _optional_args.add_argument('--snapshot-dir', metavar='DIR', default=None,
+            help="Directory containing snapshots of the selected events (created with the 'snapshot' subcommand). "
+                 "If a snapshot for the same input, tree and selections containing all needed branches exists, it is used "
+                 "as input instead.")
+        _optional_args.add_argument('--master-binning', action='store_true',
+            help="Fill each histogram (and 1D profile) using the master binning of its quantities and rebin exactly to the "
+                 "requested binning on output. The master binning is the `master_binning` of the quantity or, if not given, "
+                 "the union of the bin edges of its default and named binnings. Together with `--cache-dir`, changing to "
+                 "another binning within the edges of a configured `master_binning` does not require a new event loop.")
+        _optional_args.add_argument('--export-format', choices=['npz', 'parquet'], default='npz',
+            help="File format for exported quantities. Format 'parquet' requires the `pyarrow` package (default: 'npz')")
+        _optional_args.add_argument('--export-chunk-size', metavar='N', type=int, default=1000000,
+            help="Maximum number of rows per file for exported quantities. The values are written to temporary ROOT files "
+                 "during the event loop and converted one chunk at a time afterwards (default: 1000000)")
         _optional_args.add_argument('--overwrite', help="Overwrite output file, if it exists.", action='store_true')
         _optional_args.add_argument('--log', help="Whether to output a log file.", action="store_true")
         _optional_args.add_argument('--dump-yaml', help="Whether to dump the task configuration as a YAML file.", action="store_true")
@@ -650,7 +1965,7 @@ class LumberjackCLI(LumberjackInterfaceBase):
 
         # retrieve analysis config (tasks, splittings, quantities, etc.)
         if _analysis_name is not None:
-            _analysis_config = _available_analysis_configs[_analysis_name].find_module(_analysis_name).load_module(_analysis_name)
+            _analysis_config = _load_analysis_config(_available_analysis_configs[_analysis_name], _analysis_name)
             for _required_config_key in ('TASKS', 'SPLITTINGS', 'QUANTITIES'):
                 try:
                     getattr(_analysis_config, _required_config_key)
@@ -661,11 +1976,12 @@ class LumberjackCLI(LumberjackInterfaceBase):
             SPLITTINGS = _analysis_config.SPLITTINGS.keys()
             _allowed_input_types = set(_analysis_config.QUANTITIES.keys()) - {"global"}
         else:
+            _analysis_config = None
             TASKS = None
             SPLITTINGS = None
             _allowed_input_types = set()
 
-        _required_args.add_argument('--input-type', metavar='TYPE', type=str, help='Sample type. Choices: {%(choices)s}', choices=_allowed_input_types, required=True)
+        _required_args.add_argument('--input-type', metavar='TYPE', type=str, help='Sample type. Choices: {%(choices)s}', choices=_allowed_input_types)
 
         _subparsers = _top_parser.add_subparsers(help='Operation to perform. Available: {%(choices)s}', dest='subparser_name', metavar='SUBCOMMAND')
         _subparsers.required = True
@@ -689,8 +2005,54 @@ class LumberjackCLI(LumberjackInterfaceBase):
                                            'separating the sample into subsamples. Choices: {%(choices)s}', nargs='+', choices=SPLITTINGS, metavar='SPLITTING')
         _parsers['freestyle'].add_argument('--histograms', metavar='HISTOGRAM', help='Specification of histograms', nargs='+')
         _parsers['freestyle'].add_argument('--profiles', metavar='PROFILE', help='Specification of profiles', nargs='+')
+        _parsers['freestyle'].add_argument('--exports', metavar='EXPORT', help="Specification of quantities to export ('q1:q2:...[@weight]')", nargs='+')
         _parsers['freestyle'].add_argument('--output-file', metavar='OUTPUT', help="Name of the output file.", required=True)
 
-        _args = _top_parser.parse_args()
-
-        return _top_parser.parse_args(), _analysis_config
+        # subcommand 'snapshot' for writing the selected events to a compact TTree
+        _parsers['snapshot'] = _subparsers.add_parser('snapshot', help='Write the events passing the selections to a TTree in the snapshot directory, for use in later runs')
+        _parsers['snapshot'].add_argument('TASK_NAME', type=str, help='Name of task(s) whose needed branches are written (default: all). Choices: {}'.format("{" + ", ".join(TASKS or []) + "}"), nargs='*', metavar='TASK')
+        _parsers['snapshot'].add_argument('--compression-algorithm', choices=COMPRESSION_ALGORITHMS, default='lz4',
+            help="Compression algorithm to use for the snapshot (default: 'lz4')")
+        _parsers['snapshot'].add_argument('--compression-level', type=int, default=4,
+            help="Compression level to use for the snapshot (default: 4)")
+
+        # subcommand 'merge' for combining output files
+        _parsers['merge'] = _subparsers.add_parser('merge', help='Merge output files produced by Lumberjack (e.g. of subtasks or parallel jobs)')
+        _parsers['merge'].add_argument('INPUT_FILE', type=str, help='Files to merge. Glob patterns are expanded.', nargs='+')
+        _parsers['merge'].add_argument('--output-file', metavar='OUTPUT', help="Name of the output file.", required=True)
+
+        # subcommand 'serve' for keeping the interpreter and prepared data frames in memory across requests
+        _parsers['serve'] = _subparsers.add_parser('serve', help="Run as a server processing requests sent with 'lumberjack_client.py', "
+                                                   "keeping the ROOT interpreter, analysis configurations and prepared data frames in memory")
+        _parsers['serve'].add_argument('--socket', metavar='PATH', default=os.getenv('LUMBERJACK_SOCKET'),
+            help="Path of the UNIX socket to listen on (default: value of environment variable LUMBERJACK_SOCKET)")
+        _parsers['serve'].add_argument('--max-data-frames', metavar='N', type=int, default=4,
+            help="Maximum number of sets of input files for which data frames are kept in memory. The least recently "
+                 "used ones are discarded first. Default: %(default)s")
+        _parsers['serve'].add_argument('--max-requests', metavar='N', type=int, default=20,
+            help="Number of requests after which a kept data frame is set up again, releasing the nodes booked by "
+                 "previous requests. Default: %(default)s")
+
+        _args = _top_parser.parse_args(argv)
+
+        if getattr(_args, 'sample_fraction', None) is not None and not 0.0 < _args.sample_fraction <= 1.0:
+            _top_parser.error("argument --sample-fraction: must be between 0 (exclusive) and 1 (inclusive)")
+
+        # the entry number depends on the order of processing (multithreading) and restarts for each input chunk (processes)
+        if getattr(_args, 'sample_fraction', None) is not None and _args.sample_key is None:
+            if int(getattr(_args, 'jobs', 1)) > 1 or getattr(_args, 'processes', 1) > 1:
+                _top_parser.error("argument --sample-key: required with --sample-fraction when running with more than one "
+                                  "thread (-j) or process (-p), since the entry number does not identify entries reproducibly")
+            _args.sample_key = 'rdfentry_'
+
+        # profiling reports are not merged across processes
+        if getattr(_args, 'profile', None) is not None and getattr(_args, 'processes', 1) > 1:
+            _top_parser.error("argument --profile: not supported with more than one process (-p/--processes)")
+
+        # analysis and input are only required when processing ntuples
+        if _args.subparser_name not in ('merge', 'serve'):
+            for _required_arg_dest, _required_arg_flags in (('analysis', '-a/--analysis'), ('input_file', '-i/--input-file'), ('input_type', '--input-type')):
+                if getattr(_args, _required_arg_dest) is None:
+                    _top_parser.error("argument {} is required".format(_required_arg_flags))
+
+        return _args, _analysis_config
@@ -80,6 +80,14 @@ class AnalyzeProcessor(_ProcessorBase):
         return self._files[filename]
 
 
+    def _get_config_expressions(self, config):
+        '''return the expressions of all subtasks'''
+        return [
+            _subtask_cfg['expression']
+            for _subtask_cfg in config.get('subtasks', [])
+            if isinstance(_subtask_cfg.get('expression', None), str)
+        ]
+
     # -- actions
 
     def _request(self, config):
@@ -227,7 +227,13 @@ class _ProcessorBase(object):
         return var
 
 
+    def _get_config_expressions(self, config):
+        '''return the input expressions evaluated by the actions for a (context-resolved) template configuration'''
+        return []
+
     def _run_with_context(self, action_method, context):
+        # resolve all template configurations for this context first
+        _configs = []
         for _template in self._config[self.CONFIG_KEY_FOR_TEMPLATES]:
             _config = deepcopy(_template)
 
@@ -248,6 +254,20 @@ class _ProcessorBase(object):
                     _new_e = _ContextResolutionError.from_other(e, new_path=(_subkey_for_context_replacing,) + e.path)
                     six.raise_from(_new_e, e)
 
+            _configs.append(_config)
+
+        # share common sub-expressions between all expressions evaluated in this context
+        _input_controller = getattr(self, '_input_controller', None)
+        if _input_controller is None:
+            self._run_configs(action_method, _configs)
+            return
+
+        _expressions = [_expr for _config in _configs for _expr in self._get_config_expressions(_config)]
+        with _input_controller.shared_subexpressions(_expressions):
+            self._run_configs(action_method, _configs)
+
+    def _run_configs(self, action_method, configs):
+        for _config in configs:
             try:
                 action_method(self, _config)
             except Exception as e:
@@ -281,3 +301,8 @@ class _ProcessorBase(object):
                 except _ContextResolutionError as e:
                     # "cast" internal _ContextResolutionError to ConfigurationError before raising
                     six.raise_from(ConfigurationError(str(e)), e)
+
+            # read objects requested by the action from all input files in parallel
+            _input_controller = getattr(self, '_input_controller', None)
+            if _input_controller is not None:
+                _input_controller.prefetch()
@@ -618,6 +618,14 @@ class PlotProcessor(_ProcessorBase):
 
         return _pad_id
 
+    def _get_config_expressions(self, config):
+        '''return the expressions of all subplots'''
+        return [
+            _subplot_cfg['expression']
+            for _subplot_cfg in config.get('subplots', [])
+            if isinstance(_subplot_cfg.get('expression', None), str)
+        ]
+
     # -- actions
 
     def _request(self, config):
@@ -2,6 +2,8 @@ from __future__ import print_function
 
 import ast
 import functools
+import multiprocessing
+import numbers
 import ROOT
 import numpy as np
 import operator as op
@@ -10,8 +12,11 @@ import pandas as pd
 import six
 import sys
 import uuid
+import weakref
 
 from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from rootpy import asrootpy
 from rootpy.io import root_open, DoesNotExist
@@ -38,7 +43,7 @@ except ImportError:
 import scipy.stats as stats
 
 
-__all__ = ['InputROOTFile', 'InputROOT']
+__all__ = ['InputROOTFile', 'InputROOT', 'MemoizationCache']
 
 
 class HashableMap(Mapping):
@@ -100,6 +105,197 @@ class HashableMap(Mapping):
         return "%s(%s)" % (self.__class__.__name__, self._d)
 
 
+class MemoizationCache(object):
+    """A size-bounded cache for the results of memoized input functions.
+
+    Results are stored together with an estimate of their size in memory.
+    When the total size exceeds `max_bytes`, the least recently used results
+    are evicted until the cache fits into the budget again. If `max_bytes`
+    is ``None``, the size of the cache is not limited.
+
+    Statistics about cache hits, misses and evictions can be obtained via
+    :py:meth:`get_stats`.
+    """
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size), in order of last use
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        self._max_bytes = value
+        self._evict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def estimate_size(value):
+        """Estimate the size of `value` in memory (in bytes)."""
+        # histograms and profiles: bin contents and sums of squared weights
+        if hasattr(value, 'GetNcells'):
+            try:
+                _n_arrays = 1 + int(value.GetSumw2N() > 0) + int(isinstance(value, _ProfileBase))
+                return 512 + 8 * _n_arrays * value.GetNcells()
+            except (AttributeError, TypeError):
+                pass
+        # graphs: x/y values and errors
+        if hasattr(value, 'GetN') and hasattr(value, 'GetX'):
+            return 512 + 6 * 8 * value.GetN()
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(MemoizationCache.estimate_size(_v) for _v in value)
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(MemoizationCache.estimate_size(_v) for _v in six.itervalues(value))
+        return sys.getsizeof(value)
+
+    def get(self, key):
+        """Retrieve the value stored under `key`. Raises a `KeyError` if the key is not in the cache."""
+        try:
+            _value, _size = self._entries.pop(key)
+        except KeyError:
+            self._misses += 1
+            raise
+        # re-insert to mark as most recently used
+        self._entries[key] = (_value, _size)
+        self._hits += 1
+        return _value
+
+    def put(self, key, value):
+        """Store `value` under `key`, evicting the least recently used values if needed."""
+        if key in self._entries:
+            self._size_bytes -= self._entries.pop(key)[1]
+        _size = self.estimate_size(value)
+        self._entries[key] = (value, _size)
+        self._size_bytes += _size
+        self._evict()
+
+    def _evict(self):
+        if self._max_bytes is None:
+            return
+        # the most recently stored value is kept, even if it exceeds the budget by itself
+        while self._size_bytes > self._max_bytes and len(self._entries) > 1:
+            _, (_, _size) = self._entries.popitem(last=False)
+            self._size_bytes -= _size
+            self._evictions += 1
+
+    def clear(self):
+        """Remove all values from the cache and reset the statistics."""
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_stats(self):
+        """Return a `dict` with the number of hits, misses and evictions, and the number and (estimated) total size of stored values."""
+        return dict(
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            entries=len(self._entries),
+            size_bytes=self._size_bytes,
+            max_bytes=self._max_bytes,
+        )
+
+
+# keys identifying the origin of objects, by object id. Entries are removed when the object is deleted.
+_PROVENANCE = {}
+
+
+def _get_provenance(value):
+    '''key identifying `value` by its origin (e.g. file and path of the object). Returns `None` if not known.'''
+    _entry = _PROVENANCE.get(id(value), None)
+    if _entry is not None and _entry[0]() is value:
+        return _entry[1]
+    return None
+
+
+def _set_provenance(value, provenance):
+    '''register a key identifying the origin of `value`. Has no effect for objects not supporting weak references.'''
+    _id = id(value)
+
+    def _remove(ref):
+        if _PROVENANCE.get(_id, (None,))[0] is ref:
+            del _PROVENANCE[_id]
+
+    try:
+        _ref = weakref.ref(value, _remove)
+    except TypeError:
+        return
+    _PROVENANCE[_id] = (_ref, provenance)
+
+
+def _get_memoization_key(value):
+    '''hashable key for a function argument: objects read from files (or computed by memoized functions)
+    are identified by their origin, literals by their value and all other objects by their identity.'''
+    _provenance = _get_provenance(value)
+    if _provenance is not None:
+        return _provenance
+    if value is None or isinstance(value, (bool, numbers.Number) + six.string_types):
+        return ('literal', value)
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_get_memoization_key(_v) for _v in value))
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((_k, _get_memoization_key(_v)) for _k, _v in six.iteritems(value))))
+    # fall back to identity (the key keeps a reference to the object, so it cannot be reused)
+    return ('object', value)
+
+
+class _SubexpressionScope(object):
+    """Results of sub-expressions shared by several expressions evaluated in the same scope
+    (see :py:meth:`~DijetAnalysis.PostProcessing.Palisade.InputROOT.shared_subexpressions`).
+
+    `remaining_uses` maps each shared sub-expression (as an AST dump) to the number of times
+    it is expected to be evaluated. Results are stored by sub-expression and by the function and
+    evaluated arguments. All results for a sub-expression are released after its last use.
+    """
+
+    def __init__(self, remaining_uses):
+        self._remaining_uses = remaining_uses
+        self._results = {}
+        self.n_hits = 0
+        self.n_computed = 0
+
+    def is_shared(self, subexpression):
+        return subexpression in self._remaining_uses
+
+    def evaluate(self, subexpression, get_key, compute):
+        '''return the result stored for the key returned by `get_key`, or call `compute` to obtain and store it'''
+        _results = self._results.setdefault(subexpression, {})
+        try:
+            _key = get_key()
+            _result = _results[_key]
+            self.n_hits += 1
+        except KeyError:
+            _result = compute()
+            _results[_key] = _result
+            self.n_computed += 1
+        except TypeError:
+            # unhashable arguments (e.g. arrays): evaluate without sharing
+            _result = compute()
+
+        # release intermediate results after the last use
+        self._remaining_uses[subexpression] -= 1
+        if self._remaining_uses[subexpression] <= 0:
+            del self._remaining_uses[subexpression]
+            del self._results[subexpression]
+
+        return _result
+
+
 class _ROOTObjectFunctions(object):
 
     @staticmethod
@@ -687,12 +883,140 @@ class _ROOTObjectFunctions(object):
         return _new_tobject
 
 
+class _OpenROOTFile(object):
+    """An open ROOT file kept in a :py:class:`_ROOTFilePool`, together with an index of
+    the keys in its directories. The index is built for each directory on first access."""
+
+    def __init__(self, filename, mtime):
+        self.filename = filename
+        self.mtime = mtime
+        self.tfile = root_open(filename)
+        self._directory_keys = {}
+        self._available_paths = None
+
+    def _get_directory_keys(self, directory_path):
+        '''set of the names of all keys in the directory at `directory_path` (empty if no such directory)'''
+        _keys = self._directory_keys.get(directory_path, None)
+        if _keys is None:
+            try:
+                _tdirectory = self.tfile.GetDirectory(directory_path) if directory_path else self.tfile
+            except DoesNotExist:
+                _tdirectory = None
+            _keys = set(_key.GetName() for _key in _tdirectory.GetListOfKeys()) if _tdirectory else set()
+            self._directory_keys[directory_path] = _keys
+        return _keys
+
+    def get_available_paths(self):
+        '''list of paths of all objects in the file'''
+        if self._available_paths is None:
+            self._available_paths = ['{}/{}'.format(_path, _obj_name) for _path, _, _obj_names in self.tfile.walk() for _obj_name in _obj_names]
+        return self._available_paths
+
+    def get(self, object_path):
+        '''retrieve an object from the file, raising `DoesNotExist` if it is not in the key index'''
+        _directory_path, _, _name = object_path.strip('/').rpartition('/')
+
+        # objects with explicit cycle numbers are not indexed
+        if ';' not in _name and _name not in self._get_directory_keys(_directory_path):
+            raise DoesNotExist("requested path '{}' does not exist in {}".format(object_path, self.filename))
+
+        return self.tfile.Get(object_path)
+
+    def close(self):
+        self.tfile.Close()
+
+
+class _ROOTFilePool(object):
+    """A process-wide pool of open ROOT files.
+
+    Files are kept open between requests, so that the list of keys and the
+    streamer information are read only once. When more than `max_open_files`
+    files are open, the least recently used ones are closed. Files which
+    have been modified since they were opened are reopened. If `max_open_files`
+    is ``None``, the number of open files is not limited.
+    """
+
+    def __init__(self, max_open_files=None):
+        self._max_open_files = max_open_files
+        self._open_files = OrderedDict()  # filename -> _OpenROOTFile, in order of last use
+
+    @property
+    def max_open_files(self):
+        return self._max_open_files
+
+    @max_open_files.setter
+    def max_open_files(self, value):
+        self._max_open_files = value
+        self._evict()
+
+    def __len__(self):
+        return len(self._open_files)
+
+    def get_file(self, filename, mtime=None):
+        '''retrieve the open file `filename`, opening it if needed (`mtime` is the current modification time)'''
+        _open_file = self._open_files.pop(filename, None)
+
+        # reopen files modified since they were opened
+        if _open_file is not None and _open_file.mtime != mtime:
+            _open_file.close()
+            _open_file = None
+
+        if _open_file is None:
+            _open_file = _OpenROOTFile(filename, mtime)
+
+        # (re-)insert to mark as most recently used
+        self._open_files[filename] = _open_file
+        self._evict()
+        return _open_file
+
+    def _evict(self):
+        '''close least recently used files until the maximum number of open files is respected'''
+        if self._max_open_files is None:
+            return
+        # always keep the most recently used file open
+        while len(self._open_files) > max(self._max_open_files, 1):
+            _, _open_file = self._open_files.popitem(last=False)
+            _open_file.close()
+
+    def close_all(self):
+        '''close all open files'''
+        for _open_file in six.itervalues(self._open_files):
+            _open_file.close()
+        self._open_files.clear()
+
+
+def _get_file_mtime(filename):
+    '''modification time of the file, for identifying the objects read from it (``None`` if unavailable)'''
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+
+def _prefetch_objects(filename, requests):
+    '''read the objects for `requests` (dict of object paths to request specifications) from the file
+    `filename` and return them together with the modification time of the file. Objects which cannot be
+    read are omitted. Run in worker processes by :py:meth:`InputROOT.prefetch`.'''
+    _file_mtime = _get_file_mtime(filename)
+    _objects = {}
+    with root_open(filename) as _tfile:
+        for _object_path, _request_spec in six.iteritems(requests):
+            try:
+                _objects[_object_path] = InputROOTFile._prepare_object(_tfile.Get(_object_path), **_request_spec)
+            except Exception:
+                # reported when read again on first use
+                continue
+    return _file_mtime, _objects
+
+
 class InputROOTFile(object):
     """An input module for accessing objects from a single ROOT file.
 
     Multiple objects can be requested. They will be all be retrieved
     simultaneously and cached on the first subsequent call to `get()`.
-    The file will thus only be opened once.
+    The file is taken from a process-wide pool of open files, so that it is
+    not reopened for subsequent requests (see
+    :py:meth:`~DijetAnalysis.PostProcessing.Palisade.InputROOTFile.set_max_open_files`).
 
     Usage example:
 
@@ -704,57 +1028,93 @@ class InputROOTFile(object):
        my_object = m.get('MyDirectory/myObject')
     """
 
+    _file_pool = _ROOTFilePool(max_open_files=64)
+
     def __init__(self, filename):
         self._filename = filename
         self._outstanding_requests = dict()
         self._plot_data_cache = dict()
 
+    @classmethod
+    def set_max_open_files(cls, max_open_files):
+        """Set the maximum number of ROOT files kept open at the same time. The least recently
+        used files are closed when more files are open. If ``None``, the number is not limited."""
+        cls._file_pool.max_open_files = max_open_files
+
+    @classmethod
+    def close_all_files(cls):
+        """Close all ROOT files kept open."""
+        cls._file_pool.close_all()
+
     def _process_outstanding_requests(self):
         # if no requests, return immediately
         if not self._outstanding_requests:
             return
 
+        _file_mtime = _get_file_mtime(self._filename)
+
         # process outstanding requests
-        with root_open(self._filename) as _tfile:
-            for tobj_path, request_spec in six.iteritems(self._outstanding_requests):
-                _rebin_factor = request_spec.pop('rebin_factor', None)
-                _profile_error_option = request_spec.pop('profile_error_option', None)
-
-                try:
-                    _tobj = _tfile.Get(tobj_path)
-                except DoesNotExist as e:
-                    _available_paths = ['{}/{}'.format(_path, _obj_name) for _path, _, _obj_names in _tfile.walk() for _obj_name in _obj_names]
-                    if not _available_paths:
-                        six.raise_from(DoesNotExist(e.args[0] + " (file does not seem to contain any objects)."), e)
-
-                    # sort available paths by similarity to original query
-                    _sim_lambda = lambda s: text_similarity_metric(tobj_path, s)
-                    _available_paths.sort(key=lambda s: text_similarity_metric(tobj_path, s), reverse=True)
-
-                    # raise more informative exception
-                    six.raise_from(DoesNotExist(e.args[0] + ". Did you mean '{}'?".format(_available_paths[0].strip('/'))), e)
-
-                # for histograms: move to global directory
-                try:
-                    _tobj.SetDirectory(0)
-                except AttributeError:
-                    # call not needed to other objects
-                    pass
-                #print(tobj_path, _tobj)
-
-                # aply rebinning (if requested)
-                if _rebin_factor is not None:
-                    _tobj.Rebin(_rebin_factor)
-
-                # set TProfile error option (if requested)
-                if _profile_error_option is not None:
-                    # TOOD: check if profile?
-                    _tobj.SetErrorOption(_profile_error_option)
-
-                self._plot_data_cache[tobj_path] = _tobj
+        _open_file = self._file_pool.get_file(self._filename, _file_mtime)
+        for tobj_path, request_spec in six.iteritems(self._outstanding_requests):
+            try:
+                _tobj = _open_file.get(tobj_path)
+            except DoesNotExist as e:
+                _available_paths = list(_open_file.get_available_paths())
+                if not _available_paths:
+                    six.raise_from(DoesNotExist(e.args[0] + " (file does not seem to contain any objects)."), e)
+
+                # sort available paths by similarity to original query
+                _sim_lambda = lambda s: text_similarity_metric(tobj_path, s)
+                _available_paths.sort(key=lambda s: text_similarity_metric(tobj_path, s), reverse=True)
+
+                # raise more informative exception
+                six.raise_from(DoesNotExist(e.args[0] + ". Did you mean '{}'?".format(_available_paths[0].strip('/'))), e)
+
+            self._store_object(tobj_path, self._prepare_object(_tobj, **request_spec), request_spec, _file_mtime)
 
         self._outstanding_requests = dict()
 
+    @staticmethod
+    def _prepare_object(tobj, rebin_factor=None, profile_error_option=None, **other_request_params):
+        '''detach an object read from a file and apply the options given in the request'''
+        # for histograms: move to global directory
+        try:
+            tobj.SetDirectory(0)
+        except AttributeError:
+            # call not needed to other objects
+            pass
+
+        # aply rebinning (if requested)
+        if rebin_factor is not None:
+            tobj.Rebin(rebin_factor)
+
+        # set TProfile error option (if requested)
+        if profile_error_option is not None:
+            # TOOD: check if profile?
+            tobj.SetErrorOption(profile_error_option)
+
+        return tobj
+
+    def _store_object(self, tobj_path, tobj, request_spec, file_mtime):
+        '''store an object read for a request in the cache'''
+        _set_provenance(tobj, ('file', self._filename, file_mtime, tobj_path,
+                               request_spec.get('rebin_factor', None), request_spec.get('profile_error_option', None)))
+        self._plot_data_cache[tobj_path] = tobj
+
+    def _add_prefetched_objects(self, file_mtime, objects):
+        '''store objects read by a worker process and remove the corresponding requests'''
+        for _tobj_path, _tobj in six.iteritems(objects):
+            _request_spec = self._outstanding_requests.pop(_tobj_path, None)
+            if _request_spec is None:
+                # request withdrawn in the meantime
+                continue
+            # unpickled histograms are attached to the current directory again
+            try:
+                _tobj.SetDirectory(0)
+            except AttributeError:
+                pass
+            self._store_object(_tobj_path, asrootpy(_tobj), _request_spec, file_mtime)
+
 
     def get(self, object_path):
         """
@@ -836,7 +1196,18 @@ class InputROOT(object):
     )
 
     # class-level cache for storing memoized function results
-    _cache = {}
+    _cache = MemoizationCache(max_bytes=1024**3)
+
+    # maximum number of worker processes for prefetching objects (prefetching disabled by default)
+    _prefetch_workers = 1
+
+    # pool of worker processes for prefetching objects, kept across calls to `prefetch`
+    _prefetch_pool = None
+    _prefetch_pool_size = None
+
+    # class-level cache for compiled expressions (evaluation plan and object specifications), by expression string
+    _expression_cache = OrderedDict()
+    _EXPRESSION_CACHE_SIZE = 10000
 
     def __init__(self, files_spec=None):
         """
@@ -877,6 +1248,7 @@ class InputROOT(object):
         self._input_controllers = {}
         self._file_nick_to_realpath = {}
         self._locals = {}
+        self._subexpression_scope = None
         if files_spec is not None:
             for _nickname, _file_path in six.iteritems(files_spec):
                 self.add_file(_file_path, nickname=_nickname)
@@ -915,6 +1287,10 @@ class InputROOT(object):
                 if ``True``, store function result in a cache on first call. For every
                 subsequent call with identical arguments, the result will be retrieved
                 from the cache instead of evaluating the function again.
+                Objects read from files are identified by the file path, its modification
+                time and the path of the object in the file, so that results are also reused
+                if the same object is read again. The size of the cache is limited (see
+                :py:meth:`~DijetAnalysis.PostProcessing.Palisade.InputROOT.set_cache_size`).
                 (*default*: ``False``)
 
         Usage examples:
@@ -976,17 +1352,20 @@ class InputROOT(object):
             def memoize(f):
                 @functools.wraps(f)
                 def _memoized_function(*args, **kwargs):
-                    # compute unique hash key for the argument structure
-                    key = HashableMap(func=f, args=args, kwargs=kwargs)
+                    # compute unique key for the function and argument structure
+                    key = ('result', f, _get_memoization_key(args), _get_memoization_key(kwargs))
 
                     # look up in cache
-                    if key in cls._cache:
+                    try:
                         # return if found
-                        return cls._cache[key]
+                        return cls._cache.get(key)
+                    except KeyError:
+                        pass
 
                     # compute and store if not found
                     _result = f(*args, **kwargs)
-                    cls._cache[key] = _result
+                    _set_provenance(_result, key)
+                    cls._cache.put(key, _result)
 
                     return _result
 
@@ -1123,6 +1502,83 @@ class InputROOT(object):
             _ic = self._get_input_controller_for_file(_file_nickname)
             _ic.request(_requests)
 
+    def prefetch(self, max_workers=None):
+        """
+        Retrieve all outstanding requested objects, reading from the
+        registered files in parallel, with one worker process per file.
+
+        Objects which cannot be read by a worker process remain requested and
+        are retrieved as usual when they are first accessed. Nothing is done if
+        objects are outstanding for fewer than two files or if only one worker
+        process is allowed (the default).
+
+        .. note::
+
+            The objects read by the worker processes are sent to the main process
+            by pickling them. This only pays off if reading is slow compared to
+            this overhead, e.g. for many files on network storage. For local files,
+            reading in the main process from the files kept open by
+            :py:class:`~DijetAnalysis.PostProcessing.Palisade.InputROOTFile` is
+            usually as fast.
+
+        Parameters
+        ----------
+            max_workers : `int`
+                maximum number of worker processes. If :py:const:`None`,
+                the value set via
+                :py:meth:`~DijetAnalysis.PostProcessing.Palisade.InputROOT.set_prefetch_workers`
+                is used.
+        """
+        if max_workers is None:
+            max_workers = self._prefetch_workers
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+
+        _pending_ics = [_ic for _ic in six.itervalues(self._input_controllers) if _ic._outstanding_requests]
+        if len(_pending_ics) < 2 or max_workers < 2:
+            return
+
+        _pool = self._get_prefetch_pool(max_workers)
+        _async_results = [
+            (_ic, _pool.apply_async(_prefetch_objects, (_ic._filename, dict(_ic._outstanding_requests))))
+            for _ic in _pending_ics
+        ]
+        for _ic, _async_result in _async_results:
+            try:
+                _file_mtime, _objects = _async_result.get()
+            except Exception as e:
+                # objects are read on first access instead
+                print("[WARNING] Could not prefetch objects from file '{}': {}".format(_ic._filename, e))
+                continue
+            _ic._add_prefetched_objects(_file_mtime, _objects)
+
+    @classmethod
+    def _get_prefetch_pool(cls, n_workers):
+        '''pool of `n_workers` worker processes for prefetching, created on first use and kept for later calls'''
+        if cls._prefetch_pool is not None and cls._prefetch_pool_size != n_workers:
+            cls.close_prefetch_pool()
+        if cls._prefetch_pool is None:
+            cls._prefetch_pool = multiprocessing.Pool(processes=n_workers)
+            cls._prefetch_pool_size = n_workers
+        return cls._prefetch_pool
+
+    @classmethod
+    def close_prefetch_pool(cls):
+        """Shut down the worker processes used by
+        :py:meth:`~DijetAnalysis.PostProcessing.Palisade.InputROOT.prefetch`."""
+        if cls._prefetch_pool is not None:
+            cls._prefetch_pool.terminate()
+            cls._prefetch_pool.join()
+            cls._prefetch_pool = None
+            cls._prefetch_pool_size = None
+
+    @classmethod
+    def set_prefetch_workers(cls, max_workers):
+        """Set the maximum number of worker processes used by
+        :py:meth:`~DijetAnalysis.PostProcessing.Palisade.InputROOT.prefetch`. If ``None``,
+        the number of CPUs is used. A value of ``0`` or ``1`` (the default) disables prefetching."""
+        cls._prefetch_workers = max_workers
+
 
     def get_expr(self, expr, locals={}):
         """
@@ -1217,13 +1673,14 @@ class InputROOT(object):
 
         expr = expr.strip()   # extraneous spaces otherwise interpreted as indentation
 
-        self._request_all_objects_in_expression(expr)
+        _plan, _object_specs, _ = self._get_compiled_expression(expr)
+
+        self.request([dict(object_spec=_obj_spec, force_rerequest=False) for _obj_spec in _object_specs])
 
-        _result = self._eval(node=ast.parse(expr, mode='eval').body,
-                             ctx=dict(operators=self.operators,
-                                      functions=self.functions,
-                                      locals=_locals,
-                                      input=True))
+        _result = _plan(self, dict(operators=self.operators,
+                                   functions=self.functions,
+                                   locals=_locals,
+                                   input=True))
 
         # raise exceptions unable to be raised during `_eval` for technical reasons
         # (e.g. due to expressions with self-referencing local variables that would
@@ -1234,20 +1691,83 @@ class InputROOT(object):
         return _result
 
     def _request_all_objects_in_expression(self, expr, **other_request_params):
-        """Walk through the expression AST and request an object for each string or identifier"""
-        _ast = ast.parse(expr, mode='eval')
-        _reqs = []
-        for _node in ast.walk(_ast):
-            if isinstance(_node, ast.Name):
-                _obj_spec = _node.id
-            elif isinstance(_node, ast.Str):
-                _obj_spec = _node.s
-            else:
+        """Request an object for each string or identifier in the expression"""
+        _, _object_specs, _ = self._get_compiled_expression(expr)
+        self.request([dict(object_spec=_obj_spec, force_rerequest=False, **other_request_params) for _obj_spec in _object_specs])
+
+    @contextmanager
+    def shared_subexpressions(self, expressions):
+        """Context manager: share the results of sub-expressions (function calls and binary operations)
+        occurring more than once in `expressions` between all calls to
+        :py:meth:`~DijetAnalysis.PostProcessing.Palisade.InputROOT.get_expr` inside the context.
+
+        A shared sub-expression is computed once for each distinct combination of function and
+        evaluated arguments (objects are distinguished by their identity, literals by their value).
+        Its results are released as soon as it has been evaluated as often as it occurs in
+        `expressions`, and at the latest when leaving the context.
+
+        .. note::
+
+            Results of shared sub-expressions are returned to all expressions using them. They must
+            not be modified in-place by the caller.
+        """
+        _counts = {}
+        for _expr in expressions:
+            try:
+                _subexpressions = self._get_compiled_expression(_expr)[2]
+            except (SyntaxError, TypeError, NotImplementedError):
+                # invalid expressions are reported when evaluated
                 continue
+            for _subexpression in _subexpressions:
+                _counts[_subexpression] = _counts.get(_subexpression, 0) + 1
+
+        _previous_scope = self._subexpression_scope
+        self._subexpression_scope = _SubexpressionScope({
+            _subexpression: _count
+            for _subexpression, _count in six.iteritems(_counts)
+            if _count > 1
+        })
+        try:
+            yield self._subexpression_scope
+        finally:
+            self._subexpression_scope = _previous_scope
 
-            if ':' in _obj_spec:
-                _reqs.append(dict(object_spec=_obj_spec, force_rerequest=False, **other_request_params))
-        self.request(_reqs)
+    @classmethod
+    def _get_compiled_expression(cls, expr):
+        """Retrieve the evaluation plan, the object specifications and the shareable sub-expressions
+        for an expression, parsing and compiling the expression only on first use."""
+        expr = expr.strip()   # extraneous spaces otherwise interpreted as indentation
+        try:
+            _compiled = cls._expression_cache.pop(expr)
+        except KeyError:
+            _ast = ast.parse(expr, mode='eval')
+
+            # object specifications: strings or identifiers containing a colon
+            _object_specs = []
+            _subexpressions = []
+            for _node in ast.walk(_ast):
+                if isinstance(_node, (ast.Call, ast.BinOp)):
+                    _subexpressions.append(ast.dump(_node))
+                    continue
+                elif isinstance(_node, ast.Name):
+                    _obj_spec = _node.id
+                elif isinstance(_node, ast.Str):
+                    _obj_spec = _node.s
+                else:
+                    continue
+
+                if ':' in _obj_spec:
+                    _object_specs.append(_obj_spec)
+
+            _compiled = (cls._compile(_ast.body), tuple(_object_specs), tuple(_subexpressions))
+
+            # evict least recently used expression if cache is full
+            if len(cls._expression_cache) >= cls._EXPRESSION_CACHE_SIZE:
+                cls._expression_cache.popitem(last=False)
+
+        # (re-)insert to mark as most recently used
+        cls._expression_cache[expr] = _compiled
+        return _compiled
 
     def register_local(self, name, value):
         """
@@ -1277,136 +1797,217 @@ class InputROOT(object):
 
     def _eval(self, node, ctx):
         """Evaluate an AST node"""
+        return self._compile(node)(self, ctx)
+
+    @classmethod
+    def _compile(cls, node):
+        """Compile an AST node into a function taking the input controller and the evaluation context
+        as arguments. The node type is dispatched on once, so evaluating the function does not require
+        walking the AST again."""
         if node is None:
-            return None
+            return lambda ic, ctx: None
         elif isinstance(node, ast.Name):  # <identifier>
-            # lookup identifiers in local namespace
-            if node.id in ctx['locals']:
-                _local = ctx['locals'][node.id]
-
-                # if local variable contains a list, evaluate each element by threading 'get_expr' over it
-                if isinstance(_local, list):
-                    _retlist = []
-                    for _local_el in _local:
-                        # non-string elements are simply passed through
-                        if not isinstance(_local_el, str):
-                            _retlist.append(_local_el)
-                            continue
-
-                        # string-valued elements are evaluated
-                        try:
-                            # NOTE: local variable lookup is disabled when threading
-                            # over lists that were stored in local variables themselves.
-                            # This is done to prevent infinite recursion errors for
-                            # expressions which may reference themselves
-                            _ret_el = self.get_expr(_local_el, locals=None)
-                        except NameError as e:
-                            # one element of the list references a local variable
-                            # -> stop evaluation and return dummy
-                            # use NameError object instead of None to identifiy
-                            # dummy elements unambiguously later
-                            _retlist.append(e)
-                        else:
-                            # evaluation succeeded
-                            _retlist.append(_ret_el)
-                    return _retlist
-                # local variables containing strings are parsed
-                elif isinstance(_local, str):
-                    return self.get_expr(_local, locals=None)
-                # all other types are simply passed through
+            _id = node.id
+
+            # builtin Python literals (restrict subset of supported literals)
+            _literal_fallback = None
+            if _id in ('True', 'False', 'None'):
+                _literal_fallback = (ast.literal_eval(_id),)  # corresponding Python literal from string
+
+            def _name(ic, ctx):
+                # lookup identifiers in local namespace
+                if _id in ctx['locals']:
+                    _local = ctx['locals'][_id]
+
+                    # if local variable contains a list, evaluate each element by threading 'get_expr' over it
+                    if isinstance(_local, list):
+                        _retlist = []
+                        for _local_el in _local:
+                            # non-string elements are simply passed through
+                            if not isinstance(_local_el, str):
+                                _retlist.append(_local_el)
+                                continue
+
+                            # string-valued elements are evaluated
+                            try:
+                                # NOTE: local variable lookup is disabled when threading
+                                # over lists that were stored in local variables themselves.
+                                # This is done to prevent infinite recursion errors for
+                                # expressions which may reference themselves
+                                _ret_el = ic.get_expr(_local_el, locals=None)
+                            except NameError as e:
+                                # one element of the list references a local variable
+                                # -> stop evaluation and return dummy
+                                # use NameError object instead of None to identifiy
+                                # dummy elements unambiguously later
+                                _retlist.append(e)
+                            else:
+                                # evaluation succeeded
+                                _retlist.append(_ret_el)
+                        return _retlist
+                    # local variables containing strings are parsed
+                    elif isinstance(_local, str):
+                        return ic.get_expr(_local, locals=None)
+                    # all other types are simply passed through
+                    else:
+                        return _local
+
+                # if no local is found, try a few builtin Python literals
+                elif _literal_fallback is not None:
+                    return _literal_fallback[0]
+
+                # if nothing above matched, assume mistyped identifier and give up
+                # NOTE: do *not* assume identifier is a ROOT file path. ROOT file paths
+                # must be given explicitly as strings.
                 else:
-                    return _local
-
-            # if no local is found, try a few builtin Python literals
-            elif node.id in ('True', 'False', 'None'):  # restrict subset of supported literals
-                return ast.literal_eval(node.id)  # returns corresponding Python literal from string
-
-            # if nothing above matched, assume mistyped identifier and give up
-            # NOTE: do *not* assume identifier is a ROOT file path. ROOT file paths
-            # must be given explicitly as strings.
-            else:
-                raise NameError("Cannot resolve identifier '{}': not a valid Python literal or a registered local variable!".format(node.id))
+                    raise NameError("Cannot resolve identifier '{}': not a valid Python literal or a registered local variable!".format(_id))
+            return _name
         elif isinstance(node, ast.Str): # <string> : array column
-            if ctx['input']:
-                # lookup in ROOT file
-                return self.get(node.s)
-            else:
-                # return string as-is
-                return node.s
+            _s = node.s
+            def _str(ic, ctx):
+                if ctx['input']:
+                    # lookup in ROOT file
+                    return ic.get(_s)
+                else:
+                    # return string as-is
+                    return _s
+            return _str
         elif isinstance(node, ast.Num): # <number>
-            return node.n
+            _n = node.n
+            return lambda ic, ctx: _n
         elif isinstance(node, ast.Call): # node names containing parentheses (interpreted as 'Call' objects)
+            _subexpression = ast.dump(node)
+
+            # starred kwargs (**) not supported for the moment
+            if node.kwargs:
+                raise NotImplementedError(
+                    "Unpacking keyword arguments in expressions via "
+                    "** is not supported. Expression was: '{}'".format(
+                        ast.dump(node, annotate_fields=False)))
+
             # -- determine function to call
+            _func_name = None
+            _func = None
+            _ctx_update = None
+            _special_callable = None
 
             # function handle is a simple identifier
             if isinstance(node.func, ast.Name):
 
                 # handle special functions
-                if node.func.id in self.special_functions:
-                    _spec_func_spec = self.special_functions[node.func.id]
+                if node.func.id in cls.special_functions:
+                    _spec_func_spec = cls.special_functions[node.func.id]
                     # callable for special function (default to no-op)
-                    _callable = _spec_func_spec.get('func', lambda x: x)
+                    _special_callable = _spec_func_spec.get('func', lambda x: x)
                     # modify avaluation context for special function
-                    ctx = dict(ctx, **_spec_func_spec.get('ctx', {}))
+                    _ctx_update = _spec_func_spec.get('ctx', {})
 
-                # call a registered input function
+                # call a registered input function (looked up on evaluation)
                 else:
-                    try:
-                        _callable = ctx['functions'][node.func.id]
-                    except KeyError as e:
-                        raise KeyError(
-                            "Cannot call input function '{}': no such "
-                            "function!".format(node.func.id))
+                    _func_name = node.func.id
 
             # function handle is an expression
             else:
                 # evaluate 'func' as any other node
-                _callable = self._eval(node.func, ctx)
-
-            # evaluate unpacked positional arguments, if any
-            _starargs_values = []
-            if node.starargs is not None:
-                _starargs_values = self._eval(node.starargs, ctx)
-
-            # starred kwargs (**) not supported for the moment
-            if node.kwargs:
-                raise NotImplementedError(
-                    "Unpacking keyword arguments in expressions via "
-                    "** is not supported. Expression was: '{}'".format(
-                        ast.dump(node, annotate_fields=False)))
+                _func = cls._compile(node.func)
 
-            # evaluate arguments
-            _args = map(lambda _arg: self._eval(_arg, ctx), node.args) + _starargs_values
-            _kwargs = {
-                _keyword.arg : self._eval(_keyword.value, ctx)
-                for _keyword in node.keywords
-            }
+            _starargs = cls._compile(node.starargs) if node.starargs is not None else None
+            _args = [cls._compile(_arg) for _arg in node.args]
+            _kwargs = [(_keyword.arg, cls._compile(_keyword.value)) for _keyword in node.keywords]
 
-            # call function
-            return _callable(*_args, **_kwargs)
+            def _call(ic, ctx):
+                if _special_callable is not None:
+                    _callable = _special_callable
+                    ctx = dict(ctx, **_ctx_update)
+                elif _func_name is not None:
+                    try:
+                        _callable = ctx['functions'][_func_name]
+                    except KeyError as e:
+                        raise KeyError(
+                            "Cannot call input function '{}': no such "
+                            "function!".format(_func_name))
+                else:
+                    _callable = _func(ic, ctx)
+
+                # evaluate unpacked positional arguments, if any
+                _starargs_values = []
+                if _starargs is not None:
+                    _starargs_values = _starargs(ic, ctx)
+
+                # evaluate arguments
+                _arg_values = [_arg(ic, ctx) for _arg in _args] + _starargs_values
+                _kwarg_values = {
+                    _name : _value(ic, ctx)
+                    for _name, _value in _kwargs
+                }
+
+                # call function (or reuse the result of an identical call in the same scope)
+                _scope = ic._subexpression_scope
+                if _scope is None or not _scope.is_shared(_subexpression):
+                    return _callable(*_arg_values, **_kwarg_values)
+                return _scope.evaluate(
+                    _subexpression,
+                    lambda: (_callable, _get_memoization_key(_arg_values), _get_memoization_key(_kwarg_values)),
+                    lambda: _callable(*_arg_values, **_kwarg_values))
+            return _call
         elif isinstance(node, ast.BinOp): # <left> <operator> <right>
-            return ctx['operators'][type(node.op)](self._eval(node.left, ctx), self._eval(node.right, ctx))
+            _subexpression = ast.dump(node)
+            _op_type, _left, _right = type(node.op), cls._compile(node.left), cls._compile(node.right)
+
+            def _binop(ic, ctx):
+                _operator = ctx['operators'][_op_type]
+                _left_value, _right_value = _left(ic, ctx), _right(ic, ctx)
+
+                # apply operator (or reuse the result of an identical operation in the same scope)
+                _scope = ic._subexpression_scope
+                if _scope is None or not _scope.is_shared(_subexpression):
+                    return _operator(_left_value, _right_value)
+                return _scope.evaluate(
+                    _subexpression,
+                    lambda: (_operator, _get_memoization_key(_left_value), _get_memoization_key(_right_value)),
+                    lambda: _operator(_left_value, _right_value))
+            return _binop
         elif isinstance(node, ast.UnaryOp): # <operator> <operand> e.g., -1
-            return ctx['operators'][type(node.op)](self._eval(node.operand, ctx))
+            _op_type, _operand = type(node.op), cls._compile(node.operand)
+            return lambda ic, ctx: ctx['operators'][_op_type](_operand(ic, ctx))
         elif isinstance(node, ast.Subscript): # <operator> <operand> e.g., -1
+            _value = cls._compile(node.value)
             if isinstance(node.slice, ast.Index): # support subscripting via simple index
-                return self._eval(node.value, ctx)[self._eval(node.slice.value, ctx)]
+                _index = cls._compile(node.slice.value)
+                return lambda ic, ctx: _value(ic, ctx)[_index(ic, ctx)]
             elif isinstance(node.slice, ast.Slice): # support subscripting via slice
-                return self._eval(node.value, ctx)[self._eval(node.slice.lower, ctx):self._eval(node.slice.upper, ctx):self._eval(node.slice.step, ctx)]
+                _lower, _upper, _step = cls._compile(node.slice.lower), cls._compile(node.slice.upper), cls._compile(node.slice.step)
+                return lambda ic, ctx: _value(ic, ctx)[_lower(ic, ctx):_upper(ic, ctx):_step(ic, ctx)]
             else:
                 raise TypeError(node)
         elif isinstance(node, ast.Attribute): # <value>.<attr>
-            return getattr(self._eval(node.value, ctx), node.attr)
+            _value, _attr = cls._compile(node.value), node.attr
+            return lambda ic, ctx: getattr(_value(ic, ctx), _attr)
         elif isinstance(node, ast.List): # list of node names
-            return [self._eval(_el, ctx) for _el in node.elts]
+            _elts = [cls._compile(_el) for _el in node.elts]
+            return lambda ic, ctx: [_el(ic, ctx) for _el in _elts]
         elif isinstance(node, ast.Tuple): # tuple of node names
-            return tuple(self._eval(_el, ctx) for _el in node.elts)
+            _elts = [cls._compile(_el) for _el in node.elts]
+            return lambda ic, ctx: tuple(_el(ic, ctx) for _el in _elts)
         else:
             raise TypeError(node)
 
     @classmethod
     def clear_cache(cls):
-        cls._cache = {}
+        """Remove all results of memoized functions from the cache and reset the cache statistics."""
+        cls._cache.clear()
+
+    @classmethod
+    def set_cache_size(cls, max_bytes):
+        """Set the maximum (estimated) size in bytes of the cache for results of memoized functions.
+        The least recently used results are evicted when the cache exceeds this size. If ``None``, the
+        size of the cache is not limited."""
+        cls._cache.max_bytes = max_bytes
+
+    @classmethod
+    def get_cache_stats(cls):
+        """Statistics of the cache for results of memoized functions (see :py:meth:`MemoizationCache.get_stats`)."""
+        return cls._cache.get_stats()
 
     # functions with special meanings/side effects
     # when encountered in expressions, these functions can change the
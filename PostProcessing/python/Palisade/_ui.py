@@ -200,6 +200,16 @@ class PalisadeCLI(object):
             # new parser for task-specific CLI arguments
             _task_cli_parser = argparse.ArgumentParser()
             _task_cli_parser.add_argument('-o', '--output-dir', help="Directory in which to place the task result.")
+            _task_cli_parser.add_argument('--memo-cache-size', metavar='MB', type=float, default=None,
+                help="Maximum size (in MB) of the cache for results of memoized input functions. The least recently "
+                     "used results are evicted when the cache is full (default: 1024).")
+            _task_cli_parser.add_argument('--max-open-files', metavar='N', type=int, default=None,
+                help="Maximum number of input ROOT files kept open at the same time. The least recently "
+                     "used files are closed when more files are open (default: 64).")
+            _task_cli_parser.add_argument('--prefetch-workers', metavar='N', type=int, default=None,
+                help="Maximum number of worker processes reading requested objects from the input files in "
+                     "parallel. Only pays off if reading is slow, e.g. for many files on network storage "
+                     "(default: 1, i.e. read all objects in the main process).")
 
             # task-specific parser configuration
             _task_module.cli(_task_cli_parser)
@@ -223,5 +233,23 @@ class PalisadeCLI(object):
         if self._task_module is None:
             raise NotImplemented
         else:
+            from ._input import InputROOT, InputROOTFile
+
+            if self._args.memo_cache_size is not None:
+                InputROOT.set_cache_size(int(self._args.memo_cache_size * 1024**2))
+            if self._args.max_open_files is not None:
+                InputROOTFile.set_max_open_files(self._args.max_open_files)
+            if self._args.prefetch_workers is not None:
+                InputROOT.set_prefetch_workers(self._args.prefetch_workers)
+
             # run the task
-            self._task_module.run(self._args)
+            try:
+                self._task_module.run(self._args)
+            finally:
+                InputROOT.close_prefetch_pool()
+                InputROOTFile.close_all_files()
+
+            _stats = InputROOT.get_cache_stats()
+            if _stats['hits'] or _stats['misses']:
+                print("[INFO] Memoization cache: {hits} hit(s), {misses} miss(es), {evictions} eviction(s), "
+                      "{entries} result(s) stored ({size_mb:.1f} MB)".format(size_mb=_stats['size_bytes'] / 1024.0**2, **_stats))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Benchmark for writing Lumberjack output files with many objects.
+
+Creates a tree of `N` histograms spread over directories in the same way as
+the output of a split task, and measures the time needed for writing them
+with the per-object approach (`mkdir`/`cd`/`Write` for every object) and
+with `ObjectTreeWriter`, for different compression settings.
+
+Example:
+
+    $> python benchmark_lumberjack_write.py --n-objects 10000 100000 --compression-algorithm zlib lz4
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import tempfile
+import time
+
+import ROOT
+
+from Karma.PostProcessing.Lumberjack import ObjectTreeWriter, open_output_file, COMPRESSION_ALGORITHMS
+
+
+def make_object_tree(n_objects, n_directories, n_bins):
+    '''nested dictionary with `n_objects` filled histograms spread evenly over `n_directories` two-level directories'''
+    _rnd = ROOT.TRandom3(42)
+    _n_per_directory = max(n_objects // n_directories, 1)
+    _n_outer = max(int(n_directories ** 0.5), 1)
+
+    _tree = {}
+    for _i_object in range(n_objects):
+        _i_directory = _i_object // _n_per_directory
+        _subtree = _tree.setdefault("key1_{}".format(_i_directory % _n_outer), {}).setdefault("key2_{}".format(_i_directory // _n_outer), {})
+        _name = "h_{}".format(_i_object % _n_per_directory)
+        _h = ROOT.TH1D("h_{}".format(_i_object), "", n_bins, 0, 1)
+        _h.SetDirectory(0)
+        _h.FillRandom("gaus", 100)
+        _subtree[_name] = _h
+
+    return _tree
+
+
+def write_per_object(object_or_dict, output_file, output_path):
+    '''reference implementation: create directories, `cd` and `Write` for every object'''
+    if isinstance(object_or_dict, dict):
+        if not output_file.GetDirectory(output_path):
+            output_file.mkdir(output_path)
+        for _key, _value in sorted(object_or_dict.items()):
+            write_per_object(_value, output_file, "{}/{}".format(output_path, _key))
+    else:
+        _output_dir = '/'.join(output_path.split('/')[:-1])
+        if _output_dir:
+            output_file.cd(_output_dir)
+        object_or_dict.Write(output_path.split('/')[-1])
+
+
+def write_object_tree_writer(object_tree, output_file):
+    ObjectTreeWriter(output_file).write(object_tree)
+
+
+def run_benchmark(object_tree, method, output_dir, compression_algorithm, compression_level):
+    '''write `object_tree` with `method` and return the elapsed time (in seconds) and the file size (in bytes)'''
+    _file_path = os.path.join(output_dir, "benchmark_{}.root".format(method))
+
+    _start = time.time()
+    _tfile = open_output_file(_file_path, compression_algorithm, compression_level)
+    if method == 'per-object':
+        for _key, _value in sorted(object_tree.items()):
+            write_per_object(_value, _tfile, _key)
+    else:
+        write_object_tree_writer(object_tree, _tfile)
+    _tfile.Close()
+    _elapsed = time.time() - _start
+
+    _size = os.path.getsize(_file_path)
+    os.remove(_file_path)
+    return _elapsed, _size
+
+
+def main():
+    _parser = argparse.ArgumentParser(description="Benchmark writing of Lumberjack output files.")
+    _parser.add_argument('--n-objects', type=int, nargs='+', default=[10000, 100000],
+                         help="Number of objects to write (default: 10000 100000)")
+    _parser.add_argument('--n-directories', type=int, default=400,
+                         help="Number of leaf directories the objects are spread over (default: 400)")
+    _parser.add_argument('--n-bins', type=int, default=50,
+                         help="Number of bins per histogram (default: 50)")
+    _parser.add_argument('--compression-algorithm', choices=COMPRESSION_ALGORITHMS, nargs='+', default=['zlib', 'lz4'],
+                         help="Compression algorithms to compare (default: zlib lz4)")
+    _parser.add_argument('--compression-level', type=int, default=4,
+                         help="Compression level (default: 4)")
+    _parser.add_argument('--output-dir', default=None,
+                         help="Directory for the temporary output files (default: system temporary directory)")
+    _args = _parser.parse_args()
+
+    ROOT.gROOT.SetBatch(True)
+    ROOT.TH1.AddDirectory(False)
+
+    _output_dir = _args.output_dir or tempfile.gettempdir()
+
+    print("{:>10s}  {:>12s}  {:>8s}  {:>10s}  {:>10s}".format("objects", "method", "algo", "time [s]", "size [MB]"))
+    for _n_objects in _args.n_objects:
+        _object_tree = make_object_tree(_n_objects, _args.n_directories, _args.n_bins)
+        for _compression_algorithm in _args.compression_algorithm:
+            for _method in ('per-object', 'tree-writer'):
+                _elapsed, _size = run_benchmark(_object_tree, _method, _output_dir, _compression_algorithm, _args.compression_level)
+                print("{:>10d}  {:>12s}  {:>8s}  {:>10.2f}  {:>10.2f}".format(
+                    _n_objects, _method, _compression_algorithm, _elapsed, _size / 1024.0**2))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,4 +10,4 @@ if __name__ == "__main__":
 
     # re-export some names for convenience (e.g. for interactive sessions)
     import ROOT
-    DF = _cli._df
+    DF = getattr(_cli, '_df', None)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Thin client for a Lumberjack server started with `lumberjack.py serve`.
+
+All arguments except `--socket` are passed to the server, which processes them
+exactly like `lumberjack.py` would. The output is printed as it arrives and the
+client exits with the exit code of the request.
+
+Example:
+
+    $> lumberjack.py serve --socket /tmp/lumberjack.sock &
+    $> lumberjack_client.py --socket /tmp/lumberjack.sock -a "my_analysis" -i "input_file.root" --input-type "data" task MyTask
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+def main():
+    _parser = argparse.ArgumentParser(add_help=False)
+    _parser.add_argument('--socket', metavar='PATH', default=os.getenv('LUMBERJACK_SOCKET'))
+    _args, _argv = _parser.parse_known_args()
+
+    if _args.socket is None:
+        print("[ERROR] No socket path given: use `--socket` or set the environment variable LUMBERJACK_SOCKET", file=sys.stderr)
+        sys.exit(1)
+
+    _client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        _client_socket.connect(_args.socket)
+    except socket.error as _e:
+        print("[ERROR] Cannot connect to Lumberjack server on socket '{}': {}".format(_args.socket, _e), file=sys.stderr)
+        sys.exit(1)
+
+    _client_socket.sendall((json.dumps(dict(argv=_argv, cwd=os.getcwd())) + "\n").encode('utf-8'))
+
+    for _line in _client_socket.makefile('r'):
+        _message = json.loads(_line)
+        if 'output' in _message:
+            sys.stdout.write(_message['output'])
+            sys.stdout.flush()
+        elif 'exit_code' in _message:
+            sys.exit(_message['exit_code'])
+
+    print("[ERROR] Connection to Lumberjack server closed unexpectedly", file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -158,7 +158,7 @@ setup(
     package_dir = {
         'Karma.PostProcessing': './python',
     },
-    scripts=['scripts/lumberjack.py', 'scripts/palisade.py'],
+    scripts=['scripts/lumberjack.py', 'scripts/lumberjack_client.py', 'scripts/palisade.py'],
     keywords = "data analysis cms cern",
     license='MIT',
     install_requires=get_requirements(),
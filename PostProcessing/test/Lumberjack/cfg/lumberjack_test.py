@@ -0,0 +1,62 @@
+"""Analysis configuration used by the Lumberjack tests (loaded via `LUMBERJACK_CONFIGPATH`)."""
+from Karma.PostProcessing.Lumberjack import Quantity
+
+
+QUANTITIES = {
+    'global': {
+        'x': Quantity(name='x', expression='x', binning=[0, 1, 2, 4, 6, 8, 10], master_binning=[0.5 * _i for _i in range(21)]),
+        'y': Quantity(name='y', expression='y', binning=[0, 2.5, 5, 7.5, 10]),
+        'x_plus_y': Quantity(name='x_plus_y', expression='x_plus_y', binning=[0, 5, 10, 15, 20]),
+        'x_times_y': Quantity(name='x_times_y', expression='x * y', binning=[0, 10, 20, 50, 100]),
+    },
+    'test': {},
+}
+
+DEFINES = {
+    'global': {
+        'x_plus_y': 'x + y',
+        'w_squared': 'w * w',
+    },
+    'test': {},
+}
+
+SELECTIONS = {
+    'sum_above_two': [
+        'x_plus_y > 2',
+    ],
+}
+
+VARIATIONS = {
+    'x_up': {
+        'x': 'x_up',
+    },
+}
+
+SPLITTINGS = {
+    'y_range': {
+        'y_low': dict(y=(0, 5)),
+        'y_high': dict(y=(5, 10)),
+    },
+    'flag': {
+        'flag_0': dict(flag=0),
+        'flag_1': dict(flag=1),
+        'flag_2': dict(flag=2),
+    },
+}
+
+TASKS = {
+    'TaskX': dict(
+        splittings=['y_range'],
+        histograms=['x', 'x@w', 'x:y'],
+        profiles=['x:y'],
+    ),
+    'TaskFlag': dict(
+        splittings=['y_range', 'flag'],
+        histograms=['x_times_y', 'x_plus_y@w', 'x_plus_y@w_squared'],
+        profiles=['x:x_times_y'],
+    ),
+    'TaskExport': dict(
+        splittings=['y_range'],
+        exports=['x:y@w'],
+    ),
+}
@@ -0,0 +1,622 @@
+import io
+import json
+from array import array
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+import ROOT
+
+from rootpy.io import root_open
+
+# analysis configuration for the tests
+os.environ['LUMBERJACK_CONFIGPATH'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cfg')
+
+from Karma.PostProcessing.Lumberjack import LumberjackCLI, LumberjackServer
+
+
+_N_ENTRIES = 5000
+
+
+def _create_input_file(filename, first_entry=0, varied=False):
+    '''write a small tree with deterministic contents, starting at entry number `first_entry`.
+    If `varied` is set, the branch `x` contains the values of the branch `x_up`.'''
+    _entry = '(rdfentry_ + {})'.format(first_entry)
+    _x = '(({} * 37) % 1000) / 100.0'.format(_entry)
+    _x_up = '1.05 * {}'.format(_x)
+    ROOT.ROOT.RDataFrame(_N_ENTRIES) \
+        .Define('x', _x_up if varied else _x) \
+        .Define('x_up', _x_up) \
+        .Define('y', '(({} * 53) % 1000) / 100.0'.format(_entry)) \
+        .Define('w', '0.5 + ({} % 7) * 0.25'.format(_entry)) \
+        .Define('flag', 'int({} % 3)'.format(_entry)) \
+        .Snapshot('Events', filename)
+
+
+def _get_input_values(first_entry=0):
+    '''values of the branches written by `_create_input_file`, computed with numpy'''
+    _entry = np.arange(first_entry, first_entry + _N_ENTRIES)
+    return dict(
+        x=((_entry * 37) % 1000) / 100.0,
+        y=((_entry * 53) % 1000) / 100.0,
+        w=0.5 + (_entry % 7) * 0.25,
+        flag=_entry % 3,
+    )
+
+
+def _read_objects(filename):
+    '''bin contents and errors of all histograms and profiles in a file, by path'''
+    _objects = {}
+    with root_open(filename) as _tfile:
+        for _path, _, _obj_names in _tfile.walk():
+            for _obj_name in _obj_names:
+                _obj_path = '/'.join([_p for _p in (_path, _obj_name) if _p])
+                _obj = _tfile.Get(_obj_path)
+                if not isinstance(_obj, ROOT.TH1):
+                    continue
+                _objects[_obj_path] = np.array([
+                    (_obj.GetBinContent(_i_bin), _obj.GetBinError(_i_bin))
+                    for _i_bin in range(_obj.GetNcells())
+                ])
+    return _objects
+
+
+def _read_statistics(filename):
+    '''number of entries and statistics (sums of weights, etc.) of all histograms and profiles in a file, by path'''
+    _statistics = {}
+    with root_open(filename) as _tfile:
+        for _path, _, _obj_names in _tfile.walk():
+            for _obj_name in _obj_names:
+                _obj_path = '/'.join([_p for _p in (_path, _obj_name) if _p])
+                _obj = _tfile.Get(_obj_path)
+                if not isinstance(_obj, ROOT.TH1):
+                    continue
+                _stats = array('d', [0.0] * 13)
+                _obj.GetStats(_stats)
+                _statistics[_obj_path] = np.array([_obj.GetEntries()] + list(_stats))
+    return _statistics
+
+
+def _read_exports(export_dir):
+    '''exported values in a directory, concatenated over all chunks, by subdirectory and column'''
+    _exports = {}
+    for _dir_path, _, _filenames in os.walk(export_dir):
+        for _filename in sorted(_filenames):
+            with np.load(os.path.join(_dir_path, _filename)) as _chunk:
+                _columns = _exports.setdefault(os.path.relpath(_dir_path, export_dir), {})
+                for _column in _chunk.files:
+                    _columns[_column] = np.concatenate([_columns.get(_column, np.array([])), _chunk[_column]])
+    return _exports
+
+
+def _count_cache_files(cache_dir):
+    '''number of files written to a result cache directory'''
+    return sum([len([_f for _f in _filenames if _f.endswith('.root')]) for _, _, _filenames in os.walk(cache_dir)])
+
+
+class _LumberjackTestBase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ROOT.gROOT.SetBatch(True)
+        cls._input_dir = tempfile.mkdtemp()
+        cls._input_file = os.path.join(cls._input_dir, 'input.root')
+        _create_input_file(cls._input_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._input_dir)
+
+    def setUp(self):
+        self._output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._output_dir)
+
+    def _make_cli(self, *argv, **kwargs):
+        _input_files = kwargs.pop('input_files', [self._input_file])
+        return LumberjackCLI(argv=[
+            '-a', 'lumberjack_test',
+            '-i'] + _input_files + [
+            '--input-type', 'test',
+            '--selections', 'sum_above_two',
+        ] + list(argv))
+
+    def _run_tasks(self, task_names, *options, **kwargs):
+        '''run tasks and return the objects in the output files, by task name'''
+        _suffix = kwargs.pop('suffix', 'test')
+        _cli = self._make_cli(*(list(options) + ['--overwrite', 'task'] + list(task_names) + [
+            '--output-dir', self._output_dir, '--output-file-suffix', _suffix]), **kwargs)
+        _cli.run()
+        return {
+            _task_name: _read_objects(os.path.join(self._output_dir, '{}_{}.root'.format(_task_name, _suffix)))
+            for _task_name in task_names
+        }
+
+    def assertObjectsEqual(self, objects_1, objects_2):
+        self.assertEqual(sorted(objects_1.keys()), sorted(objects_2.keys()))
+        for _obj_path in objects_1:
+            self.assertTrue(np.allclose(objects_1[_obj_path], objects_2[_obj_path]), "Objects differ: '{}'".format(_obj_path))
+
+
+class TestSnapshot(_LumberjackTestBase):
+
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        self._snapshot_dir = os.path.join(self._output_dir, 'snapshots')
+
+    def test_snapshot_created_and_found(self):
+        self._make_cli('--snapshot-dir', self._snapshot_dir, 'snapshot', 'TaskX').run()
+
+        # one snapshot with metadata for the input and selections
+        _key_dirs = os.listdir(self._snapshot_dir)
+        self.assertEqual(len(_key_dirs), 1)
+        _snapshot_files = sorted(os.listdir(os.path.join(self._snapshot_dir, _key_dirs[0])))
+        self.assertEqual([os.path.splitext(_f)[1] for _f in _snapshot_files], ['.root', '.yml'])
+
+        _cli = self._make_cli('--snapshot-dir', self._snapshot_dir, 'task', 'TaskX')
+        self.assertEqual(_cli._get_snapshot_key(), _key_dirs[0])
+
+        # snapshot contains all branches needed by the task
+        _cli._prepare_bare_data_frame()
+        _task_spec = dict(_cli._config.TASKS['TaskX'], _quantities=_cli._config.QUANTITIES['global'])
+        _snapshot_meta = _cli._find_snapshot(_cli._get_required_branches([_task_spec]))
+        self.assertIsNotNone(_snapshot_meta)
+        self.assertEqual(sorted(_snapshot_meta['branches']), ['w', 'x', 'y'])
+
+    def test_snapshot_reused(self):
+        _objects = self._run_tasks(['TaskX'], suffix='nominal')
+
+        self._make_cli('--snapshot-dir', self._snapshot_dir, 'snapshot', 'TaskX').run()
+        _objects_from_snapshot = self._run_tasks(['TaskX'], '--snapshot-dir', self._snapshot_dir, suffix='snapshot')
+
+        self.assertObjectsEqual(_objects['TaskX'], _objects_from_snapshot['TaskX'])
+
+    def test_snapshot_not_used_for_task_with_missing_branches(self):
+        # number of events limited: snapshot only used by the task it was created for
+        _objects = self._run_tasks(['TaskX', 'TaskFlag'], '-n', '2000', suffix='nominal')
+
+        self._make_cli('--snapshot-dir', self._snapshot_dir, '-n', '2000', 'snapshot', 'TaskX').run()
+        _objects_from_snapshot = self._run_tasks(['TaskX', 'TaskFlag'], '--snapshot-dir', self._snapshot_dir, '-n', '2000', suffix='snapshot')
+
+        for _task_name in ('TaskX', 'TaskFlag'):
+            self.assertObjectsEqual(_objects[_task_name], _objects_from_snapshot[_task_name])
+
+    def test_snapshot_key_depends_on_selection_columns(self):
+        _cli = self._make_cli('--snapshot-dir', self._snapshot_dir, 'task', 'TaskX')
+        _defines = _cli._config.DEFINES['global']
+        _key = _cli._get_snapshot_key()
+
+        try:
+            # define not used by the selections
+            _defines['x_minus_y'] = 'x - y'
+            self.assertEqual(_cli._get_snapshot_key(), _key)
+
+            # define used by the selections
+            _defines['x_plus_y'] = 'x + 2 * y'
+            self.assertNotEqual(_cli._get_snapshot_key(), _key)
+        finally:
+            _defines.pop('x_minus_y', None)
+            _defines['x_plus_y'] = 'x + y'
+
+
+
+class TestExecutionModes(_LumberjackTestBase):
+
+    _TASK_NAMES = ['TaskX', 'TaskFlag']
+
+    def setUp(self):
+        super(TestExecutionModes, self).setUp()
+        self._objects = self._run_tasks(self._TASK_NAMES, suffix='nominal')
+
+    def assertTaskObjectsEqual(self, objects):
+        for _task_name in self._TASK_NAMES:
+            self.assertTrue(self._objects[_task_name])
+            self.assertObjectsEqual(self._objects[_task_name], objects[_task_name])
+
+    def test_single_event_loop(self):
+        self.assertTaskObjectsEqual(self._run_tasks(self._TASK_NAMES, '--single-event-loop', suffix='single_event_loop'))
+
+    def test_single_event_loop_skips_existing_outputs(self):
+        # output of 'TaskX' exists and is not overwritten, 'TaskFlag' is run with the data frame prepared for it only
+        os.remove(os.path.join(self._output_dir, 'TaskFlag_nominal.root'))
+        _existing_filename = os.path.join(self._output_dir, 'TaskX_nominal.root')
+        _mtime = os.path.getmtime(_existing_filename)
+        self._make_cli('--single-event-loop', 'task', 'TaskX', 'TaskFlag',
+                       '--output-dir', self._output_dir, '--output-file-suffix', 'nominal').run()
+
+        self.assertEqual(os.path.getmtime(_existing_filename), _mtime)
+        self.assertObjectsEqual(self._objects['TaskFlag'], _read_objects(os.path.join(self._output_dir, 'TaskFlag_nominal.root')))
+
+    def test_batch_weights(self):
+        # 'TaskFlag' contains histograms differing only in their weights, which are filled in one batch
+        self.assertTaskObjectsEqual(self._run_tasks(self._TASK_NAMES, '--batch-weights', suffix='batch_weights'))
+        for _task_name in self._TASK_NAMES:
+            _statistics = _read_statistics(os.path.join(self._output_dir, '{}_nominal.root'.format(_task_name)))
+            _statistics_batched = _read_statistics(os.path.join(self._output_dir, '{}_batch_weights.root'.format(_task_name)))
+            self.assertEqual(sorted(_statistics.keys()), sorted(_statistics_batched.keys()))
+            for _obj_path in _statistics:
+                self.assertTrue(np.allclose(_statistics[_obj_path], _statistics_batched[_obj_path]),
+                                "Entries or statistics differ: '{}'".format(_obj_path))
+
+    def test_split_mode_index(self):
+        self.assertTaskObjectsEqual(self._run_tasks(self._TASK_NAMES, '--split-mode', 'index', suffix='index'))
+
+    def test_split_mode_sparse(self):
+        self.assertTaskObjectsEqual(self._run_tasks(self._TASK_NAMES, '--split-mode', 'sparse', suffix='sparse'))
+
+    def test_split_mode_sparse_single_event_loop(self):
+        self.assertTaskObjectsEqual(self._run_tasks(self._TASK_NAMES, '--split-mode', 'sparse', '--single-event-loop', suffix='sparse_single_event_loop'))
+
+    def test_write_sparse(self):
+        self._run_tasks(['TaskX'], '--split-mode', 'sparse', '--write-sparse', suffix='write_sparse')
+
+        # one sparse histogram filled with the entries of all subsamples
+        with root_open(os.path.join(self._output_dir, 'TaskX_nominal.root')) as _tfile:
+            _n_entries = sum([_tfile.Get('{}/h_x'.format(_split_name)).GetEntries() for _split_name in ('y_low', 'y_high')])
+        with root_open(os.path.join(self._output_dir, 'TaskX_write_sparse.root')) as _tfile:
+            _sparse = _tfile.Get('sparse/sparse_x_0')
+            self.assertTrue(isinstance(_sparse, ROOT.THnSparse))
+            self.assertGreater(_n_entries, 0)
+            self.assertEqual(_sparse.GetEntries(), _n_entries)
+
+
+class TestSampling(_LumberjackTestBase):
+
+    def test_sample_scaled_and_tagged(self):
+        _objects = self._run_tasks(['TaskX'], '--sample-fraction', '0.25', suffix='sample')['TaskX']
+
+        # histogram filled with the same entries, without scaling
+        _h_x = ROOT.ROOT.RDataFrame('Events', self._input_file) \
+            .Filter('karma::lumberjack::sampleEntry(rdfentry_, 0.25)') \
+            .Filter('x + y > 2 && y < 5') \
+            .Histo1D(ROOT.RDF.TH1DModel('h_x', '', 6, np.array([0, 1, 2, 4, 6, 8, 10], dtype='d')), 'x')
+        _expected = np.array([(_h_x.GetBinContent(_i_bin), _h_x.GetBinError(_i_bin)) for _i_bin in range(_h_x.GetNcells())])
+        _values = _get_input_values()
+        self.assertGreater(_h_x.GetEntries(), 0)
+        self.assertLess(_h_x.GetEntries(), np.count_nonzero((_values['x'] + _values['y'] > 2) & (_values['y'] < 5)))
+
+        # histograms are scaled by the inverse of the fraction
+        self.assertTrue(np.allclose(_objects['y_low/h_x'], 4 * _expected))
+
+        with root_open(os.path.join(self._output_dir, 'TaskX_sample.root')) as _tfile:
+            self.assertEqual(_tfile.Get('sample_fraction').GetTitle(), repr(0.25))
+
+    def test_sample_key_required_with_multithreading(self):
+        with self.assertRaises(SystemExit):
+            self._make_cli('-j', '2', '--sample-fraction', '0.25', 'task', 'TaskX')
+        _cli = self._make_cli('-j', '2', '--sample-fraction', '0.25', '--sample-key', 'int(x * 100)', 'task', 'TaskX')
+        self.assertEqual(_cli._args.sample_key, 'int(x * 100)')
+
+
+class TestResultCache(_LumberjackTestBase):
+
+    _TASK_NAMES = ['TaskX', 'TaskFlag']
+
+    def setUp(self):
+        super(TestResultCache, self).setUp()
+        self._cache_dir = os.path.join(self._output_dir, 'cache')
+        self._objects = self._run_tasks(self._TASK_NAMES, '--cache-dir', self._cache_dir, suffix='first')
+        self._n_cache_files = _count_cache_files(self._cache_dir)
+
+    def test_second_run_served_from_cache(self):
+        self.assertGreater(self._n_cache_files, 0)
+        _objects_cached = self._run_tasks(self._TASK_NAMES, '--cache-dir', self._cache_dir, suffix='second')
+
+        # no new objects filled
+        self.assertEqual(_count_cache_files(self._cache_dir), self._n_cache_files)
+        for _task_name in self._TASK_NAMES:
+            self.assertTrue(_objects_cached[_task_name])
+            self.assertObjectsEqual(self._objects[_task_name], _objects_cached[_task_name])
+
+    def test_changed_define_invalidates_cache(self):
+        # same values, different expression
+        _defines = self._make_cli('task', 'TaskFlag')._config.DEFINES['global']
+        _expression = _defines['x_plus_y']
+        try:
+            _defines['x_plus_y'] = 'y + x'
+            _objects = self._run_tasks(self._TASK_NAMES, '--cache-dir', self._cache_dir, suffix='changed_define')
+        finally:
+            _defines['x_plus_y'] = _expression
+
+        # objects filled again, for a new context
+        self.assertEqual(len(os.listdir(self._cache_dir)), 2)
+        self.assertEqual(_count_cache_files(self._cache_dir), 2 * self._n_cache_files)
+        for _task_name in self._TASK_NAMES:
+            self.assertObjectsEqual(self._objects[_task_name], _objects[_task_name])
+
+
+class TestMasterBinning(_LumberjackTestBase):
+
+    def test_rebinned_master_equals_direct_fill(self):
+        _objects = self._run_tasks(['TaskX', 'TaskFlag'], suffix='direct')
+        _objects_master = self._run_tasks(['TaskX', 'TaskFlag'], '--master-binning', suffix='master')
+        for _task_name in ('TaskX', 'TaskFlag'):
+            self.assertObjectsEqual(_objects[_task_name], _objects_master[_task_name])
+
+    def test_binning_change_served_from_cache(self):
+        _cache_dir = os.path.join(self._output_dir, 'cache')
+        self._run_tasks(['TaskX'], '--master-binning', '--cache-dir', _cache_dir, suffix='master')
+        _n_cache_files = _count_cache_files(_cache_dir)
+        self.assertGreater(_n_cache_files, 0)
+
+        # another binning within the master binning of 'x'
+        _quantities = self._make_cli('task', 'TaskX')._config.QUANTITIES['global']
+        _quantity_x = _quantities['x']
+        try:
+            _quantities['x'] = _quantity_x.clone(binning=[0, 2.5, 5, 10])
+            _objects_cached = self._run_tasks(['TaskX'], '--master-binning', '--cache-dir', _cache_dir, suffix='cached')
+            _objects_direct = self._run_tasks(['TaskX'], suffix='direct')
+        finally:
+            _quantities['x'] = _quantity_x
+
+        # no new objects filled
+        self.assertEqual(_count_cache_files(_cache_dir), _n_cache_files)
+        self.assertObjectsEqual(_objects_direct['TaskX'], _objects_cached['TaskX'])
+        self.assertEqual(len(_objects_direct['TaskX']['y_low/h_x']), 5)
+
+
+class TestVariations(_LumberjackTestBase):
+
+    _TASK_NAMES = ['TaskX', 'TaskFlag']
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestVariations, cls).setUpClass()
+        cls._varied_input_file = os.path.join(cls._input_dir, 'input_varied.root')
+        _create_input_file(cls._varied_input_file, varied=True)
+
+    def test_variation_equals_varied_input(self):
+        _objects = self._run_tasks(self._TASK_NAMES, '--variations', 'x_up', suffix='variations')
+        _objects_nominal = self._run_tasks(self._TASK_NAMES, suffix='nominal')
+        # nominal run on an input in which the substituted column `x` contains the values of `x_up`
+        _objects_varied_input = self._run_tasks(self._TASK_NAMES, input_files=[self._varied_input_file], suffix='varied_input')
+
+        _prefix = 'variations/x_up/'
+        for _task_name in self._TASK_NAMES:
+            _nominal = {_path: _obj for _path, _obj in _objects[_task_name].items() if not _path.startswith(_prefix)}
+            _varied = {_path[len(_prefix):]: _obj for _path, _obj in _objects[_task_name].items() if _path.startswith(_prefix)}
+            self.assertTrue(_varied)
+            self.assertObjectsEqual(_nominal, _objects_nominal[_task_name])
+            self.assertObjectsEqual(_varied, _objects_varied_input[_task_name])
+
+
+class TestMemoryBudget(_LumberjackTestBase):
+
+    def _get_task_configs(self, cli, task_names):
+        '''task configurations as queued by the `task` subcommand'''
+        return [
+            (_task_name, dict(cli._config.TASKS[_task_name],
+                _filename=os.path.join(self._output_dir, '{}_test.root'.format(_task_name)),
+                _log_filename=None,
+                _quantities=cli._config.QUANTITIES['global'],
+            ))
+            for _task_name in task_names
+        ]
+
+    def test_estimate_includes_variations(self):
+        _cli = self._make_cli('task', 'TaskFlag')
+        _task_spec = self._get_task_configs(_cli, ['TaskFlag'])[0][1]
+        _n_bytes = _cli._estimate_task_memory(_task_spec)
+        self.assertGreater(_n_bytes, 0)
+
+        _cli._args.variations = ['variation_1', 'variation_2']
+        self.assertEqual(_cli._estimate_task_memory(_task_spec), 3 * _n_bytes)
+
+    def test_estimate_includes_exports(self):
+        _cli = self._make_cli('task', 'TaskExport')
+        _task_spec = self._get_task_configs(_cli, ['TaskExport'])[0][1]
+        self.assertGreater(_cli._estimate_task_memory(_task_spec), 0)
+
+    def test_split_into_subtasks(self):
+        _cli = self._make_cli('task', 'TaskFlag')
+        _task_configs = self._get_task_configs(_cli, ['TaskFlag'])
+        _n_bytes = _cli._estimate_task_memory(_task_configs[0][1])
+
+        # budget for half of the task: split over the largest key ('flag', three values)
+        _cli._args.max_memory = 0.5 * _n_bytes / 1024.0**2
+        _subtask_configs = _cli._expand_subtasks(_task_configs)
+
+        self.assertEqual([_task_name for _task_name, _ in _subtask_configs], ['TaskFlag_0', 'TaskFlag_1', 'TaskFlag_2'])
+        _flag_values = []
+        for _, _subtask_spec in _subtask_configs:
+            self.assertEqual(_subtask_spec['splittings'][0], 'y_range')
+            self.assertRegexpMatches(_subtask_spec['splittings'][1], r'^flag\[flag_\d\]$')
+            _flag_values.append(_subtask_spec['splittings'][1])
+            self.assertLessEqual(_cli._estimate_task_memory(_subtask_spec), 0.5 * _n_bytes)
+        self.assertEqual(sorted(_flag_values), ['flag[flag_0]', 'flag[flag_1]', 'flag[flag_2]'])
+
+        # output files of subtasks are numbered
+        self.assertEqual(
+            [os.path.basename(_subtask_spec['_filename']) for _, _subtask_spec in _subtask_configs],
+            ['TaskFlag_test_0.root', 'TaskFlag_test_1.root', 'TaskFlag_test_2.root'])
+
+    def test_group_into_passes(self):
+        _cli = self._make_cli('--single-event-loop', 'task', 'TaskX', 'TaskFlag')
+        _task_configs = self._get_task_configs(_cli, ['TaskX', 'TaskFlag'])
+        _n_bytes = [_cli._estimate_task_memory(_task_spec) for _, _task_spec in _task_configs]
+
+        # both tasks fit into the budget together
+        _cli._args.max_memory = 1.01 * sum(_n_bytes) / 1024.0**2
+        self.assertEqual([[_task_name for _task_name, _ in _pass] for _pass in _cli._group_tasks_by_memory(_task_configs)],
+                         [['TaskX', 'TaskFlag']])
+
+        # only one task at a time fits into the budget
+        _cli._args.max_memory = max(_n_bytes) / 1024.0**2
+        self.assertEqual([[_task_name for _task_name, _ in _pass] for _pass in _cli._group_tasks_by_memory(_task_configs)],
+                         [['TaskX'], ['TaskFlag']])
+
+
+class TestExports(_LumberjackTestBase):
+
+    def test_export_npz_chunks(self):
+        self._run_tasks(['TaskExport'], '--export-chunk-size', '1000', suffix='export')
+        _export_dir = os.path.join(self._output_dir, 'TaskExport_export_export')
+
+        _values = _get_input_values()
+        _selected = _values['x'] + _values['y'] > 2
+        _split_masks = dict(
+            y_low=_selected & (_values['y'] < 5),
+            y_high=_selected & (_values['y'] >= 5),
+        )
+        self.assertEqual(sorted(os.listdir(_export_dir)), sorted(_split_masks.keys()))
+
+        for _split_dir, _mask in _split_masks.items():
+            _n_rows = np.count_nonzero(_mask)
+            _filenames = sorted(os.listdir(os.path.join(_export_dir, _split_dir)))
+            self.assertEqual(_filenames, ['e_x_y_w_{:04d}.npz'.format(_i) for _i in range((_n_rows + 999) // 1000)])
+
+            # all chunks but the last one are full
+            _chunk_sizes = []
+            for _filename in _filenames:
+                with np.load(os.path.join(_export_dir, _split_dir, _filename)) as _chunk:
+                    self.assertEqual(sorted(_chunk.files), ['w', 'x', 'y'])
+                    _chunk_sizes.append(len(_chunk['x']))
+            self.assertEqual(_chunk_sizes[:-1], [1000] * (len(_chunk_sizes) - 1))
+            self.assertEqual(sum(_chunk_sizes), _n_rows)
+
+            # values in the order of the input entries
+            _exported = _read_exports(_export_dir)[_split_dir]
+            for _column in ('x', 'y', 'w'):
+                self.assertTrue(np.array_equal(_exported[_column], _values[_column][_mask]))
+
+
+class TestJITCache(_LumberjackTestBase):
+
+    def test_cached_library_loaded(self):
+        _jit_cache_dir = os.path.join(self._output_dir, 'jit')
+        _objects = self._run_tasks(['TaskFlag'], suffix='nominal')
+
+        # first run compiles the library
+        _objects_compiled = self._run_tasks(['TaskFlag'], '--jit-cache-dir', _jit_cache_dir, suffix='compiled')
+        _libraries = [_f for _f in os.listdir(_jit_cache_dir) if _f.endswith('.' + ROOT.gSystem.GetSoExt())]
+        self.assertEqual(len(_libraries), 1)
+        _library_mtime = os.path.getmtime(os.path.join(_jit_cache_dir, _libraries[0]))
+
+        # second run loads the library from the cache without compiling again
+        _cli = self._make_cli('--jit-cache-dir', _jit_cache_dir, '--overwrite', 'task', 'TaskFlag',
+            '--output-dir', self._output_dir, '--output-file-suffix', 'cached')
+        _cli.run()
+        self.assertEqual(_cli._jit_cache.library_path, os.path.join(os.path.abspath(_jit_cache_dir), _libraries[0]))
+        self.assertEqual(os.path.getmtime(_cli._jit_cache.library_path), _library_mtime)
+        _objects_cached = _read_objects(os.path.join(self._output_dir, 'TaskFlag_cached.root'))
+
+        self.assertObjectsEqual(_objects['TaskFlag'], _objects_compiled['TaskFlag'])
+        self.assertObjectsEqual(_objects['TaskFlag'], _objects_cached)
+
+
+class _FakeConnection(object):
+    """stands in for the client socket of a request sent to a `LumberjackServer`"""
+
+    def __init__(self, argv, cwd):
+        self._request = json.dumps(dict(argv=argv, cwd=cwd)) + "\n"
+        self.messages = []
+
+    def makefile(self, mode):
+        return io.BytesIO(self._request)
+
+    def sendall(self, data):
+        self.messages.extend([json.loads(_line) for _line in data.splitlines()])
+
+    def get_output(self):
+        return "".join([_message['output'] for _message in self.messages if 'output' in _message])
+
+    def get_exit_code(self):
+        return [_message['exit_code'] for _message in self.messages if 'exit_code' in _message][0]
+
+
+class TestServer(_LumberjackTestBase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestServer, cls).setUpClass()
+        cls._input_file_2 = os.path.join(cls._input_dir, 'input_2.root')
+        _create_input_file(cls._input_file_2, first_entry=_N_ENTRIES)
+
+    def _send_request(self, server, suffix, input_file=None):
+        _connection = _FakeConnection([
+            '-a', 'lumberjack_test',
+            '-i', input_file or self._input_file,
+            '--input-type', 'test',
+            '--selections', 'sum_above_two',
+            '--overwrite', 'task', 'TaskX',
+            '--output-dir', self._output_dir, '--output-file-suffix', suffix,
+        ], cwd=self._output_dir)
+        server._handle_request(_connection)
+        self.assertEqual(_connection.get_exit_code(), 0, _connection.get_output())
+        return _connection.get_output()
+
+    def test_requests_reuse_data_frame(self):
+        _server = LumberjackServer(os.path.join(self._output_dir, 'server.sock'))
+        _output_1 = self._send_request(_server, 'request_1')
+        _output_2 = self._send_request(_server, 'request_2')
+
+        self.assertNotIn("Reusing", _output_1)
+        self.assertIn("Reusing data frame set up for a previous request", _output_2)
+        self.assertIn("Reusing defines and selections set up for a previous request", _output_2)
+
+        _objects = self._run_tasks(['TaskX'])['TaskX']
+        for _suffix in ('request_1', 'request_2'):
+            self.assertObjectsEqual(_objects, _read_objects(os.path.join(self._output_dir, 'TaskX_{}.root'.format(_suffix))))
+
+    def test_warm_state_bounded(self):
+        _server = LumberjackServer(os.path.join(self._output_dir, 'server.sock'), max_data_frames=1, max_requests=2)
+        self._send_request(_server, 'request_1')
+        self._send_request(_server, 'request_2', input_file=self._input_file_2)
+        self.assertEqual(len(_server._warm_state), 1)
+
+        # data frame for the first input file has been discarded
+        self.assertNotIn("Reusing", self._send_request(_server, 'request_3'))
+        self.assertIn("Reusing", self._send_request(_server, 'request_4'))
+        # set up again after the maximum number of requests
+        self.assertNotIn("Reusing", self._send_request(_server, 'request_5'))
+
+        self.assertObjectsEqual(
+            _read_objects(os.path.join(self._output_dir, 'TaskX_request_1.root')),
+            _read_objects(os.path.join(self._output_dir, 'TaskX_request_5.root')),
+        )
+
+
+class TestParallel(_LumberjackTestBase):
+
+    _TASK_NAMES = ['TaskX', 'TaskFlag', 'TaskExport']
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestParallel, cls).setUpClass()
+        cls._input_files = [cls._input_file, os.path.join(cls._input_dir, 'input_2.root')]
+        _create_input_file(cls._input_files[1], first_entry=_N_ENTRIES)
+
+    def test_processes(self):
+        _objects = self._run_tasks(self._TASK_NAMES, input_files=self._input_files, suffix='serial')
+        _objects_parallel = self._run_tasks(self._TASK_NAMES, '-p', '2', '--log', input_files=self._input_files, suffix='parallel')
+
+        for _task_name in self._TASK_NAMES:
+            self.assertObjectsEqual(_objects[_task_name], _objects_parallel[_task_name])
+
+        # exported values of both processes are collected in the export directory (in the order of the input files)
+        _exports = _read_exports(os.path.join(self._output_dir, 'TaskExport_serial_export'))
+        _exports_parallel = _read_exports(os.path.join(self._output_dir, 'TaskExport_parallel_export'))
+        self.assertEqual(sorted(_exports.keys()), ['y_high', 'y_low'])
+        self.assertEqual(sorted(_exports_parallel.keys()), sorted(_exports.keys()))
+        for _split_dir, _columns in _exports.items():
+            self.assertEqual(sorted(_columns.keys()), ['w', 'x', 'y'])
+            for _column, _values in _columns.items():
+                self.assertTrue(np.array_equal(_values, _exports_parallel[_split_dir][_column]))
+
+        # partial outputs, exports and logs are removed after merging
+        self.assertEqual(sorted(os.listdir(self._output_dir)), sorted(
+            ['{}_{}.root'.format(_task_name, _suffix) for _task_name in self._TASK_NAMES for _suffix in ('serial', 'parallel')] +
+            ['{}_parallel.log'.format(_task_name) for _task_name in self._TASK_NAMES] +
+            ['TaskExport_serial_export', 'TaskExport_parallel_export']
+        ))
+
+    def test_profile_not_supported(self):
+        with self.assertRaises(SystemExit):
+            self._make_cli('-p', '2', '--profile', 'task', 'TaskX', input_files=self._input_files)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,19 @@ from rootpy.plotting import Hist1D, Hist2D, Profile1D, Efficiency, Graph
 from rootpy.plotting.hist import _Hist, _Hist2D
 from rootpy.plotting.profile import _ProfileBase
 
-from Karma.PostProcessing.Palisade import InputROOT
+from Karma.PostProcessing.Palisade import InputROOT, InputROOTFile, MemoizationCache
+
+
+class FuncWithCounter:
+    '''helper callable with call counter'''
+    def __init__(self, func):
+        self._f = func
+        self.__name__ = func.__name__
+        self._call_count = 0
+
+    def __call__(self, *args):
+        self._call_count += 1
+        return self._f(*args)
 
 
 class TestInputROOTClass(unittest.TestCase):
@@ -63,6 +75,60 @@ class TestInputROOTClass(unittest.TestCase):
         self.assertIs(InputROOT.get_function('test_function'), test_function_2)
 
 
+class TestMemoizationCache(unittest.TestCase):
+
+    def test_get_put(self):
+        _cache = MemoizationCache()
+        _cache.put('a', 42)
+        self.assertIn('a', _cache)
+        self.assertEqual(_cache.get('a'), 42)
+        with self.assertRaises(KeyError):
+            _cache.get('b')
+
+    def test_stats(self):
+        _cache = MemoizationCache()
+        _cache.put('a', np.zeros(100))
+        _cache.get('a')
+        _cache.get('a')
+        with self.assertRaises(KeyError):
+            _cache.get('b')
+        _stats = _cache.get_stats()
+        self.assertEqual(_stats['hits'], 2)
+        self.assertEqual(_stats['misses'], 1)
+        self.assertEqual(_stats['entries'], 1)
+        self.assertEqual(_stats['size_bytes'], 800)
+
+    def test_evict_least_recently_used(self):
+        # room for two arrays of 100 doubles
+        _cache = MemoizationCache(max_bytes=1600)
+        _cache.put('a', np.zeros(100))
+        _cache.put('b', np.zeros(100))
+        _cache.get('a')  # 'b' is now least recently used
+        _cache.put('c', np.zeros(100))
+        self.assertIn('a', _cache)
+        self.assertNotIn('b', _cache)
+        self.assertIn('c', _cache)
+        self.assertEqual(_cache.get_stats()['evictions'], 1)
+        self.assertEqual(_cache.get_stats()['size_bytes'], 1600)
+
+    def test_reduce_max_bytes(self):
+        _cache = MemoizationCache()
+        for _key in 'abcd':
+            _cache.put(_key, np.zeros(100))
+        _cache.max_bytes = 800
+        self.assertEqual(len(_cache), 1)
+        self.assertIn('d', _cache)
+
+    def test_clear(self):
+        _cache = MemoizationCache()
+        _cache.put('a', 42)
+        _cache.get('a')
+        _cache.clear()
+        self.assertNotIn('a', _cache)
+        self.assertEqual(_cache.get_stats()['hits'], 0)
+        self.assertEqual(_cache.get_stats()['size_bytes'], 0)
+
+
 class TestInputROOTNoFile(unittest.TestCase):
 
     def setUp(self):
@@ -113,6 +179,72 @@ class TestInputROOTWithFile(unittest.TestCase):
         self.assertIsInstance(self._ic.get(object_spec="test:h1"), _Hist)
         self.assertIsInstance(self._ic.get(object_spec="test:h2"), _Hist)
 
+    def test_get_file_kept_open(self):
+        InputROOTFile.close_all_files()
+        self._ic.get(object_spec="test:h1")
+        self.assertEqual(len(InputROOTFile._file_pool), 1)
+        _open_file, = InputROOTFile._file_pool._open_files.values()
+
+        # file is reused by other input controllers
+        _ic = InputROOT()
+        _ic.add_file('ref/test.root', nickname='test')
+        self.assertIsInstance(_ic.get(object_spec="test:h2"), _Hist)
+        self.assertEqual(len(InputROOTFile._file_pool), 1)
+        self.assertIs(list(InputROOTFile._file_pool._open_files.values())[0], _open_file)
+
+        InputROOTFile.close_all_files()
+        self.assertEqual(len(InputROOTFile._file_pool), 0)
+
+    def test_get_max_open_files(self):
+        InputROOTFile.close_all_files()
+        InputROOTFile.set_max_open_files(1)
+        try:
+            self._ic.add_file('ref/test_2.root', nickname='test_2')
+            self._ic.get(object_spec="test:h1")
+            self._ic.get(object_spec="test_2:h1")
+
+            # least recently used file has been closed
+            self.assertEqual(len(InputROOTFile._file_pool), 1)
+            self.assertEqual(list(InputROOTFile._file_pool._open_files), [self._ic._file_nick_to_realpath['test_2']])
+        finally:
+            InputROOTFile.set_max_open_files(64)
+            InputROOTFile.close_all_files()
+
+    def test_prefetch(self):
+        self._ic.add_file('ref/test_2.root', nickname='test_2')
+        self._ic.request([dict(object_spec="test:h1"), dict(object_spec="test_2:h1"), dict(object_spec="test_2:this_does_not_exist")])
+        self._ic.prefetch(max_workers=2)
+
+        # readable objects have been retrieved
+        for _nickname in ('test', 'test_2'):
+            _file_ic = self._ic._input_controllers[self._ic._file_nick_to_realpath[_nickname]]
+            self.assertIn('h1', _file_ic._plot_data_cache)
+            _hist = self._ic.get(object_spec="{}:h1".format(_nickname))
+            self.assertIsInstance(_hist, _Hist)
+
+            # not attached to a directory (same-named objects from different files would collide)
+            self.assertFalse(_hist.GetDirectory())
+
+        # inexistent objects remain requested and raise on access
+        with self.assertRaises(DoesNotExist):
+            self._ic.get(object_spec="test_2:this_does_not_exist")
+
+        InputROOT.close_prefetch_pool()
+
+    def test_prefetch_single_worker_noop(self):
+        self._ic.add_file('ref/test_2.root', nickname='test_2')
+        self._ic.request([dict(object_spec="test:h1"), dict(object_spec="test_2:h1")])
+        self._ic.prefetch(max_workers=1)
+
+        _file_ic = self._ic._input_controllers[self._ic._file_nick_to_realpath['test']]
+        self.assertIn('h1', _file_ic._outstanding_requests)
+
+    def test_get_after_closing_files(self):
+        self._ic.get(object_spec="test:h1")
+        InputROOTFile.close_all_files()
+        self._ic.request([dict(object_spec="test:h1")])
+        self.assertIsInstance(self._ic.get(object_spec="test:h1"), _Hist)
+
     def test_get_expr_simple(self):
         self.assertIsInstance(self._ic.get_expr('"test:h1"'), _Hist)
         self.assertIsInstance(self._ic.get_expr('"test:h2"'), _Hist)
@@ -275,17 +407,6 @@ class TestInputROOTWithFile(unittest.TestCase):
 
     def test_get_expr_user_defined_function_memoized(self):
 
-        # helper callable with call counter
-        class FuncWithCounter:
-            def __init__(self, func):
-                self._f = func
-                self.__name__ = func.__name__
-                self._call_count = 0
-
-            def __call__(self, *args):
-                self._call_count += 1
-                return self._f(*args)
-
         # define two equivalend call-counted functions
         @FuncWithCounter
         def triple(tobject):
@@ -324,17 +445,6 @@ class TestInputROOTWithFile(unittest.TestCase):
 
     def test_get_expr_user_defined_function_memoized_clear_cache(self):
 
-        # helper callable with call counter
-        class FuncWithCounter:
-            def __init__(self, func):
-                self._f = func
-                self.__name__ = func.__name__
-                self._call_count = 0
-
-            def __call__(self, *args):
-                self._call_count += 1
-                return self._f(*args)
-
         @FuncWithCounter
         def triple_memoized(tobject):
             return 3 * tobject
@@ -353,6 +463,34 @@ class TestInputROOTWithFile(unittest.TestCase):
         # remove function to avoid side effects
         InputROOT.functions.pop('triple_memoized', None)
 
+    def test_get_expr_user_defined_function_memoized_reread_object(self):
+
+        @FuncWithCounter
+        def triple_memoized(tobject):
+            return 3 * tobject
+
+        # add the memoized function
+        InputROOT.add_function(function=triple_memoized, memoize=True)
+
+        # read the object again with a new input controller each time
+        InputROOT.clear_cache()
+        for _i in range(7):
+            _ic = InputROOT()
+            _ic.add_file('ref/test.root', nickname='test')
+            _result_expr_memoized = _ic.get_expr('triple_memoized("test:h1")')
+
+        # ensure memoized version has only been called once
+        assert triple_memoized._call_count == 1
+        self.assertEqual(InputROOT.get_cache_stats()['hits'], 6)
+
+        # different literal arguments are not taken from the cache
+        _ic.get_expr('triple_memoized(2)')
+        assert triple_memoized._call_count == 2
+
+        # remove function and clear the cache to avoid side effects
+        InputROOT.functions.pop('triple_memoized', None)
+        InputROOT.clear_cache()
+
     def test_get_expr_user_defined_function_memoized_iterable_arguments(self):
 
         # add a custom function: scale hist by a factor 3
@@ -386,6 +524,69 @@ class TestInputROOTWithFile(unittest.TestCase):
         # remove function to avoid side effects
         InputROOT.functions.pop('how_many', None)
 
+    def test_get_expr_compiled_expression_cached(self):
+        _expr = '"test:h1" * my_factor'
+        _result_1 = self._ic.get_expr(_expr, locals={'my_factor': 2})
+        self.assertIn(_expr, InputROOT._expression_cache)
+
+        # locals are looked up when evaluating the cached expression
+        _result_2 = self._ic.get_expr(_expr, locals={'my_factor': 3})
+        for _bin_1, _bin_2 in zip(_result_1, _result_2):
+            self.assertAlmostEqual(3 * _bin_1.value, 2 * _bin_2.value)
+
+    def test_get_expr_compiled_expression_function_override(self):
+        InputROOT.add_function(function=lambda tobject: 1, name='constant_function')
+        self.assertEqual(self._ic.get_expr('constant_function("test:h1")'), 1)
+
+        # functions are looked up when evaluating the cached expression
+        InputROOT.add_function(function=lambda tobject: 2, name='constant_function', override=True)
+        self.assertEqual(self._ic.get_expr('constant_function("test:h1")'), 2)
+
+        # remove function to avoid side effects
+        InputROOT.functions.pop('constant_function', None)
+
+    def test_get_expr_shared_subexpressions(self):
+
+        @FuncWithCounter
+        def triple_counted(tobject):
+            return 3 * tobject
+
+        InputROOT.add_function(function=triple_counted)
+
+        _expressions = ['triple_counted("test:h1") * 2', 'triple_counted("test:h1") + "test:h1"']
+        with self._ic.shared_subexpressions(_expressions) as _scope:
+            _result_1, _result_2 = [self._ic.get_expr(_expr) for _expr in _expressions]
+
+        # common sub-expression only evaluated once
+        self.assertEqual(triple_counted._call_count, 1)
+        self.assertEqual(_scope.n_hits, 1)
+
+        # shared result released after last use
+        self.assertEqual(_scope._results, {})
+
+        _result_direct = 3 * self._ic.get_expr('"test:h1"')
+        for _bin_1, _bin_2, _bin_direct in zip(_result_1, _result_2, _result_direct):
+            self.assertAlmostEqual(_bin_1.value, 2 * _bin_direct.value)
+            self.assertAlmostEqual(_bin_2.value, 4.0 / 3.0 * _bin_direct.value)
+
+        # no sharing outside the context
+        for _expr in _expressions:
+            self._ic.get_expr(_expr)
+        self.assertEqual(triple_counted._call_count, 3)
+
+        # remove function to avoid side effects
+        InputROOT.functions.pop('triple_counted', None)
+
+    def test_get_expr_shared_subexpressions_unhashable_arguments(self):
+        _locals = {'my_array': np.array([1.0, 2.0, 3.0])}
+        _expressions = ['my_array * 2', '(my_array * 2) + 1']
+        with self._ic.shared_subexpressions(_expressions):
+            _result_1, _result_2 = [self._ic.get_expr(_expr, locals=_locals) for _expr in _expressions]
+
+        # evaluated without sharing
+        self.assertTrue(np.array_equal(_result_1, [2.0, 4.0, 6.0]))
+        self.assertTrue(np.array_equal(_result_2, [3.0, 5.0, 7.0]))
+
     def test_get_expr_local_variables(self):
 
         with self.subTest(test_label="call_local_variable"):